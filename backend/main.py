@@ -7,20 +7,55 @@ from dotenv import load_dotenv
 load_dotenv()  # 加载 .env 文件
 import uuid
 import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime
 from typing import Optional, List
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Query, Request
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Query, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, HttpUrl
+from pydantic import BaseModel, Field, HttpUrl
 from pathlib import Path
 import json
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时预建上游连接池，关闭时统一释放"""
+    from services.http_client import http_client_pool
+    from services.grsai_service import GrsaiNanoBananaService, grsai_host_router
+    from services.grsai_task_registry import grsai_task_registry
+    from services.job_queue import job_queue
+    from services.image_ops import image_ops
+    from services.sam_executor import sam_executor
+    from services.sam_batcher import sam_encoder_batcher
+    
+    from services.local_sam_service import SAM_BACKEND
+    if SAM_BACKEND == "onnx":
+        from services.sam_onnx import check_exported
+        check_exported()  # 导出是部署步骤，缺失时启动即失败，而不是在第一个分割请求里导出
+    
+    http_client_pool.startup(GrsaiNanoBananaService.HOST_CHINA, GrsaiNanoBananaService.HOST_OVERSEAS)
+    await grsai_task_registry.start()
+    if os.getenv("GRSAI_HOST_ROUTING", "latency").lower() == "latency":
+        await grsai_host_router.start(http_client_pool.get_client)
+    job_queue.register("generate", _generate_job)
+    await job_queue.start()
+    image_ops.start()
+    yield
+    await job_queue.aclose()
+    await asyncio.to_thread(image_ops.shutdown)
+    await asyncio.to_thread(sam_executor.shutdown)
+    await asyncio.to_thread(sam_encoder_batcher.shutdown)
+    await grsai_host_router.aclose()
+    await grsai_task_registry.aclose()
+    await http_client_pool.aclose()
+
+
 app = FastAPI(
     title="NanoBanana AI",
     description="AI装修效果图生成服务 - 毛胚房秒变精装修",
-    version="0.2.0"
+    version="0.2.0",
+    lifespan=lifespan
 )
 
 # CORS
@@ -58,12 +93,89 @@ class GenerateResponse(BaseModel):
     processing_time: float = 0
     cost_rmb: float = 0
     error: Optional[str] = None
+    coalesced: bool = False  # 是否与同时提交的相同请求合并
+    cache_hit: bool = False  # 是否命中结果缓存
+    saved_cost_rmb: float = 0  # 命中缓存节省的成本
+    provider: str = "grsai"  # 实际提供服务的 provider（熔断切换后可能不是 grsai）
+    transient: bool = Field(default=False, exclude=True)  # 失败是否为上游故障（任务队列据此决定是否重试），不返回给客户端
 
 class HealthResponse(BaseModel):
     status: str
     timestamp: str
     version: str
 
+# ============ 依赖注入 ============
+
+def get_grsai_service():
+    """Grsai 服务单例（共享连接池）"""
+    from services.grsai_service import get_grsai_service as _get_grsai_service
+    
+    try:
+        return _get_grsai_service()
+    except ValueError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# 合并请求的积分策略:
+#   per_request - 每个请求都扣（默认）
+#   per_user    - 同一用户合并到同一次上游调用的重复请求只扣一次
+#   leader      - 只扣实际发起上游调用的请求
+COALESCED_CREDIT_POLICY = os.getenv("GENERATE_COALESCED_CREDIT_POLICY", "per_request")
+
+def _should_charge_credits(outcome) -> bool:
+    """按策略判断合并后的请求是否扣除积分"""
+    if COALESCED_CREDIT_POLICY == "leader":
+        return not outcome.shared
+    if COALESCED_CREDIT_POLICY == "per_user":
+        return outcome.first_for_member
+    return True
+
+# 备用 provider 按美元计费，换算成人民币记录成本
+USD_TO_RMB = float(os.getenv("USD_TO_RMB", "7.2"))
+
+def _generation_calls(generate, params: dict) -> list:
+    """
+    按 PROVIDER_FAILOVER_ORDER 构建各 provider 的生成调用，结果统一为 Grsai GenerationResult
+    
+    Replicate / ControlNet 需要 REPLICATE_API_TOKEN，未配置时只使用 Grsai
+    """
+    from services.grsai_service import GenerationResult
+    from services.ai_service import fallback_prompt
+    from services.provider_router import failover_order
+    
+    def normalise(result) -> GenerationResult:
+        return GenerationResult(
+            success=result.success,
+            task_id=result.request_id,
+            images=result.images,
+            cost=result.cost * USD_TO_RMB,
+            error=result.error,
+            transient=result.transient,
+            elapsed_seconds=result.elapsed_seconds
+        )
+    
+    # 房间类型和 prompt 随请求一起传给备用 provider（追加在风格 prompt 后）
+    custom_prompt = fallback_prompt(params.get("room_type"), params.get("prompt"))
+    
+    async def replicate():
+        from services.ai_service import ReplicateAIService
+        result = await ReplicateAIService().generate(
+            image_url=params["image_url"], style=params["style"], num_outputs=1, custom_prompt=custom_prompt
+        )
+        return normalise(result)
+    
+    async def controlnet():
+        from services.controlnet_service import ControlNetInteriorService
+        service = ControlNetInteriorService()
+        result = await asyncio.to_thread(
+            service.generate, image_url=params["image_url"], style=params["style"], custom_prompt=custom_prompt
+        )
+        return normalise(result)
+    
+    available = {"grsai": lambda: generate(**params)}
+    if os.getenv("REPLICATE_API_TOKEN"):
+        available.update(replicate=replicate, controlnet=controlnet)
+    return [(name, available[name]) for name in failover_order() if name in available]
+
 # ============ API Endpoints ============
 
 @app.get("/", response_model=HealthResponse)
@@ -79,39 +191,149 @@ async def health_check():
 async def upload_image(file: UploadFile = File(...), request: Request = None):
     """
     上传图片到服务器，返回持久化URL
-    """
-    import aiofiles
     
-    # 验证文件类型
-    allowed_types = ["image/jpeg", "image/png", "image/webp", "image/gif"]
-    if file.content_type not in allowed_types:
-        raise HTTPException(status_code=400, detail="不支持的图片格式")
+    按内容寻址存储：相同照片返回相同 URL，不重复占用磁盘；
+    格式按文件头识别（jpeg/png/webp/gif），超过 UPLOAD_MAX_BYTES 返回 413；
+    规范化与多分辨率衍生图（缩略图/1024/2K/原图）在后台生成，不阻塞上传
+    """
+    from services.upload_store import upload_store, UploadTooLarge, UnsupportedImage
+    from services.image_derivatives import derivative_store
     
-    # 生成唯一文件名
-    ext = file.filename.split(".")[-1] if "." in file.filename else "jpg"
-    filename = f"{uuid.uuid4().hex}.{ext}"
-    filepath = static_dir / "uploads" / filename
+    try:
+        stored = await upload_store.save_upload(file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    # 保存文件
-    async with aiofiles.open(filepath, 'wb') as f:
-        content = await file.read()
-        await f.write(content)
+    derivative_store.schedule(stored.filename)
     
     # 构建访问URL
     base_url = str(request.base_url).rstrip('/') if request else "http://localhost:8000"
-    image_url = f"{base_url}/static/uploads/{filename}"
+    image_url = f"{base_url}/static/uploads/{stored.filename}"
     
     return {
         "success": True,
         "url": image_url,
-        "filename": filename
+        "filename": stored.filename,
+        "content_type": stored.content_type,
+        "size": stored.size,
+        "sha256": stored.sha256,
+        "duplicate": stored.duplicate
     }
 
+def _check_credits(user_id: Optional[int]):
+    """检查用户积分（生成前）"""
+    from services.auth_service import auth_service
+    
+    if user_id:
+        user = auth_service.get_user(user_id)
+        if not user:
+            raise HTTPException(status_code=404, detail="用户不存在")
+        if user.credits < 1:
+            raise HTTPException(status_code=402, detail="积分不足，请充值")
+
+def _user_tier(user_id: Optional[int]) -> str:
+    """用户的会员等级（匿名或未知用户按免费用户调度）"""
+    from services.auth_service import auth_service, MembershipType
+    
+    user = auth_service.get_user(user_id) if user_id else None
+    return user.membership_type if user else MembershipType.FREE.value
+
+async def _run_generation(request: GenerateRequest, service) -> GenerateResponse:
+    """执行一次生成并在成功后扣除积分（同步接口与任务队列共用）"""
+    from services.auth_service import auth_service
+    from services.single_flight import generation_flights
+    from services.provider_router import provider_router
+    from services.tier_scheduler import tier_scheduler
+    
+    # 房间类型映射
+    room_names = {
+        "living_room": "客厅", "bedroom": "卧室", "master_bedroom": "主卧",
+        "kitchen": "厨房", "bathroom": "卫生间", "dining_room": "餐厅",
+        "study": "书房", "balcony": "阳台"
+    }
+    room_name = room_names.get(request.room_type, "房间")
+    prompt = f"将这个毛胚房装修成精美的{room_name}，专业室内设计效果图"
+    
+    params = dict(
+        prompt=prompt,
+        image_url=str(request.image_url),
+        style=request.style,
+        room_type=request.room_type,  # 使用专业prompt库
+        model=request.model,
+        image_size=request.image_size,
+        aspect_ratio=request.aspect_ratio
+    )
+    # 配置了回调地址时走 webHook 回调，不占用上游连接
+    generate = service.generate_with_callback if service.webhook_url else service.generate
+    tier = _user_tier(request.user_id)
+    
+    async def scheduled():
+        # 按会员等级排队获得上游名额；主 provider 熔断或失败时按顺序切换到备用 provider
+        async with tier_scheduler.slot(tier):
+            return await provider_router.run(_generation_calls(generate, params))
+    
+    # 同时到达的相同请求（双击、前端重试）只调用一次上游，按发起者的等级排队
+    outcome = await generation_flights.do(
+        service.request_key(**params),
+        scheduled,
+        member=request.user_id,
+    )
+    routed = outcome.value
+    result = routed.result
+    
+    # 生成成功后扣除积分
+    if result.success and request.user_id and _should_charge_credits(outcome):
+        auth_service.use_credits(request.user_id, 1)
+    
+    return GenerateResponse(
+        success=result.success,
+        task_id=result.task_id or str(uuid.uuid4())[:8],
+        message="生成成功" if result.success else "生成失败",
+        images=result.images or [],
+        processing_time=result.elapsed_seconds,
+        cost_rmb=result.cost,
+        error=result.error,
+        coalesced=outcome.shared,
+        cache_hit=result.cache_hit,
+        saved_cost_rmb=result.saved_cost,
+        provider=routed.provider,
+        transient=result.transient
+    )
+
+async def _generate_job(params: dict) -> dict:
+    """
+    任务队列 handler：上游故障（网络 / 超时 / 429 / 5xx、全部熔断、排队超时）抛出异常，由队列按退避重试；
+    内容审核、图片无效等请求本身的失败抛出 PermanentJobError，不重试（重试会再次计费）
+    """
+    from services.grsai_service import get_grsai_service as _get_grsai_service
+    from services.job_queue import PermanentJobError
+    from services.provider_router import CircuitOpenError, is_transient_error
+    from services.tier_scheduler import SchedulerTimeout
+    
+    try:
+        response = await _run_generation(GenerateRequest(**params), _get_grsai_service())
+    except (CircuitOpenError, SchedulerTimeout):
+        raise
+    except Exception as e:
+        if is_transient_error(e):
+            raise
+        raise PermanentJobError(str(e) or e.__class__.__name__) from e
+    if not response.success:
+        error = response.error or "生成失败"
+        if response.transient:
+            raise Exception(error)
+        raise PermanentJobError(error)
+    return response.model_dump()
+
 @app.post("/api/v1/generate", response_model=GenerateResponse)
-async def generate_design(request: GenerateRequest):
+async def generate_design(request: GenerateRequest, service=Depends(get_grsai_service)):
     """
     生成装修效果图 (同步接口，等待完成后返回)
     
+    耗时较长，推荐使用 POST /api/v1/jobs 异步提交
+    
     - **image_url**: 毛胚房图片URL (必须可公开访问)
     - **room_type**: 房间类型 (living_room, bedroom, kitchen, bathroom, etc.)
     - **style**: 风格 (nanobanana, nanobanana_A, nanobanana_B, nanobanana_C, cream_style, modern_chinese)
@@ -119,66 +341,106 @@ async def generate_design(request: GenerateRequest):
     - **image_size**: 分辨率 (1K, 2K, 4K)
     - **user_id**: 用户ID，用于积分扣除
     """
-    from services.grsai_service import GrsaiNanoBananaService
-    from services.auth_service import auth_service
+    from services.provider_router import CircuitOpenError
+    from services.tier_scheduler import SchedulerTimeout
     
-    # 检查用户积分
-    if request.user_id:
-        user = auth_service.get_user(request.user_id)
-        if not user:
-            raise HTTPException(status_code=404, detail="用户不存在")
-        if user.credits < 1:
-            raise HTTPException(status_code=402, detail="积分不足，请充值")
+    _check_credits(request.user_id)
     
     try:
-        service = GrsaiNanoBananaService()
-        
-        # 房间类型映射
-        room_names = {
-            "living_room": "客厅", "bedroom": "卧室", "master_bedroom": "主卧",
-            "kitchen": "厨房", "bathroom": "卫生间", "dining_room": "餐厅",
-            "study": "书房", "balcony": "阳台"
-        }
-        room_name = room_names.get(request.room_type, "房间")
-        prompt = f"将这个毛胚房装修成精美的{room_name}，专业室内设计效果图"
-        
-        result = await service.generate(
-            prompt=prompt,
-            image_url=str(request.image_url),
-            style=request.style,
-            room_type=request.room_type,  # 使用专业prompt库
-            model=request.model,
-            image_size=request.image_size,
-            aspect_ratio=request.aspect_ratio
-        )
-        
-        # 生成成功后扣除积分
-        if result.success and request.user_id:
-            auth_service.use_credits(request.user_id, 1)
-        
-        return GenerateResponse(
-            success=result.success,
-            task_id=result.task_id or str(uuid.uuid4())[:8],
-            message="生成成功" if result.success else "生成失败",
-            images=result.images or [],
-            processing_time=result.elapsed_seconds,
-            cost_rmb=result.cost,
-            error=result.error
-        )
+        return await _run_generation(request, service)
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=f"生成服务暂不可用: {e}")
+    except SchedulerTimeout as e:
+        raise HTTPException(status_code=503, detail=f"排队人数过多，请稍后重试: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _job_data(job) -> dict:
+    return {
+        "job_id": job.job_id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "result": job.result,
+        "error": job.error,
+        "provider": job.provider,
+        "cancel_requested": job.cancel_requested,
+        "next_run_at": job.next_run_at.isoformat() if job.next_run_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "completed_at": job.completed_at.isoformat() if job.completed_at else None,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+    }
+
+def _get_own_job(job_id: str, user_id: Optional[str]):
+    """获取任务；提交时带了 user_id 的任务只能由同一用户查看和操作"""
+    from services.job_queue import job_queue
+    
+    job = job_queue.get(job_id)
+    if not job or (job.user_id and job.user_id != user_id):
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+@app.post("/api/v1/jobs", status_code=202)
+async def submit_generate_job(request: GenerateRequest):
+    """
+    异步提交生成任务，立即返回 job_id
+    
+    参数同 /api/v1/generate；通过 GET /api/v1/jobs/{job_id} 查询状态和结果
+    """
+    from services.job_queue import job_queue
+    
+    _check_credits(request.user_id)
+    job = await job_queue.submit("generate", request.model_dump(mode="json"), user_id=request.user_id)
+    
+    return {
+        "success": True,
+        "data": {
+            "job_id": job.job_id,
+            "status": job.status,
+            "status_url": f"/api/v1/jobs/{job.job_id}"
+        }
+    }
+
+@app.get("/api/v1/jobs/{job_id}")
+async def get_generate_job(job_id: str, user_id: Optional[str] = Query(default=None)):
+    """查询生成任务状态；完成后 result 与 /api/v1/generate 的返回相同"""
+    job = _get_own_job(job_id, user_id)
+    return {"success": True, "data": _job_data(job)}
+
+@app.post("/api/v1/jobs/{job_id}/cancel")
+async def cancel_generate_job(job_id: str, user_id: Optional[str] = Query(default=None)):
+    """取消任务（排队中的立即取消，执行中的尽快停止等待）"""
+    from services.job_queue import job_queue
+    
+    _get_own_job(job_id, user_id)
+    success, message = job_queue.cancel(job_id)
+    if not success:
+        raise HTTPException(status_code=400, detail=message)
+    
+    return {"success": True, "message": message}
+
+@app.post("/api/v1/jobs/{job_id}/retry")
+async def retry_generate_job(job_id: str, user_id: Optional[str] = Query(default=None)):
+    """重新执行失败或已取消的任务"""
+    from services.job_queue import job_queue
+    
+    _get_own_job(job_id, user_id)
+    success, message = job_queue.retry(job_id)
+    if not success:
+        raise HTTPException(status_code=400, detail=message)
+    
+    return {"success": True, "message": message}
+
 
 @app.post("/api/v1/generate/stream")
-async def generate_design_stream(request: GenerateRequest):
+async def generate_design_stream(request: GenerateRequest, service=Depends(get_grsai_service)):
     """
     流式生成装修效果图 (实时返回进度)
     
-    返回 Server-Sent Events 格式的进度数据
+    返回 Server-Sent Events 格式的进度数据；排队期间每秒推送
+    {"status": "queued", "queue_position", "eta_seconds"}
     """
-    from services.grsai_service import GrsaiNanoBananaService
-    
-    service = GrsaiNanoBananaService()
+    from services.tier_scheduler import tier_scheduler
     
     room_names = {
         "living_room": "客厅", "bedroom": "卧室", "master_bedroom": "主卧",
@@ -189,7 +451,18 @@ async def generate_design_stream(request: GenerateRequest):
     prompt = f"将这个毛胚房装修成精美的{room_name}，专业室内设计效果图"
     
     async def event_generator():
+        ticket = tier_scheduler.enqueue(_user_tier(request.user_id))
         try:
+            # 按会员等级排队，推送排队位置与预计等待时间
+            while not ticket.granted:
+                queued = {
+                    "status": "queued",
+                    "queue_position": tier_scheduler.position(ticket),
+                    "eta_seconds": round(tier_scheduler.eta(ticket), 1)
+                }
+                yield f"data: {json.dumps(queued)}\n\n"
+                await tier_scheduler.wait(ticket, timeout=1.0)
+            
             async for progress in service.generate_stream(
                 prompt=prompt,
                 image_url=str(request.image_url),
@@ -209,6 +482,8 @@ async def generate_design_stream(request: GenerateRequest):
                 yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
         except Exception as e:
             yield f"data: {json.dumps({'error': str(e)})}\n\n"
+        finally:
+            tier_scheduler.release(ticket)
     
     return StreamingResponse(
         event_generator(),
@@ -216,6 +491,67 @@ async def generate_design_stream(request: GenerateRequest):
         headers={"Cache-Control": "no-cache", "Connection": "keep-alive"}
     )
 
+@app.post("/api/v1/callbacks/grsai")
+async def grsai_callback(request: Request, token: str = Query(default="")):
+    """
+    Grsai webHook 回调
+    
+    上游任务结束时回调此地址，完成登记表中等待的请求。
+    配置 GRSAI_WEBHOOK_SECRET 时校验回调地址中的 token。
+    """
+    import hmac
+    from services.grsai_task_registry import grsai_task_registry
+    
+    secret = os.getenv("GRSAI_WEBHOOK_SECRET")
+    if secret and not hmac.compare_digest(token, secret):
+        raise HTTPException(status_code=403, detail="invalid token")
+    
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid json")
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="invalid payload")
+    
+    accepted = await grsai_task_registry.complete(body)
+    return {"success": True, "accepted": accepted}
+
+@app.get("/api/v1/metrics/upstream")
+async def upstream_metrics():
+    """上游调用监控：限流器排队深度、会员调度、熔断状态、合并与缓存命中情况、任务队列、图片处理与分割推理"""
+    from services.rate_limiter import upstream_limits
+    from services.single_flight import generation_flights
+    from services.result_cache import result_cache
+    from services.grsai_task_registry import grsai_task_registry
+    from services.grsai_service import grsai_host_router
+    from services.provider_router import provider_router
+    from services.job_queue import job_queue
+    from services.tier_scheduler import tier_scheduler
+    from services.image_ops import image_ops
+    from services.sam_executor import sam_executor
+    from services.embedding_cache import sam_embedding_cache, sam_label_maps
+    from services.sam_batcher import sam_encoder_batcher
+    from services.mask_store import mask_store
+    from services.mask_compositor import segmentation_compositor
+    
+    return {
+        "hosts": grsai_host_router.stats(),
+        "scheduler": tier_scheduler.stats(),
+        "providers": provider_router.stats(),
+        "limits": upstream_limits.stats(),
+        "coalescing": generation_flights.stats(),
+        "result_cache": result_cache.stats(),
+        "callbacks": grsai_task_registry.stats(),
+        "jobs": job_queue.stats(),
+        "image_ops": image_ops.stats(),
+        "sam": sam_executor.stats(),
+        "sam_embeddings": sam_embedding_cache.stats(),
+        "sam_label_maps": sam_label_maps.stats(),
+        "sam_batching": sam_encoder_batcher.stats(),
+        "masks": mask_store.stats(),
+        "mask_compositor": segmentation_compositor.stats(),
+    }
+
 @app.get("/api/v1/styles")
 async def list_styles():
     """获取可用风格列表"""
@@ -267,6 +603,7 @@ class SegmentRequest(BaseModel):
     image_url: Optional[str] = None
     image_base64: Optional[str] = None  # 支持 base64 输入
     labels: Optional[List[str]] = None  # 要检测的标签，默认使用室内家具
+    include_label_map: bool = False  # 同时返回标签索引图（前端可在本地解析点击）
 
 class SegmentPointRequest(BaseModel):
     image_url: Optional[str] = None
@@ -277,6 +614,10 @@ class SegmentPointRequest(BaseModel):
 class SegmentedObjectResponse(BaseModel):
     label: str
     label_zh: str
+    labels: List[str] = []  # 跨标签去重合并后的全部标签（第一个为 label）
+    mask_id: str = ""  # mask 存储 ID（/api/v1/masks/{mask_id}）
+    label_index: int = 0  # 在标签索引图中的像素值（0 = 不在图中）
+    mask_rle: Optional[dict] = None  # COCO 风格 RLE：{"size": [h, w], "counts": "..."}
     mask_url: str  # 彩色 mask（用于可视化）
     inpaint_mask_url: str = ""  # 黑白 mask URL（用于 inpaint）
     inpaint_mask_base64: str = ""  # 黑白 mask base64（直接传递给 API）
@@ -288,6 +629,7 @@ class SegmentResponse(BaseModel):
     objects: List[SegmentedObjectResponse] = []
     annotated_image_url: Optional[str] = None
     combined_mask_url: Optional[str] = None
+    label_map_url: Optional[str] = None  # 标签索引图（灰度 PNG，像素值 = 物体的 label_index，0 = 背景）
     processing_time: float = 0
     error: Optional[str] = None
 
@@ -303,16 +645,19 @@ async def segment_furniture(request: SegmentRequest):
     使用本地 SAM 模型，无需 API 费用
     """
     from services.local_sam_service import LocalSAMService
+    from services.sam_executor import sam_executor, InferenceOverloaded
     
     if not request.image_url and not request.image_base64:
         raise HTTPException(status_code=400, detail="需要提供 image_url 或 image_base64")
     
     try:
         service = LocalSAMService()
-        result = service.segment_furniture(
+        result = await sam_executor.run(
+            service.segment_furniture,
             image_url=request.image_url,
             image_base64=request.image_base64,
-            labels=request.labels
+            labels=request.labels,
+            include_label_map=request.include_label_map
         )
         
         objects = []
@@ -320,6 +665,10 @@ async def segment_furniture(request: SegmentRequest):
             objects.append(SegmentedObjectResponse(
                 label=obj.label,
                 label_zh=service.get_label_zh(obj.label),
+                labels=obj.labels,
+                mask_id=obj.mask_id,
+                label_index=obj.label_index,
+                mask_rle=obj.mask_rle,
                 mask_url=obj.mask_url,
                 inpaint_mask_url=obj.inpaint_mask_url,
                 inpaint_mask_base64=obj.inpaint_mask_base64,
@@ -332,9 +681,12 @@ async def segment_furniture(request: SegmentRequest):
             objects=objects,
             annotated_image_url=result.annotated_image_url,
             combined_mask_url=result.combined_mask_url,
+            label_map_url=result.label_map_url,
             processing_time=result.elapsed_seconds,
             error=result.error
         )
+    except InferenceOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -345,24 +697,35 @@ async def segment_at_point(request: SegmentPointRequest):
     点击分割 - 在指定坐标位置分割物体
     
     用户点击图片某个位置，返回该位置物体的 mask
-    使用本地 SAM 模型
+    这张图片已经做过家具分割时直接查标签索引图返回（不排队、不跑模型），
+    否则使用本地 SAM 模型
     """
     from services.local_sam_service import LocalSAMService
+    from services.sam_executor import sam_executor, InferenceOverloaded
     
     try:
         service = LocalSAMService()
-        result = service.segment_at_point(
-            image_url=request.image_url,
-            image_base64=request.image_base64,
-            x=request.x,
-            y=request.y
+        result = await asyncio.to_thread(
+            service.lookup_point, request.image_url, request.image_base64, request.x, request.y
         )
+        if result is None:
+            result = await sam_executor.run(
+                service.segment_at_point,
+                image_url=request.image_url,
+                image_base64=request.image_base64,
+                x=request.x,
+                y=request.y
+            )
         
         objects = []
         for obj in result.objects:
             objects.append(SegmentedObjectResponse(
                 label=obj.label,
                 label_zh=obj.label_zh or "选中区域",
+                labels=obj.labels,
+                mask_id=obj.mask_id,
+                label_index=obj.label_index,
+                mask_rle=obj.mask_rle,
                 mask_url=obj.mask_url,
                 inpaint_mask_url=obj.inpaint_mask_url or "",
                 inpaint_mask_base64=obj.inpaint_mask_base64 or "",
@@ -377,10 +740,43 @@ async def segment_at_point(request: SegmentPointRequest):
             processing_time=result.elapsed_seconds,
             error=result.error
         )
+    except InferenceOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/v1/masks/{mask_id}")
+async def get_mask(
+    mask_id: str,
+    format: str = Query("color", description="color | bw | base64 | rle"),
+    size: str = Query("work", description="work（分割工作分辨率）| full（原图分辨率）"),
+):
+    """
+    按需渲染分割 mask
+    
+    color: 彩色半透明 PNG（可视化），bw: 黑白 PNG（inpaint），base64: 黑白 PNG 的 data URL，
+    rle: COCO 风格 RLE 的 JSON
+    默认返回分割时的工作分辨率（SAM_WORK_SIZE），size=full 时放大到原图分辨率
+    mask ID 为内容哈希，渲染结果不会变化，可长期缓存
+    """
+    from services.mask_store import mask_store, MaskNotFound
+    
+    if size not in ("work", "full"):
+        raise HTTPException(status_code=400, detail=f"不支持的尺寸: {size}")
+    try:
+        content, media_type = await asyncio.to_thread(mask_store.render, mask_id, format, size == "full")
+    except MaskNotFound:
+        raise HTTPException(status_code=404, detail="mask 不存在")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(
+        content=content,
+        media_type=media_type,
+        headers={"Cache-Control": "public, max-age=31536000, immutable"},
+    )
+
+
 # ============ 局部重绘 API ============
 
 class InpaintRequest(BaseModel):
@@ -398,192 +794,45 @@ class InpaintResponse(BaseModel):
     processing_time: float = 0
     cost: float = 0
     error: Optional[str] = None
+    cache_hit: bool = False
 
 
 @app.post("/api/v1/inpaint", response_model=InpaintResponse)
-async def inpaint_region(request: InpaintRequest):
+async def inpaint_region(request: InpaintRequest, service=Depends(get_grsai_service)):
     """
     局部重绘 - 使用 NanoBanana Inpaint 对选中区域进行风格替换
     
     使用 mask 指定要替换的区域，AI 会保持其他区域不变，只对 mask 区域进行重绘
     """
-    from services.grsai_service import GrsaiNanoBananaService
-    import base64
-    from PIL import Image
-    import io
+    from services.image_derivatives import derivative_store
+    from services.image_ops import image_ops, prepare_inpaint_image, prepare_inpaint_mask, read_file_base64
     
     try:
-        # 辅助函数：压缩图片并转base64
-        def compress_image_base64(data: str, max_size: int = 1024) -> str:
-            """压缩图片到指定最大尺寸"""
-            if not data.startswith("data:"):
-                return data
-            
-            # 提取base64数据
-            header, b64_data = data.split(",", 1)
-            # 清理 base64 数据：移除空白字符，处理 URL 安全编码
-            b64_data = b64_data.strip().replace(' ', '+').replace('\n', '').replace('\r', '')
-            # 修复 base64 padding（长度必须是4的倍数）
-            missing_padding = len(b64_data) % 4
-            if missing_padding:
-                b64_data += '=' * (4 - missing_padding)
-            
-            try:
-                img_bytes = base64.b64decode(b64_data)
-            except Exception as e:
-                print(f"[Inpaint] base64解码失败: {e}, 数据前100字符: {b64_data[:100]}")
-                raise
-            
-            # 打开并压缩
-            try:
-                img = Image.open(io.BytesIO(img_bytes))
-            except Exception as e:
-                print(f"[Inpaint] PIL无法识别图片: {e}, 数据长度: {len(img_bytes)}, 前16字节: {img_bytes[:16]}")
-                raise
-            
-            # 计算缩放比例
-            ratio = min(max_size / img.width, max_size / img.height, 1.0)
-            if ratio < 1.0:
-                new_size = (int(img.width * ratio), int(img.height * ratio))
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
-            
-            # 转回base64
-            buffer = io.BytesIO()
-            img_format = "PNG" if "png" in header else "JPEG"
-            img.save(buffer, format=img_format, quality=85)
-            compressed_b64 = base64.b64encode(buffer.getvalue()).decode()
-            
-            return f"{header},{compressed_b64}"
-        
-        # 辅助函数：将本地URL转为base64
-        def url_to_base64(url: str, prefix: str = "data:image/png;base64,") -> str:
-            # 如果已经是 base64，直接返回
-            if url.startswith("data:"):
-                return url
-            
-            local_path = None
-            # 处理相对路径 /static/...
-            if url.startswith("/static/"):
-                local_path = url.lstrip("/")  # 去掉开头的 /
-            # 处理完整 URL
-            elif "localhost" in url or "127.0.0.1" in url:
-                local_path = url.replace("http://localhost:8000/static/", "static/")
-                local_path = local_path.replace("http://127.0.0.1:8000/static/", "static/")
-                local_path = local_path.replace("http://localhost:3000/static/", "static/")
-            
-            if local_path:
-                full_path = Path(__file__).parent / local_path
-                print(f"[url_to_base64] 转换路径: {url} -> {full_path}")
-                if full_path.exists():
-                    with open(full_path, "rb") as f:
-                        return prefix + base64.b64encode(f.read()).decode()
-                else:
-                    print(f"[url_to_base64] 文件不存在: {full_path}")
-                    # 尝试其他可能的路径
-                    alt_paths = [
-                        Path(__file__).parent / "static" / "masks" / Path(local_path).name,
-                        Path(__file__).parent / local_path.replace("static/", ""),
-                    ]
-                    for alt_path in alt_paths:
-                        print(f"[url_to_base64] 尝试备用路径: {alt_path}")
-                        if alt_path.exists():
-                            with open(alt_path, "rb") as f:
-                                return prefix + base64.b64encode(f.read()).decode()
-            
-            print(f"[url_to_base64] 无法找到文件: {url}")
-            return ""  # 返回空字符串表示失败
-        
-        # 合并多个 mask 的函数
-        def merge_masks(mask_data_list: List[str], max_size: int = 1024) -> str:
-            """合并多个黑白 mask，白色区域叠加"""
-            if len(mask_data_list) == 1:
-                return mask_data_list[0]
-            
-            merged = None
-            for mask_data in mask_data_list:
-                # 解析 base64
-                if mask_data.startswith("data:"):
-                    _, b64 = mask_data.split(",", 1)
-                    b64 = b64.strip().replace(' ', '+').replace('\n', '').replace('\r', '')
-                    missing = len(b64) % 4
-                    if missing:
-                        b64 += '=' * (4 - missing)
-                    img_bytes = base64.b64decode(b64)
-                    img = Image.open(io.BytesIO(img_bytes)).convert('L')
-                else:
-                    continue
-                
-                # 压缩到统一尺寸
-                ratio = min(max_size / img.width, max_size / img.height, 1.0)
-                if ratio < 1.0:
-                    img = img.resize((int(img.width * ratio), int(img.height * ratio)), Image.Resampling.LANCZOS)
-                
-                import numpy as np
-                arr = np.array(img)
-                
-                if merged is None:
-                    merged = arr
-                else:
-                    # 如果尺寸不同，调整
-                    if merged.shape != arr.shape:
-                        img = img.resize((merged.shape[1], merged.shape[0]), Image.Resampling.LANCZOS)
-                        arr = np.array(img)
-                    # 叠加白色区域（取最大值）
-                    merged = np.maximum(merged, arr)
-            
-            if merged is None:
-                return mask_data_list[0]
-            
-            # 转回 base64
-            result_img = Image.fromarray(merged, mode='L')
-            buffer = io.BytesIO()
-            result_img.save(buffer, format='PNG')
-            return f"data:image/png;base64,{base64.b64encode(buffer.getvalue()).decode()}"
-        
         # 准备 mask 和 furniture_type 列表
         mask_list = request.mask_urls if request.mask_urls and len(request.mask_urls) > 0 else [request.mask_url]
         furniture_list = request.furniture_types if request.furniture_types and len(request.furniture_types) > 0 else [request.furniture_type]
         
         print(f"[Inpaint] 物品数量: {len(mask_list)}, 家具类型: {furniture_list}")
-        print(f"[Inpaint] 原始 mask_list: {[m[:80] if len(str(m)) > 80 else str(m) for m in mask_list]}")
-        
-        # 转换所有 mask 为 base64
-        processed_masks = []
-        for m in mask_list:
-            m = str(m)
-            print(f"[Inpaint] 处理 mask: {m[:100]}...")
-            if not m.startswith("data:"):
-                converted = url_to_base64(m)
-                print(f"[Inpaint] 转换后: {converted[:100]}...")
-                m = converted
-            if m.startswith("data:"):
-                processed_masks.append(m)
-            else:
-                print(f"[Inpaint] 警告: mask 转换失败，跳过: {m[:50]}")
         
-        # 合并所有 mask（一次 API 调用）
-        if not processed_masks:
+        # 图片解码/缩放/合并/编码都在图片处理执行器中完成，不阻塞事件循环
+        # mask：URL 转 base64 -> 合并所有 mask（一次 API 调用）-> 压缩
+        merged_mask = await image_ops.run("inpaint_mask", prepare_inpaint_mask, [str(m) for m in mask_list], 1024)
+        if not merged_mask:
             raise HTTPException(status_code=400, detail="没有有效的 mask 数据")
         
-        merged_mask = merge_masks(processed_masks)
-        print(f"[Inpaint] 合并后 mask: {merged_mask[:100]}...")
-        
-        if not merged_mask.startswith("data:"):
-            raise HTTPException(status_code=400, detail="mask 合并失败")
-        
-        merged_mask = compress_image_base64(merged_mask, max_size=1024)
-        
-        # 处理 image_url
+        # 处理 image_url：上传图片直接使用 1024 工作副本（已规范化），不再解码原图
         image_url = str(request.image_url)
-        if not image_url.startswith("data:"):
-            image_url = url_to_base64(image_url, "data:image/jpeg;base64,")
-        image_url = compress_image_base64(image_url, max_size=1024)
+        work_path = await asyncio.to_thread(derivative_store.resolve, image_url, "work")
+        if work_path is not None:
+            prefix = "data:image/png;base64," if work_path.suffix == ".png" else "data:image/jpeg;base64,"
+            image_url = await image_ops.run("inpaint_read_work", read_file_base64, str(work_path), prefix)
+        else:
+            image_url = await image_ops.run("inpaint_image", prepare_inpaint_image, image_url, 1024)
         
         # 合并所有家具类型描述
         furniture_desc = ", ".join([f for f in furniture_list if f])
         print(f"[Inpaint] 合并后家具描述: {furniture_desc}")
         
-        service = GrsaiNanoBananaService()
         result = await service.inpaint(
             image_url=image_url,
             mask_url=merged_mask,
@@ -597,7 +846,8 @@ async def inpaint_region(request: InpaintRequest):
             image_url=result.images[0] if result.images else None,
             processing_time=result.elapsed_seconds,
             cost=result.cost,
-            error=result.error
+            error=result.error,
+            cache_hit=result.cache_hit
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1176,6 +1426,7 @@ async def get_generations(
             "generation_id": r.generation_id,
             "generation_type": r.generation_type,
             "input_image_url": r.input_image_url,
+            "input_thumbnail_url": r.input_thumbnail_url,
             "output_image_url": r.output_image_url,
             "style": r.style,
             "room_type": r.room_type,
@@ -1201,6 +1452,7 @@ async def get_generation(generation_id: str, user_id: str = Query(...)):
             "generation_id": info.generation_id,
             "generation_type": info.generation_type,
             "input_image_url": info.input_image_url,
+            "input_thumbnail_url": info.input_thumbnail_url,
             "output_image_url": info.output_image_url,
             "style": info.style,
             "room_type": info.room_type,
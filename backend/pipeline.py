@@ -21,6 +21,7 @@ class PipelineResult:
     processing_time: float = 0
     cost_rmb: float = 0          # 成本(人民币)
     error: str = None
+    provider: str = None         # 实际提供服务的 provider
 
 class NanoBananaPipeline:
     """
@@ -29,11 +30,11 @@ class NanoBananaPipeline:
     流程:
     1. 接收毛胚房图片URL
     2. [可选] 自动识别房间类型
-    3. 调用AI API生成效果图 (Grsai或Replicate)
+    3. 调用AI API生成效果图 (Grsai或Replicate)，主 provider 熔断或失败时自动切换
     4. 返回结果(带水印预览)
     """
     
-    def __init__(self, provider: str = None, api_key: str = None):
+    def __init__(self, provider: str = None, api_key: str = None, failover: bool = True):
         # 支持的 provider: grsai, replicate, controlnet (推荐，保持结构)
         self.provider = provider or os.getenv("AI_PROVIDER", "controlnet")
         self.api_key = api_key
@@ -42,6 +43,25 @@ class NanoBananaPipeline:
             self.api_key = api_key or os.getenv("GRSAI_API_KEY")
         else:
             self.api_key = api_key or os.getenv("REPLICATE_API_TOKEN")
+        self.failover = failover
+    
+    def _provider_calls(self, image_url: str, room_type: str, style: str, num_outputs: int) -> list:
+        """主 provider 在前，其余按 PROVIDER_FAILOVER_ORDER 排列；备用 provider 使用环境变量中的凭证"""
+        from services.provider_router import failover_order
+        
+        calls = {
+            "grsai": lambda: self._call_grsai(image_url, room_type, style),
+            "replicate": lambda: self._call_replicate(image_url, room_type, style, num_outputs),
+            "controlnet": lambda: self._call_controlnet(image_url, room_type, style),
+        }
+        if not self.failover:
+            return [(self.provider, calls.get(self.provider, calls["replicate"]))]
+        # 没有配置凭证的备用 provider 不参与切换
+        credentials = {"grsai": "GRSAI_API_KEY", "replicate": "REPLICATE_API_TOKEN", "controlnet": "REPLICATE_API_TOKEN"}
+        return [
+            (name, calls[name]) for name in failover_order(self.provider)
+            if name in calls and (name == self.provider or os.getenv(credentials[name]))
+        ]
         
     def run(
         self,
@@ -70,24 +90,22 @@ class NanoBananaPipeline:
         print(f"[{task_id}] Room: {room_type}, Style: {style}")
         
         try:
-            # Step 1: 调用AI服务
-            if self.provider == "grsai":
-                result = self._call_grsai(image_url, room_type, style)
-            elif self.provider == "controlnet":
-                result = self._call_controlnet(image_url, style)
-            else:
-                result = self._call_replicate(image_url, style, num_outputs)
+            # Step 1: 调用AI服务（熔断 / 失败时切换）
+            from services.provider_router import provider_router
+            routed = provider_router.run_sync(self._provider_calls(image_url, room_type, style, num_outputs))
+            result = routed.result
             
             if not result.success:
                 return PipelineResult(
                     success=False,
                     task_id=task_id,
                     error=result.error,
-                    processing_time=time.time() - start_time
+                    processing_time=time.time() - start_time,
+                    provider=routed.provider
                 )
             
             # Step 2: 处理结果
-            print(f"[{task_id}] Generation completed! Got {len(result.images)} images")
+            print(f"[{task_id}] Generation completed by {routed.provider}! Got {len(result.images)} images")
             
             processing_time = time.time() - start_time
             
@@ -97,7 +115,8 @@ class NanoBananaPipeline:
                 preview_images=result.images,  # baseline先不加水印
                 hd_images=result.images,
                 processing_time=processing_time,
-                cost_rmb=result.cost
+                cost_rmb=result.cost,
+                provider=routed.provider
             )
             
         except Exception as e:
@@ -126,7 +145,8 @@ class NanoBananaPipeline:
         room_name = room_names.get(room_type, "房间")
         
         print(f"[Grsai] Calling Nano Banana API...")
-        service = GrsaiNanoBananaServiceSync(api_key=self.api_key)
+        api_key = self.api_key if self.provider == "grsai" else None
+        service = GrsaiNanoBananaServiceSync(api_key=api_key)
         
         prompt = f"将这个毛胚房装修成精美的{room_name}，专业室内设计效果图"
         result = service.generate(
@@ -138,17 +158,29 @@ class NanoBananaPipeline:
         )
         return result
     
-    def _call_replicate(self, image_url: str, style: str, num_outputs: int):
+    def _call_replicate(self, image_url: str, room_type: str, style: str, num_outputs: int):
         """调用Replicate API"""
-        from services.ai_service import ReplicateAIServiceSync
+        from services.ai_service import ReplicateAIServiceSync, fallback_prompt
         
         print(f"[Replicate] Calling API...")
-        service = ReplicateAIServiceSync(api_token=self.api_key)
+        api_key = self.api_key if self.provider == "replicate" else None
+        service = ReplicateAIServiceSync(api_token=api_key)
         return service.generate(
             image_url=image_url,
             style=style,
-            num_outputs=num_outputs
+            num_outputs=num_outputs,
+            custom_prompt=fallback_prompt(room_type)
         )
+    
+    def _call_controlnet(self, image_url: str, room_type: str, style: str):
+        """调用 ControlNet 室内设计模型 (保持房间结构)"""
+        from services.ai_service import fallback_prompt
+        from services.controlnet_service import ControlNetInteriorService
+        
+        print(f"[ControlNet] Calling API...")
+        api_key = self.api_key if self.provider == "controlnet" else None
+        service = ControlNetInteriorService(api_token=api_key)
+        return service.generate(image_url=image_url, style=style, custom_prompt=fallback_prompt(room_type))
 
 def test_pipeline():
     """测试Pipeline"""
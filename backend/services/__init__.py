@@ -8,4 +8,6 @@ from .grsai_service import (
     GenerationResult,
     GenerationProgress,
     generate_interior_design,
+    get_grsai_service,
 )
+from .http_client import HTTPClientPool, HTTPPoolConfig, http_client_pool
@@ -9,6 +9,9 @@ import httpx
 from typing import Optional, Dict, Any, List
 from dataclasses import dataclass
 
+from services.rate_limiter import upstream_limits
+from services.provider_router import is_transient_error
+
 @dataclass
 class GenerationResult:
     success: bool
@@ -16,8 +19,24 @@ class GenerationResult:
     request_id: str = None
     cost: float = 0.0
     error: str = None
+    transient: bool = False  # 失败是否为上游故障（网络 / 超时 / 429 / 5xx），只有这类失败才切换 provider
     elapsed_seconds: float = 0.0
 
+def fallback_prompt(room_type: str = None, prompt: str = None) -> str:
+    """
+    备用 provider（Replicate / ControlNet）追加在风格 prompt 后的请求描述
+
+    备用模型只认英文风格 prompt，房间类型换成英文描述，原请求的 prompt 原样附上，保证切换后仍是同一个请求
+    """
+    from prompts import ROOM_TYPES
+
+    parts = []
+    if room_type:
+        parts.append(f"{ROOM_TYPES.get(room_type, {}).get('name_en', room_type.replace('_', ' '))} interior")
+    if prompt:
+        parts.append(prompt)
+    return ", ".join(parts)
+
 class ReplicateAIService:
     """
     Replicate API 服务
@@ -65,7 +84,8 @@ class ReplicateAIService:
         style: str = "nanobanana",
         num_outputs: int = 4,
         guidance_scale: float = 7.5,
-        num_inference_steps: int = 50
+        num_inference_steps: int = 50,
+        custom_prompt: str = None
     ) -> GenerationResult:
         """
         生成室内设计效果图
@@ -76,6 +96,7 @@ class ReplicateAIService:
             num_outputs: 生成图片数量 (1-4)
             guidance_scale: 引导强度
             num_inference_steps: 推理步数
+            custom_prompt: 自定义提示词（会追加到风格prompt后）
         
         Returns:
             GenerationResult
@@ -84,13 +105,16 @@ class ReplicateAIService:
         
         # 获取风格prompt
         style_config = self.STYLE_PROMPTS.get(style, self.STYLE_PROMPTS["nanobanana"])
+        prompt = style_config["prompt"]
+        if custom_prompt:
+            prompt = f"{prompt}, {custom_prompt}"
         
         # 构建请求
         payload = {
             "version": "latest",
             "input": {
                 "image": image_url,
-                "prompt": style_config["prompt"],
+                "prompt": prompt,
                 "negative_prompt": style_config["negative_prompt"],
                 "num_outputs": min(num_outputs, 4),
                 "guidance_scale": guidance_scale,
@@ -101,34 +125,36 @@ class ReplicateAIService:
         }
         
         try:
-            async with httpx.AsyncClient(timeout=120) as client:
-                # 创建预测
-                response = await client.post(
-                    f"{self.BASE_URL}/models/{self.MODEL}/predictions",
-                    headers=self.headers,
-                    json=payload
-                )
-                response.raise_for_status()
-                prediction = response.json()
-                prediction_id = prediction["id"]
+            async with upstream_limits.limit("replicate", self.MODEL):
+                async with httpx.AsyncClient(timeout=120) as client:
+                    # 创建预测
+                    response = await client.post(
+                        f"{self.BASE_URL}/models/{self.MODEL}/predictions",
+                        headers=self.headers,
+                        json=payload
+                    )
+                    response.raise_for_status()
+                    prediction = response.json()
+                    prediction_id = prediction["id"]
                 
-                # 轮询等待结果
-                images = await self._poll_prediction(client, prediction_id)
+                    # 轮询等待结果
+                    images = await self._poll_prediction(client, prediction_id)
                 
-                elapsed = time.time() - start_time
-                return GenerationResult(
-                    success=True,
-                    images=images,
-                    request_id=prediction_id,
-                    cost=self.COST_PER_RUN * num_outputs,
-                    elapsed_seconds=elapsed
-                )
+                    elapsed = time.time() - start_time
+                    return GenerationResult(
+                        success=True,
+                        images=images,
+                        request_id=prediction_id,
+                        cost=self.COST_PER_RUN * num_outputs,
+                        elapsed_seconds=elapsed
+                    )
                 
         except Exception as e:
             elapsed = time.time() - start_time
             return GenerationResult(
                 success=False,
                 error=str(e),
+                transient=is_transient_error(e),
                 elapsed_seconds=elapsed
             )
     
@@ -160,7 +186,7 @@ class ReplicateAIService:
             await asyncio.sleep(poll_interval)
             waited += poll_interval
         
-        raise Exception(f"Prediction timed out after {max_wait}s")
+        raise TimeoutError(f"Prediction timed out after {max_wait}s")
 
 # 同步版本（方便测试）
 class ReplicateAIServiceSync:
@@ -186,19 +212,23 @@ class ReplicateAIServiceSync:
         self,
         image_url: str,
         style: str = "nanobanana",
-        num_outputs: int = 4
+        num_outputs: int = 4,
+        custom_prompt: str = None
     ) -> GenerationResult:
         """同步生成"""
         import requests
         
         start_time = time.time()
         style_config = self.STYLE_PROMPTS.get(style, self.STYLE_PROMPTS["nanobanana"])
+        prompt = style_config["prompt"]
+        if custom_prompt:
+            prompt = f"{prompt}, {custom_prompt}"
         
         payload = {
             "version": "latest",
             "input": {
                 "image": image_url,
-                "prompt": style_config["prompt"],
+                "prompt": prompt,
                 "negative_prompt": style_config["negative_prompt"],
                 "num_outputs": min(num_outputs, 4),
                 "width": 1024,
@@ -207,32 +237,34 @@ class ReplicateAIServiceSync:
         }
         
         try:
-            # 创建预测
-            resp = requests.post(
-                f"{self.BASE_URL}/models/{self.MODEL}/predictions",
-                headers=self.headers,
-                json=payload,
-                timeout=30
-            )
-            resp.raise_for_status()
-            prediction = resp.json()
-            prediction_id = prediction["id"]
+            with upstream_limits.limit_sync("replicate", self.MODEL):
+                # 创建预测
+                resp = requests.post(
+                    f"{self.BASE_URL}/models/{self.MODEL}/predictions",
+                    headers=self.headers,
+                    json=payload,
+                    timeout=30
+                )
+                resp.raise_for_status()
+                prediction = resp.json()
+                prediction_id = prediction["id"]
             
-            # 轮询
-            images = self._poll_prediction(prediction_id)
+                # 轮询
+                images = self._poll_prediction(prediction_id)
             
-            elapsed = time.time() - start_time
-            return GenerationResult(
-                success=True,
-                images=images,
-                request_id=prediction_id,
-                cost=self.COST_PER_RUN * num_outputs,
-                elapsed_seconds=elapsed
-            )
+                elapsed = time.time() - start_time
+                return GenerationResult(
+                    success=True,
+                    images=images,
+                    request_id=prediction_id,
+                    cost=self.COST_PER_RUN * num_outputs,
+                    elapsed_seconds=elapsed
+                )
         except Exception as e:
             return GenerationResult(
                 success=False,
                 error=str(e),
+                transient=is_transient_error(e),
                 elapsed_seconds=time.time() - start_time
             )
     
@@ -256,6 +288,6 @@ class ReplicateAIServiceSync:
             t.sleep(2)
             waited += 2
         
-        raise Exception("Timeout")
+        raise TimeoutError("Timeout")
 
 import asyncio  # 放在文件末尾避免循环导入
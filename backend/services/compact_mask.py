@@ -0,0 +1,242 @@
+"""
+紧凑 mask 表示
+
+按行打包的位图（每像素 1 bit），支持直接在打包字节上做集合运算、面积、包围框，以及 COCO 风格 RLE 编解码
+"""
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+# 每个字节中 1 的个数（numpy < 2.0 没有 bitwise_count 时查表）
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(bits: np.ndarray) -> np.ndarray:
+    """逐元素 popcount（uint8 / uint64）"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits)
+    if bits.dtype != np.uint8:
+        bits = bits.view(np.uint8).reshape(*bits.shape[:-1], -1)
+    return _POPCOUNT[bits]
+
+
+@dataclass(frozen=True, eq=False)
+class CompactMask:
+    """按行打包的二值 mask：bits 形状为 (height, ceil(width / 8))，行尾填充位恒为 0"""
+    bits: np.ndarray
+    height: int
+    width: int
+
+    # ---------- 构造 / 还原 ----------
+
+    @classmethod
+    def from_array(cls, mask: np.ndarray) -> "CompactMask":
+        mask = np.asarray(mask, dtype=bool)
+        if mask.ndim != 2:
+            raise ValueError(f"mask 必须是二维数组，实际形状 {mask.shape}")
+        return cls(np.packbits(mask, axis=1), mask.shape[0], mask.shape[1])
+
+    @classmethod
+    def empty(cls, height: int, width: int) -> "CompactMask":
+        return cls(np.zeros((height, (width + 7) // 8), dtype=np.uint8), height, width)
+
+    def to_array(self) -> np.ndarray:
+        return np.unpackbits(self.bits, axis=1, count=self.width).astype(bool)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.height, self.width
+
+    @property
+    def nbytes(self) -> int:
+        return self.bits.nbytes
+
+    # ---------- 集合运算（直接在打包字节上计算）----------
+
+    def _check(self, other: "CompactMask"):
+        if self.shape != other.shape:
+            raise ValueError(f"mask 尺寸不一致: {self.shape} vs {other.shape}")
+
+    def __or__(self, other: "CompactMask") -> "CompactMask":
+        self._check(other)
+        return CompactMask(self.bits | other.bits, self.height, self.width)
+
+    def __and__(self, other: "CompactMask") -> "CompactMask":
+        self._check(other)
+        return CompactMask(self.bits & other.bits, self.height, self.width)
+
+    def __sub__(self, other: "CompactMask") -> "CompactMask":
+        self._check(other)
+        return CompactMask(self.bits & ~other.bits, self.height, self.width)
+
+    def __invert__(self) -> "CompactMask":
+        return CompactMask(~self.bits & self._row_mask(), self.height, self.width)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, CompactMask) and self.shape == other.shape and np.array_equal(self.bits, other.bits)
+
+    def _row_mask(self) -> np.ndarray:
+        """每行有效位为 1、填充位为 0 的字节模板"""
+        return np.packbits(np.ones((1, self.width), dtype=bool), axis=1)
+
+    # ---------- 统计 ----------
+
+    def area(self) -> int:
+        return int(_popcount(self.bits).sum(dtype=np.int64))
+
+    def iou(self, other: "CompactMask") -> float:
+        union = (self | other).area()
+        return (self & other).area() / union if union else 0.0
+
+    def bbox(self) -> Optional[List[int]]:
+        """[x1, y1, x2, y2]（右下角不包含）；空 mask 返回 None"""
+        rows = np.flatnonzero(self.bits.any(axis=1))
+        if rows.size == 0:
+            return None
+        cols = np.flatnonzero(np.unpackbits(np.bitwise_or.reduce(self.bits, axis=0), count=self.width))
+        return [int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1]
+
+    # ---------- 几何 ----------
+
+    def resize(self, height: int, width: int) -> "CompactMask":
+        """最近邻缩放（行选择在打包形式上完成，列选择需要解包）"""
+        if (height, width) == self.shape:
+            return self
+        rows = np.minimum((np.arange(height) + 0.5) * self.height / height, self.height - 1).astype(np.intp)
+        cols = np.minimum((np.arange(width) + 0.5) * self.width / width, self.width - 1).astype(np.intp)
+        picked = np.unpackbits(self.bits[rows], axis=1, count=self.width)[:, cols]
+        return CompactMask(np.packbits(picked, axis=1), height, width)
+
+    def upsample(self, height: int, width: int) -> "CompactMask":
+        """
+        放大到更高分辨率，只在包围框内计算并平滑边缘
+
+        包围框（外扩 2 像素）内的区域双线性放大后做一次半径为放大倍数一半的高斯模糊再取 0.5 阈值，
+        消除最近邻放大的锯齿；框外保持为空，耗时与物体大小而不是整图大小成正比
+        """
+        if (height, width) == self.shape:
+            return self
+        box = self.bbox()
+        if box is None:
+            return CompactMask.empty(height, width)
+        from PIL import Image, ImageFilter
+
+        sx, sy = width / self.width, height / self.height
+        x0, y0 = max(0, box[0] - 2), max(0, box[1] - 2)
+        x1, y1 = min(self.width, box[2] + 2), min(self.height, box[3] + 2)
+        tx0, ty0 = int(x0 * sx), int(y0 * sy)
+        tx1, ty1 = min(width, round(x1 * sx)), min(height, round(y1 * sy))
+
+        crop = np.unpackbits(self.bits[y0:y1], axis=1, count=self.width)[:, x0:x1] * np.uint8(255)
+        image = Image.fromarray(crop, mode="L").resize((tx1 - tx0, ty1 - ty0), Image.Resampling.BILINEAR)
+        radius = max(sx, sy) / 2
+        if radius > 0.5:
+            image = image.filter(ImageFilter.GaussianBlur(radius))
+
+        full = np.zeros((height, width), dtype=bool)
+        full[ty0:ty1, tx0:tx1] = np.asarray(image) >= 128
+        return CompactMask.from_array(full)
+
+    # ---------- COCO RLE ----------
+
+    def rle_counts(self) -> List[int]:
+        """列优先游程长度，从 0 的游程开始（与 COCO 一致）"""
+        flat = self.to_array().ravel(order="F")
+        if flat.size == 0:
+            return []
+        changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+        bounds = np.concatenate(([0], changes, [flat.size]))
+        counts = np.diff(bounds).tolist()
+        return ([0] + counts) if flat[0] else counts
+
+    def to_rle(self) -> dict:
+        return {"size": [self.height, self.width], "counts": _encode_counts(self.rle_counts())}
+
+    @classmethod
+    def from_rle(cls, rle: dict) -> "CompactMask":
+        height, width = (int(v) for v in rle["size"])
+        counts = rle["counts"]
+        if isinstance(counts, str):
+            counts = _decode_counts(counts)
+        values = np.zeros(len(counts), dtype=bool)
+        values[1::2] = True
+        flat = np.repeat(values, counts)
+        if flat.size != height * width:
+            raise ValueError(f"RLE 长度 {flat.size} 与尺寸 {height}x{width} 不符")
+        return cls.from_array(flat.reshape((height, width), order="F"))
+
+
+def pairwise_iou(masks: List[CompactMask], boxes: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    所有 mask 两两之间的 IoU（N x N）
+
+    打包位图摊平成 (N, 字节数) 并按 8 字节对齐后视为 uint64，每个 mask 与其余 mask 的交集
+    一次按位与 + popcount 算完；包围框不相交的组合直接跳过
+    """
+    n = len(masks)
+    iou = np.eye(n, dtype=np.float32)
+    if n < 2:
+        return iou
+    for mask in masks[1:]:
+        masks[0]._check(mask)
+
+    flat = np.stack([m.bits.reshape(-1) for m in masks])
+    pad = -flat.shape[1] % 8
+    if pad:
+        flat = np.pad(flat, ((0, 0), (0, pad)))
+    words = flat.view(np.uint64)
+    areas = _popcount(words).sum(axis=1, dtype=np.int64)
+
+    if boxes is None:
+        boxes = np.array([m.bbox() or [0, 0, 0, 0] for m in masks], dtype=np.int64)
+    overlap = (
+        (np.maximum(boxes[:, None, 0], boxes[None, :, 0]) < np.minimum(boxes[:, None, 2], boxes[None, :, 2]))
+        & (np.maximum(boxes[:, None, 1], boxes[None, :, 1]) < np.minimum(boxes[:, None, 3], boxes[None, :, 3]))
+    )
+    for i in range(n - 1):
+        others = np.flatnonzero(overlap[i, i + 1:]) + i + 1
+        if others.size == 0:
+            continue
+        inter = _popcount(words[i] & words[others]).sum(axis=1, dtype=np.int64)
+        union = areas[i] + areas[others] - inter
+        values = np.where(union > 0, inter / np.maximum(union, 1), 0.0)
+        iou[i, others] = values
+        iou[others, i] = values
+    return iou
+
+
+def _encode_counts(counts: List[int]) -> str:
+    """COCO 压缩 RLE 字符串（COCO maskApi 的 rleToString 格式：差分 + 每字符 5 位的变长编码）"""
+    chars = []
+    for i, x in enumerate(counts):
+        if i > 2:
+            x -= counts[i - 2]
+        more = True
+        while more:
+            c = x & 0x1F
+            x >>= 5
+            more = x != -1 if c & 0x10 else x != 0
+            if more:
+                c |= 0x20
+            chars.append(chr(c + 48))
+    return "".join(chars)
+
+
+def _decode_counts(text: str) -> List[int]:
+    counts, p = [], 0
+    while p < len(text):
+        x, k, more = 0, 0, True
+        while more:
+            c = ord(text[p]) - 48
+            x |= (c & 0x1F) << (5 * k)
+            more = bool(c & 0x20)
+            p += 1
+            k += 1
+            if not more and c & 0x10:
+                x |= -1 << (5 * k)
+        if len(counts) > 2:
+            x += counts[-2]
+        counts.append(x)
+    return counts
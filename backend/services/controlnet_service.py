@@ -13,6 +13,9 @@ import httpx
 from typing import List, Optional
 from dataclasses import dataclass
 
+from services.rate_limiter import upstream_limits
+from services.provider_router import is_transient_error
+
 
 @dataclass
 class ControlNetResult:
@@ -22,6 +25,7 @@ class ControlNetResult:
     request_id: str = None
     cost: float = 0.0
     error: str = None
+    transient: bool = False  # 失败是否为上游故障（网络 / 超时 / 429 / 5xx），只有这类失败才切换 provider
     elapsed_seconds: float = 0.0
 
 
@@ -145,43 +149,45 @@ class ControlNetInteriorService:
             payload["input"]["seed"] = seed
         
         try:
-            # 发送请求
-            resp = requests.post(
-                f"{self.BASE_URL}/predictions",
-                headers=self.headers,
-                json=payload,
-                timeout=120
-            )
-            resp.raise_for_status()
-            result = resp.json()
+            with upstream_limits.limit_sync("replicate", self.MODEL):
+                # 发送请求
+                resp = requests.post(
+                    f"{self.BASE_URL}/predictions",
+                    headers=self.headers,
+                    json=payload,
+                    timeout=120
+                )
+                resp.raise_for_status()
+                result = resp.json()
             
-            # 检查状态
-            if result.get("status") == "succeeded":
-                output = result.get("output")
-                images = [output] if isinstance(output, str) else output
+                # 检查状态
+                if result.get("status") == "succeeded":
+                    output = result.get("output")
+                    images = [output] if isinstance(output, str) else output
                 
-                elapsed = time.time() - start_time
-                return ControlNetResult(
-                    success=True,
-                    images=images,
-                    request_id=result.get("id"),
-                    cost=self.COST_PER_RUN,
-                    elapsed_seconds=elapsed
-                )
-            elif result.get("status") == "failed":
-                return ControlNetResult(
-                    success=False,
-                    error=result.get("error", "Generation failed"),
-                    elapsed_seconds=time.time() - start_time
-                )
-            else:
-                # 需要轮询
-                return self._poll_result(result.get("id"))
+                    elapsed = time.time() - start_time
+                    return ControlNetResult(
+                        success=True,
+                        images=images,
+                        request_id=result.get("id"),
+                        cost=self.COST_PER_RUN,
+                        elapsed_seconds=elapsed
+                    )
+                elif result.get("status") == "failed":
+                    return ControlNetResult(
+                        success=False,
+                        error=result.get("error", "Generation failed"),
+                        elapsed_seconds=time.time() - start_time
+                    )
+                else:
+                    # 需要轮询
+                    return self._poll_result(result.get("id"))
                 
         except Exception as e:
             return ControlNetResult(
                 success=False,
                 error=str(e),
+                transient=is_transient_error(e),
                 elapsed_seconds=time.time() - start_time
             )
     
@@ -221,6 +227,7 @@ class ControlNetInteriorService:
         return ControlNetResult(
             success=False,
             error=f"Timeout after {max_wait}s",
+            transient=True,
             elapsed_seconds=time.time() - start_time
         )
     
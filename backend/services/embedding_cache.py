@@ -0,0 +1,149 @@
+"""
+SAM 图像特征缓存
+
+按图片内容哈希缓存图像编码器输出（按字节数 LRU + TTL），文本提示与框提示共用同一份特征，并发请求同一张图片时只编码一次
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Tuple
+
+from PIL import Image
+
+
+def tensor_nbytes(value: Any) -> int:
+    """估算张量（或张量的 dict/list/tuple 嵌套）占用的字节数"""
+    if hasattr(value, "element_size") and hasattr(value, "nelement"):
+        return value.element_size() * value.nelement()
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sum(tensor_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(tensor_nbytes(v) for v in value)
+    if hasattr(value, "__dict__"):
+        return sum(tensor_nbytes(v) for v in vars(value).values())
+    return 0
+
+
+class EmbeddingCache:
+    """
+    线程安全的 LRU + TTL 缓存（SAM 推理在推理线程中调用）
+    """
+
+    def __init__(self, max_bytes: int = 1024 * 1024 * 1024, ttl: float = 1800.0):
+        """
+        Args:
+            max_bytes: 总字节上限，0 表示关闭
+            ttl: 有效期(秒)
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()  # key -> (value, nbytes, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._computing: Dict[str, threading.Event] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _pop(self, key: str):
+        _, nbytes, _ = self._entries.pop(key)
+        self._bytes -= nbytes
+
+    def get(self, key: str) -> Any:
+        """命中返回缓存值，未命中或过期返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= time.monotonic():
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: str, value: Any, nbytes: int = None):
+        """写入；单个条目超过总上限时不缓存"""
+        if not self.enabled:
+            return
+        nbytes = tensor_nbytes(value) if nbytes is None else nbytes
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes, time.monotonic() + self.ttl)
+            self._bytes += nbytes
+            self._evict()
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [k for k, (_, _, expires_at) in self._entries.items() if expires_at <= now]:
+            self._pop(key)
+        while self._bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            self._pop(key)
+            self.evictions += 1
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        """取缓存；未命中时调用 compute()，同一个 key 并发时只计算一次"""
+        while True:
+            value = self.get(key)
+            if value is not None:
+                with self._lock:
+                    self.hits += 1
+                return value
+            with self._lock:
+                event = self._computing.get(key)
+                if event is None:
+                    event = self._computing[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # 其他线程正在计算同一张图片，等它完成后再查缓存（计算失败时由自己重新计算）
+            event.wait()
+
+        try:
+            value = compute()
+            self.put(key, value)
+            return value
+        finally:
+            with self._lock:
+                self._computing.pop(key, None)
+            event.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+sam_embedding_cache = EmbeddingCache(
+    max_bytes=int(float(os.getenv("SAM_EMBEDDING_CACHE_MB", "1024")) * 1024 * 1024),
+    ttl=float(os.getenv("SAM_EMBEDDING_CACHE_TTL", "1800")),
+)
+
+# 分割结果的标签索引图（按图片内容），点击选择时直接查表，不再跑 SAM
+sam_label_maps = EmbeddingCache(
+    max_bytes=int(float(os.getenv("SAM_LABEL_MAP_CACHE_MB", "64")) * 1024 * 1024),
+    ttl=float(os.getenv("SAM_EMBEDDING_CACHE_TTL", "1800")),
+)
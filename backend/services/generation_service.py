@@ -11,6 +11,7 @@ from enum import Enum
 from sqlalchemy import Column, String, Integer, DateTime, Float, Text, Index, Enum as SQLEnum
 
 from services.database import db_manager, Base
+from services.image_derivatives import derivative_store
 
 
 class GenerationType(str, Enum):
@@ -91,6 +92,7 @@ class GenerationInfo:
     is_favorite: bool
     created_at: datetime
     completed_at: Optional[datetime]
+    input_thumbnail_url: Optional[str] = None
 
 
 class GenerationService:
@@ -123,7 +125,8 @@ class GenerationService:
             cost=record.cost or 0,
             is_favorite=bool(record.is_favorite),
             created_at=record.created_at,
-            completed_at=record.completed_at
+            completed_at=record.completed_at,
+            input_thumbnail_url=record.input_thumbnail_url
         )
     
     def save_generation(
@@ -152,6 +155,7 @@ class GenerationService:
                     user_id=user_id,
                     generation_type=GenerationType(generation_type) if generation_type in ["full", "inpaint"] else GenerationType.FULL,
                     input_image_url=input_image_url,
+                    input_thumbnail_url=derivative_store.thumbnail_url(input_image_url),
                     output_image_url=output_image_url,
                     style=style,
                     room_type=room_type,
@@ -0,0 +1,289 @@
+"""
+Grsai 任务结果集中轮询器
+
+由一个后台协程统一调度所有未完成任务的 /v1/draw/result 轮询，按模型和进度速率自适应间隔，同一 task_id 共享一次轮询
+"""
+import time
+import random
+import asyncio
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from services.provider_router import is_transient_error
+
+
+@dataclass
+class PollProfile:
+    """单个模型的轮询参数（秒）"""
+    first_delay: float
+    min_interval: float
+    max_interval: float
+
+
+class PollSchedule:
+    """
+    自适应轮询间隔
+
+    - 有进度增长时：按进度速率估算剩余时间，取其一半作为下次间隔
+    - 没有进度变化时：间隔按 1.5 倍退避
+    - 结果限定在模型的 [min_interval, max_interval] 内，再加 ±jitter 抖动
+    """
+
+    PROFILES = {
+        "nano-banana-fast": PollProfile(first_delay=2.0, min_interval=1.0, max_interval=4.0),
+        "nano-banana": PollProfile(first_delay=4.0, min_interval=1.5, max_interval=6.0),
+        "nano-banana-pro": PollProfile(first_delay=6.0, min_interval=2.0, max_interval=8.0),
+        "nano-banana-pro-vt": PollProfile(first_delay=6.0, min_interval=2.0, max_interval=8.0),
+        "nano-banana-pro-cl": PollProfile(first_delay=6.0, min_interval=2.0, max_interval=8.0),
+        "nano-banana-pro-vip": PollProfile(first_delay=8.0, min_interval=2.0, max_interval=10.0),
+        "nano-banana-pro-4k-vip": PollProfile(first_delay=15.0, min_interval=3.0, max_interval=12.0),
+    }
+    DEFAULT_PROFILE = PollProfile(first_delay=5.0, min_interval=2.0, max_interval=8.0)
+    BACKOFF = 1.5
+
+    def __init__(self, model: str = None, base_interval: float = None, jitter: float = 0.2):
+        """
+        Args:
+            model: 模型名，决定轮询参数
+            base_interval: 指定初始间隔（兼容原来的 poll_interval 参数）
+            jitter: 抖动比例，0.2 表示 ±20%
+        """
+        model = getattr(model, "value", model)
+        self.profile = self.PROFILES.get(model, self.DEFAULT_PROFILE)
+        self.jitter = jitter
+        self.interval = base_interval or self.profile.min_interval
+        self._last_progress: Optional[int] = None
+        self._last_time: Optional[float] = None
+
+    def _clamp(self, value: float) -> float:
+        return max(self.profile.min_interval, min(self.profile.max_interval, value))
+
+    def _jittered(self, value: float) -> float:
+        if self.jitter <= 0:
+            return value
+        return value * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def first_delay(self) -> float:
+        """提交后第一次轮询前的等待时间"""
+        return self._jittered(self.profile.first_delay)
+
+    def observe(self, progress: int, now: float = None) -> float:
+        """记录一次轮询得到的进度，返回下次轮询的等待时间"""
+        now = time.monotonic() if now is None else now
+        progress = progress or 0
+
+        if self._last_progress is not None and progress > self._last_progress and now > self._last_time:
+            rate = (progress - self._last_progress) / (now - self._last_time)
+            remaining = (100 - progress) / rate
+            self.interval = self._clamp(remaining / 2)
+        elif self._last_progress is not None:
+            self.interval = self._clamp(self.interval * self.BACKOFF)
+        else:
+            self.interval = self._clamp(self.interval)
+
+        self._last_progress = progress
+        self._last_time = now
+        return self._jittered(self.interval)
+
+    def error_backoff(self, errors: int) -> float:
+        """请求出错后的重试等待时间"""
+        return self._jittered(min(self.profile.max_interval, self.profile.min_interval * (2 ** errors)))
+
+
+def parse_result_response(body: dict) -> Optional[dict]:
+    """
+    解析 /v1/draw/result 的响应
+
+    Returns:
+        任务已结束时返回结果 dict；仍在运行返回 None
+
+    Raises:
+        Exception: 任务不存在或生成失败
+    """
+    if body.get("code") == -22:
+        raise Exception("Task not found")
+
+    result = body.get("data") or {}
+    status = result.get("status")
+    if status == "succeeded":
+        return result
+    if status == "failed":
+        raise Exception(result.get("error") or result.get("failure_reason") or "Generation failed")
+    return None
+
+
+@dataclass
+class _PollEntry:
+    task_id: str
+    schedule: PollSchedule
+    future: asyncio.Future
+    deadline: float
+    max_wait: float
+    next_poll_at: float
+    waiters: int = 0
+    errors: int = 0
+    polls: int = 0
+    in_flight: bool = False
+    last_progress: int = 0
+
+
+class GrsaiResultPoller:
+    """
+    集中轮询器
+
+    使用示例:
+        poller = GrsaiResultPoller(fetch=service._fetch_task)
+        result = await poller.wait(task_id, model="nano-banana-fast", max_wait=180)
+    """
+
+    MAX_CONSECUTIVE_ERRORS = 5
+
+    def __init__(
+        self,
+        fetch: Callable[[str], Awaitable[dict]],
+        max_concurrency: int = 16,
+        jitter: float = 0.2,
+    ):
+        """
+        Args:
+            fetch: 查询单个任务的协程函数，返回 /v1/draw/result 的原始响应 JSON
+            max_concurrency: 同时在途的查询请求上限
+            jitter: 轮询间隔抖动比例
+        """
+        self._fetch = fetch
+        self._max_concurrency = max_concurrency
+        self._jitter = jitter
+        self._entries: Dict[str, _PollEntry] = {}
+        self._inflight_tasks: Set[asyncio.Task] = set()
+        self._runner: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.requests_sent = 0
+        self.completed = 0
+
+    def _ensure_running(self):
+        if self._runner is None or self._runner.done():
+            # 调度循环空闲时会退出，重启时重建同步原语，绑定到当前事件循环
+            self._wakeup = asyncio.Event()
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+            self._runner = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    async def wait(
+        self,
+        task_id: str,
+        model: str = None,
+        max_wait: float = 180.0,
+        base_interval: float = None,
+    ) -> dict:
+        """
+        登记任务并等待其结束
+
+        Returns:
+            succeeded 状态的结果 dict
+
+        Raises:
+            Exception: 任务失败 / 不存在 / 超时
+        """
+        loop = asyncio.get_running_loop()
+        entry = self._entries.get(task_id)
+        if entry is None:
+            schedule = PollSchedule(model, base_interval, jitter=self._jitter)
+            now = loop.time()
+            entry = _PollEntry(
+                task_id=task_id,
+                schedule=schedule,
+                future=loop.create_future(),
+                deadline=now + max_wait,
+                max_wait=max_wait,
+                next_poll_at=now + schedule.first_delay(),
+            )
+            self._entries[task_id] = entry
+        entry.waiters += 1
+        self._ensure_running()
+
+        try:
+            return await asyncio.shield(entry.future)
+        finally:
+            entry.waiters -= 1
+            # 所有等待方都放弃了（如请求被取消），停止轮询该任务
+            if entry.waiters <= 0 and not entry.future.done():
+                entry.future.cancel()
+                self._entries.pop(task_id, None)
+
+    def _finish(self, entry: _PollEntry, result: dict = None, error: Exception = None):
+        self._entries.pop(entry.task_id, None)
+        if entry.future.done():
+            return
+        if error is not None:
+            entry.future.set_exception(error)
+        else:
+            entry.future.set_result(result)
+        self.completed += 1
+
+    async def _poll_one(self, entry: _PollEntry):
+        loop = asyncio.get_running_loop()
+        try:
+            async with self._semaphore:
+                self.requests_sent += 1
+                entry.polls += 1
+                body = await self._fetch(entry.task_id)
+            result = parse_result_response(body)
+        except Exception as e:
+            entry.errors += 1
+            if not is_transient_error(e) or entry.errors >= self.MAX_CONSECUTIVE_ERRORS:
+                self._finish(entry, error=e)
+                return
+            entry.next_poll_at = loop.time() + entry.schedule.error_backoff(entry.errors)
+        else:
+            entry.errors = 0
+            if result is not None:
+                self._finish(entry, result=result)
+                return
+            data = body.get("data") or {}
+            entry.last_progress = data.get("progress", entry.last_progress) or 0
+            entry.next_poll_at = loop.time() + entry.schedule.observe(entry.last_progress, now=loop.time())
+        finally:
+            entry.in_flight = False
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    async def _run(self):
+        """调度循环：没有待轮询任务时自动退出"""
+        loop = asyncio.get_running_loop()
+        while self._entries:
+            self._wakeup.clear()
+            now = loop.time()
+            next_due = None
+
+            for entry in list(self._entries.values()):
+                if entry.future.done():
+                    self._entries.pop(entry.task_id, None)
+                    continue
+                if entry.in_flight:
+                    continue
+                if now >= entry.deadline:
+                    self._finish(entry, error=TimeoutError(f"Timeout after {entry.max_wait}s"))
+                    continue
+                if entry.next_poll_at <= now:
+                    entry.in_flight = True
+                    task = asyncio.create_task(self._poll_one(entry))
+                    self._inflight_tasks.add(task)
+                    task.add_done_callback(self._inflight_tasks.discard)
+                    continue
+                due = min(entry.next_poll_at, entry.deadline)
+                next_due = due if next_due is None else min(next_due, due)
+
+            timeout = 1.0 if next_due is None else max(0.0, next_due - now)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        """轮询器状态（用于监控）"""
+        return {
+            "outstanding": len(self._entries),
+            "requests_sent": self.requests_sent,
+            "completed": self.completed,
+        }
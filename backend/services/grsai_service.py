@@ -4,13 +4,26 @@ Grsai Nano Banana API 服务
 成本: ~¥0.18/张 (nano-banana-pro)
 """
 import os
+import json
 import time
 import asyncio
+import hashlib
 import httpx
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from typing import Optional, List, Callable, AsyncGenerator
 from dataclasses import dataclass, field
 from enum import Enum
 
+from services.http_client import http_client_pool
+from services.stream_decoder import GrsaiStreamDecoder
+from services.grsai_poller import GrsaiResultPoller, PollSchedule, parse_result_response
+from services.grsai_task_registry import grsai_task_registry
+from services.result_cache import ResultCache, result_cache as default_result_cache
+from services.rate_limiter import upstream_limits
+from services.provider_router import is_transient_error
+from services.host_router import HostRouter
+
 
 class NanoBananaModel(str, Enum):
     """支持的模型"""
@@ -72,7 +85,10 @@ class GenerationResult:
     content: str = None       # 回复内容
     cost: float = 0.0         # 成本(RMB)
     error: str = None
+    transient: bool = False   # 失败是否为上游故障（网络 / 超时 / 429 / 5xx），只有这类失败才切换 provider
     elapsed_seconds: float = 0.0
+    cache_hit: bool = False   # 是否命中结果缓存
+    saved_cost: float = 0.0   # 命中缓存节省的成本(RMB)
 
 
 class GrsaiNanoBananaService:
@@ -148,15 +164,23 @@ class GrsaiNanoBananaService:
         self, 
         api_key: str = None,
         use_china_host: bool = True,
-        timeout: float = 180.0
+        timeout: float = 180.0,
+        http_client: httpx.AsyncClient = None,
+        webhook_url: str = None,
+        result_cache: ResultCache = None,
+        router: HostRouter = None,
     ):
         """
         初始化服务
         
         Args:
             api_key: API密钥，不传则从环境变量 GRSAI_API_KEY 获取
-            use_china_host: 是否使用国内直连地址
+            use_china_host: 是否使用国内直连地址（启用路由时为没有延迟数据时的默认入口）
             timeout: 请求超时时间(秒)
+            http_client: 自定义 httpx client，不传则使用进程级共享连接池
+            webhook_url: 回调地址，不传则从环境变量 GRSAI_WEBHOOK_URL 获取；为空时不启用回调模式
+            result_cache: 结果缓存，不传则使用进程级缓存
+            router: 多入口路由，不传则按 GRSAI_HOST_ROUTING 使用进程级路由（latency）或固定入口（fixed）
         """
         self.api_key = api_key or os.getenv("GRSAI_API_KEY")
         if not self.api_key:
@@ -168,6 +192,46 @@ class GrsaiNanoBananaService:
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}"
         }
+        self._http_client = http_client
+        self._poller: Optional[GrsaiResultPoller] = None
+        self.webhook_url = webhook_url or os.getenv("GRSAI_WEBHOOK_URL") or None
+        self.callback_deadline = float(os.getenv("GRSAI_CALLBACK_DEADLINE", "150"))
+        self.result_cache = result_cache if result_cache is not None else default_result_cache
+        if router is None and os.getenv("GRSAI_HOST_ROUTING", "latency").lower() == "latency":
+            router = grsai_host_router
+        self.router = router
+        self.hedge_submit = os.getenv("GRSAI_HEDGE_SUBMIT", "false").lower() == "true"
+        # 任务ID -> 提交时使用的入口，查询结果时保持一致
+        self._task_hosts: "OrderedDict[str, str]" = OrderedDict()
+    
+    def _client(self, host: str = None) -> httpx.AsyncClient:
+        """获取 HTTP client（复用连接池，不要在调用方关闭）"""
+        if self._http_client is not None:
+            return self._http_client
+        return http_client_pool.get_client(host or self.base_url)
+    
+    def _pick_host(self) -> str:
+        """当前最快的健康入口；未启用路由时为固定入口"""
+        return self.router.choose(preferred=self.base_url) if self.router is not None else self.base_url
+    
+    def _record_host(self, host: str, ttfb: Optional[float], ok: bool):
+        if self.router is not None:
+            self.router.record(host, ttfb, ok)
+    
+    @asynccontextmanager
+    async def _stream_draw(self, payload: dict, timeout: float):
+        """向选中的入口发起流式绘图请求，记录首字节时间和传输错误"""
+        host = self._pick_host()
+        url = f"{host}{self.ENDPOINT_DRAW}"
+        start = time.monotonic()
+        try:
+            async with self._client(host).stream("POST", url, headers=self.headers, json=payload, timeout=timeout) as response:
+                self._record_host(host, time.monotonic() - start, response.status_code < 500)
+                response.raise_for_status()
+                yield response
+        except httpx.TransportError:
+            self._record_host(host, None, False)
+            raise
     
     def _build_prompt(self, prompt: str, style: str = None, room_type: str = None) -> str:
         """构建完整的prompt，优先使用prompts库，强制加入结构锁定"""
@@ -205,6 +269,72 @@ class GrsaiNanoBananaService:
                 return f"{struct_lock}，{self.STYLE_PROMPTS[style]}，{prompt}"
             return f"{struct_lock}，{prompt}"
     
+    def _build_payload(
+        self,
+        prompt: str,
+        image_url: str = None,
+        model: NanoBananaModel = NanoBananaModel.PRO,
+        style: str = None,
+        room_type: str = None,
+        aspect_ratio: AspectRatio = AspectRatio.AUTO,
+        image_size: ImageSize = ImageSize.SIZE_1K,
+    ) -> dict:
+        """构建生成请求的公共字段（不含 webHook / shutProgress 等返回方式字段）"""
+        payload = {
+            "model": model.value if isinstance(model, NanoBananaModel) else model,
+            "prompt": self._build_prompt(prompt, style, room_type),
+            "aspectRatio": aspect_ratio.value if isinstance(aspect_ratio, AspectRatio) else aspect_ratio,
+            "imageSize": image_size.value if isinstance(image_size, ImageSize) else image_size,
+        }
+        if image_url:
+            payload["urls"] = [image_url] if isinstance(image_url, str) else list(image_url)
+        return payload
+    
+    def request_key(self, prompt: str, **kwargs) -> str:
+        """
+        生成请求的规范化哈希（_build_prompt 结果 + 参数），参数同 generate
+        
+        与结果返回方式无关的字段不参与计算，参数相同的请求得到相同的 key，用于合并重复请求。
+        """
+        payload = self._build_payload(prompt, **kwargs)
+        canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+    
+    async def _cache_lookup(self, payload: dict, start_time: float) -> tuple:
+        """
+        查询结果缓存（make_key 可能读取本地图片，get 有 SQLite 读写，都在线程中执行，不阻塞事件循环）
+        
+        Returns:
+            (cache_key, 命中时的 GenerationResult 或 None)
+        """
+        def lookup():
+            key = self.result_cache.make_key(payload)
+            return key, self.result_cache.get(key)
+        
+        cache_key, cached = await asyncio.to_thread(lookup)
+        if cached is None:
+            return cache_key, None
+        return cache_key, GenerationResult(
+            success=True,
+            task_id=cached.get("task_id"),
+            images=cached.get("images", []),
+            content=cached.get("content", ""),
+            cost=0.0,
+            elapsed_seconds=time.time() - start_time,
+            cache_hit=True,
+            saved_cost=cached.get("cost", 0.0),
+        )
+    
+    async def _cache_store(self, cache_key: str, result: GenerationResult):
+        """缓存成功的生成结果（SQLite 写入在线程中执行）"""
+        if result.success and result.images:
+            await asyncio.to_thread(self.result_cache.put, cache_key, {
+                "task_id": result.task_id,
+                "images": result.images,
+                "content": result.content,
+                "cost": result.cost,
+            })
+    
     async def generate(
         self,
         prompt: str,
@@ -233,65 +363,45 @@ class GrsaiNanoBananaService:
         start_time = time.time()
         
         # 构建请求 - 使用prompts库生成专业prompt
-        full_prompt = self._build_prompt(prompt, style, room_type)
-        payload = {
-            "model": model.value if isinstance(model, NanoBananaModel) else model,
-            "prompt": full_prompt,
-            "aspectRatio": aspect_ratio.value if isinstance(aspect_ratio, AspectRatio) else aspect_ratio,
-            "imageSize": image_size.value if isinstance(image_size, ImageSize) else image_size,
-            "shutProgress": True,  # 不需要进度，直接返回结果
-        }
+        payload = self._build_payload(prompt, image_url, model, style, room_type, aspect_ratio, image_size)
+        payload["shutProgress"] = True  # 不需要进度，直接返回结果
         
-        if image_url:
-            payload["urls"] = [image_url] if isinstance(image_url, str) else image_url
+        cache_key, cached = await self._cache_lookup(payload, start_time)
+        if cached is not None:
+            return cached
         
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
+            # 按模型限流，流式连接占用期间计为在途
+            async with upstream_limits.limit("grsai", payload["model"]):
                 # 发送请求，使用流式响应
-                url = f"{self.base_url}{self.ENDPOINT_DRAW}"
+                async with self._stream_draw(payload, timeout=self.timeout) as response:
+                    final_result = await GrsaiStreamDecoder().read_terminal(response.aiter_lines())
+            
+            elapsed = time.time() - start_time
+            images = [r["url"] for r in final_result.get("results", [])]
+            content = final_result.get("results", [{}])[0].get("content", "")
                 
-                async with client.stream("POST", url, headers=self.headers, json=payload) as response:
-                    response.raise_for_status()
-                    
-                    final_result = None
-                    async for line in response.aiter_lines():
-                        if line.strip():
-                            try:
-                                import json
-                                data = json.loads(line)
-                                if data.get("status") == "succeeded":
-                                    final_result = data
-                                    break
-                                elif data.get("status") == "failed":
-                                    raise Exception(data.get("error") or data.get("failure_reason") or "Generation failed")
-                            except json.JSONDecodeError:
-                                continue
-                    
-                    if not final_result:
-                        raise Exception("No result received")
-                    
-                    elapsed = time.time() - start_time
-                    images = [r["url"] for r in final_result.get("results", [])]
-                    content = final_result.get("results", [{}])[0].get("content", "")
-                    
-                    # 估算成本
-                    model_key = NanoBananaModel(payload["model"]) if payload["model"] in [m.value for m in NanoBananaModel] else NanoBananaModel.PRO
-                    cost = self.COST_MAP.get(model_key, 0.18)
-                    
-                    return GenerationResult(
-                        success=True,
-                        task_id=final_result.get("id"),
-                        images=images,
-                        content=content,
-                        cost=cost,
-                        elapsed_seconds=elapsed
-                    )
+            # 估算成本
+            model_key = NanoBananaModel(payload["model"]) if payload["model"] in [m.value for m in NanoBananaModel] else NanoBananaModel.PRO
+            cost = self.COST_MAP.get(model_key, 0.18)
+                
+            result = GenerationResult(
+                success=True,
+                task_id=final_result.get("id"),
+                images=images,
+                content=content,
+                cost=cost,
+                elapsed_seconds=elapsed
+            )
+            await self._cache_store(cache_key, result)
+            return result
                     
         except Exception as e:
             elapsed = time.time() - start_time
             return GenerationResult(
                 success=False,
                 error=str(e),
+                transient=is_transient_error(e),
                 elapsed_seconds=elapsed
             )
     
@@ -332,27 +442,17 @@ class GrsaiNanoBananaService:
         if image_url:
             payload["urls"] = [image_url] if isinstance(image_url, str) else image_url
         
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            url = f"{self.base_url}{self.ENDPOINT_DRAW}"
-            
-            async with client.stream("POST", url, headers=self.headers, json=payload) as response:
-                response.raise_for_status()
-                
-                async for line in response.aiter_lines():
-                    if line.strip():
-                        try:
-                            import json
-                            data = json.loads(line)
-                            yield GenerationProgress(
-                                id=data.get("id", ""),
-                                progress=data.get("progress", 0),
-                                status=TaskStatus(data.get("status", "running")),
-                                results=data.get("results", []),
-                                failure_reason=data.get("failure_reason", ""),
-                                error=data.get("error", "")
-                            )
-                        except json.JSONDecodeError:
-                            continue
+        async with upstream_limits.limit("grsai", payload["model"]):
+            async with self._stream_draw(payload, timeout=self.timeout) as response:
+                async for data in GrsaiStreamDecoder().iter_frames(response.aiter_lines()):
+                    yield GenerationProgress(
+                        id=data.get("id", ""),
+                        progress=data.get("progress", 0),
+                        status=TaskStatus(data.get("status", "running")),
+                        results=data.get("results", []),
+                        failure_reason=data.get("failure_reason", ""),
+                        error=data.get("error", "")
+                    )
     
     async def generate_with_webhook(
         self,
@@ -364,6 +464,7 @@ class GrsaiNanoBananaService:
         room_type: str = None,
         aspect_ratio: AspectRatio = AspectRatio.AUTO,
         image_size: ImageSize = ImageSize.SIZE_1K,
+        shut_progress: bool = False,
     ) -> str:
         """
         使用WebHook回调生成图片
@@ -377,6 +478,7 @@ class GrsaiNanoBananaService:
             room_type: 房间类型
             aspect_ratio: 输出宽高比
             image_size: 输出分辨率
+            shut_progress: 是否关闭进度回调，只回调最终结果
         
         Returns:
             任务ID
@@ -388,18 +490,131 @@ class GrsaiNanoBananaService:
             "aspectRatio": aspect_ratio.value if isinstance(aspect_ratio, AspectRatio) else aspect_ratio,
             "imageSize": image_size.value if isinstance(image_size, ImageSize) else image_size,
             "webHook": webhook_url,
-            "shutProgress": False,
+            "shutProgress": shut_progress,
         }
         
         if image_url:
             payload["urls"] = [image_url] if isinstance(image_url, str) else image_url
         
-        async with httpx.AsyncClient(timeout=30) as client:
-            url = f"{self.base_url}{self.ENDPOINT_DRAW}"
-            response = await client.post(url, headers=self.headers, json=payload)
-            response.raise_for_status()
-            data = response.json()
-            return data.get("data", {}).get("id", "")
+        async with upstream_limits.limit("grsai", payload["model"]):
+            return await self._submit_task(payload)
+    
+    async def _submit_task(self, payload: dict) -> str:
+        """提交任务（webHook 模式），返回任务ID；调用方负责限流"""
+        if self.router is not None and self.hedge_submit:
+            return await self.router.hedged(lambda host: self._submit_to(host, payload), preferred=self.base_url)
+        return await self._submit_to(self._pick_host(), payload)
+    
+    async def _submit_to(self, host: str, payload: dict) -> str:
+        """向指定入口提交任务，记录延迟并保存任务所在入口"""
+        url = f"{host}{self.ENDPOINT_DRAW}"
+        start = time.monotonic()
+        try:
+            response = await self._client(host).post(url, headers=self.headers, json=payload, timeout=30)
+        except httpx.TransportError:
+            self._record_host(host, None, False)
+            raise
+        self._record_host(host, time.monotonic() - start, response.status_code < 500)
+        response.raise_for_status()
+        task_id = response.json().get("data", {}).get("id", "")
+        if task_id:
+            self._task_hosts[task_id] = host
+            while len(self._task_hosts) > 10000:
+                self._task_hosts.popitem(last=False)
+        return task_id
+    
+    def _callback_url(self) -> str:
+        """回调地址，配置了 GRSAI_WEBHOOK_SECRET 时带上校验 token"""
+        secret = os.getenv("GRSAI_WEBHOOK_SECRET")
+        if not secret:
+            return self.webhook_url
+        separator = "&" if "?" in self.webhook_url else "?"
+        return f"{self.webhook_url}{separator}token={secret}"
+    
+    async def generate_with_callback(
+        self,
+        prompt: str,
+        image_url: str = None,
+        model: NanoBananaModel = NanoBananaModel.PRO,
+        style: str = None,
+        room_type: str = None,
+        aspect_ratio: AspectRatio = AspectRatio.AUTO,
+        image_size: ImageSize = ImageSize.SIZE_1K,
+        max_wait: float = 300.0,
+    ) -> GenerationResult:
+        """
+        回调模式生成：提交后不占用上游连接，等待 /api/v1/callbacks/grsai 完成任务，
+        超过 callback_deadline 仍未回调时退回集中轮询
+        
+        Args:
+            prompt: 提示词
+            image_url: 参考图URL
+            model: 使用的模型
+            style: 风格模板
+            room_type: 房间类型
+            aspect_ratio: 输出宽高比
+            image_size: 输出分辨率
+            max_wait: 最大等待时间(秒)，包括回调等待和轮询
+        
+        Returns:
+            GenerationResult
+        """
+        if not self.webhook_url:
+            raise ValueError("GRSAI_WEBHOOK_URL is required for callback mode")
+        
+        start_time = time.time()
+        payload = self._build_payload(prompt, image_url, model, style, room_type, aspect_ratio, image_size)
+        model_value = payload["model"]
+        task_id = ""
+        
+        cache_key, cached = await self._cache_lookup(payload, start_time)
+        if cached is not None:
+            return cached
+        
+        payload["webHook"] = self._callback_url()
+        payload["shutProgress"] = True
+        
+        try:
+            # 等待回调期间任务仍在上游运行，名额保持到拿到结果
+            async with upstream_limits.limit("grsai", model_value):
+                task_id = await self._submit_task(payload)
+                if not task_id:
+                    raise Exception("Failed to get task ID")
+                
+                try:
+                    result = await grsai_task_registry.wait(task_id, timeout=min(self.callback_deadline, max_wait))
+                except asyncio.TimeoutError:
+                    print(f"[Callback] {task_id} 超过 {self.callback_deadline}s 未回调，改为轮询")
+                    remaining = max(1.0, max_wait - (time.time() - start_time))
+                    result = await self._poll_result(task_id, max_wait=remaining, model=model_value)
+            
+            elapsed = time.time() - start_time
+            images = [r["url"] for r in result.get("results", [])]
+            content = result.get("results", [{}])[0].get("content", "")
+            
+            model_key = NanoBananaModel(model_value) if model_value in [m.value for m in NanoBananaModel] else NanoBananaModel.PRO
+            cost = self.COST_MAP.get(model_key, 0.18)
+            
+            result = GenerationResult(
+                success=True,
+                task_id=task_id,
+                images=images,
+                content=content,
+                cost=cost,
+                elapsed_seconds=elapsed
+            )
+            await self._cache_store(cache_key, result)
+            return result
+            
+        except Exception as e:
+            elapsed = time.time() - start_time
+            return GenerationResult(
+                success=False,
+                task_id=task_id or None,
+                error=str(e),
+                transient=is_transient_error(e),
+                elapsed_seconds=elapsed
+            )
     
     async def generate_with_polling(
         self,
@@ -410,11 +625,11 @@ class GrsaiNanoBananaService:
         room_type: str = None,
         aspect_ratio: AspectRatio = AspectRatio.AUTO,
         image_size: ImageSize = ImageSize.SIZE_1K,
-        poll_interval: float = 2.0,
+        poll_interval: float = None,
         max_wait: float = 180.0,
     ) -> GenerationResult:
         """
-        使用轮询方式获取结果
+        使用轮询方式获取结果（由集中轮询器按模型自适应调度）
         
         Args:
             prompt: 提示词
@@ -424,7 +639,7 @@ class GrsaiNanoBananaService:
             room_type: 房间类型
             aspect_ratio: 输出宽高比
             image_size: 输出分辨率
-            poll_interval: 轮询间隔(秒)
+            poll_interval: 初始轮询间隔(秒)，不传则按模型自适应
             max_wait: 最大等待时间(秒)
         
         Returns:
@@ -445,75 +660,66 @@ class GrsaiNanoBananaService:
             payload["urls"] = [image_url] if isinstance(image_url, str) else image_url
         
         try:
-            async with httpx.AsyncClient(timeout=30) as client:
+            async with upstream_limits.limit("grsai", payload["model"]):
                 # 提交任务
-                url = f"{self.base_url}{self.ENDPOINT_DRAW}"
-                response = await client.post(url, headers=self.headers, json=payload)
-                response.raise_for_status()
-                data = response.json()
-                task_id = data.get("data", {}).get("id", "")
-                
+                task_id = await self._submit_task(payload)
+                    
                 if not task_id:
                     raise Exception("Failed to get task ID")
-                
+                    
                 # 轮询结果
-                result = await self._poll_result(client, task_id, poll_interval, max_wait)
+                result = await self._poll_result(task_id, poll_interval, max_wait, model=payload["model"])
                 
-                elapsed = time.time() - start_time
-                images = [r["url"] for r in result.get("results", [])]
-                content = result.get("results", [{}])[0].get("content", "")
+            elapsed = time.time() - start_time
+            images = [r["url"] for r in result.get("results", [])]
+            content = result.get("results", [{}])[0].get("content", "")
                 
-                model_key = NanoBananaModel(payload["model"]) if payload["model"] in [m.value for m in NanoBananaModel] else NanoBananaModel.PRO
-                cost = self.COST_MAP.get(model_key, 0.18)
+            model_key = NanoBananaModel(payload["model"]) if payload["model"] in [m.value for m in NanoBananaModel] else NanoBananaModel.PRO
+            cost = self.COST_MAP.get(model_key, 0.18)
                 
-                return GenerationResult(
-                    success=True,
-                    task_id=task_id,
-                    images=images,
-                    content=content,
-                    cost=cost,
-                    elapsed_seconds=elapsed
-                )
+            return GenerationResult(
+                success=True,
+                task_id=task_id,
+                images=images,
+                content=content,
+                cost=cost,
+                elapsed_seconds=elapsed
+            )
                 
         except Exception as e:
             elapsed = time.time() - start_time
             return GenerationResult(
                 success=False,
                 error=str(e),
+                transient=is_transient_error(e),
                 elapsed_seconds=elapsed
             )
     
+    async def _fetch_task(self, task_id: str) -> dict:
+        """查询单个任务，返回 /v1/draw/result 的原始响应"""
+        host = self._task_hosts.get(task_id) or self._pick_host()
+        url = f"{host}{self.ENDPOINT_RESULT}"
+        response = await self._client(host).post(url, headers=self.headers, json={"id": task_id}, timeout=30)
+        response.raise_for_status()
+        return response.json()
+    
+    def _result_poller(self) -> GrsaiResultPoller:
+        """集中轮询器（每个服务实例一个，单例服务即进程级共享）"""
+        if self._poller is None:
+            self._poller = GrsaiResultPoller(fetch=self._fetch_task)
+        return self._poller
+    
     async def _poll_result(
         self, 
-        client: httpx.AsyncClient, 
         task_id: str,
-        poll_interval: float = 2.0,
-        max_wait: float = 180.0
+        poll_interval: float = None,
+        max_wait: float = 180.0,
+        model: str = None,
     ) -> dict:
-        """轮询获取结果"""
-        url = f"{self.base_url}{self.ENDPOINT_RESULT}"
-        waited = 0.0
-        
-        while waited < max_wait:
-            response = await client.post(url, headers=self.headers, json={"id": task_id})
-            response.raise_for_status()
-            data = response.json()
-            
-            if data.get("code") == -22:
-                raise Exception("Task not found")
-            
-            result = data.get("data", {})
-            status = result.get("status")
-            
-            if status == "succeeded":
-                return result
-            elif status == "failed":
-                raise Exception(result.get("error") or result.get("failure_reason") or "Generation failed")
-            
-            await asyncio.sleep(poll_interval)
-            waited += poll_interval
-        
-        raise Exception(f"Timeout after {max_wait}s")
+        """登记到集中轮询器并等待结果"""
+        return await self._result_poller().wait(
+            task_id, model=model, max_wait=max_wait, base_interval=poll_interval
+        )
     
     async def get_result(self, task_id: str) -> GenerationProgress:
         """
@@ -525,24 +731,20 @@ class GrsaiNanoBananaService:
         Returns:
             GenerationProgress
         """
-        async with httpx.AsyncClient(timeout=30) as client:
-            url = f"{self.base_url}{self.ENDPOINT_RESULT}"
-            response = await client.post(url, headers=self.headers, json={"id": task_id})
-            response.raise_for_status()
-            data = response.json()
-            
-            if data.get("code") == -22:
-                raise Exception("Task not found")
+        data = await self._fetch_task(task_id)
+        
+        if data.get("code") == -22:
+            raise Exception("Task not found")
             
-            result = data.get("data", {})
-            return GenerationProgress(
-                id=result.get("id", task_id),
-                progress=result.get("progress", 0),
-                status=TaskStatus(result.get("status", "running")),
-                results=result.get("results", []),
-                failure_reason=result.get("failure_reason", ""),
-                error=result.get("error", "")
-            )
+        result = data.get("data", {})
+        return GenerationProgress(
+            id=result.get("id", task_id),
+            progress=result.get("progress", 0),
+            status=TaskStatus(result.get("status", "running")),
+            results=result.get("results", []),
+            failure_reason=result.get("failure_reason", ""),
+            error=result.get("error", "")
+        )
 
     # ============ Inpaint 局部重绘 ============
     
@@ -578,45 +780,34 @@ class GrsaiNanoBananaService:
                 "imageSize": "4K",
             }
             
+            cache_key, cached = await self._cache_lookup(payload, start_time)
+            if cached is not None:
+                return cached
+            
             try:
-                async with httpx.AsyncClient(timeout=300) as client:
-                    url = f"{self.base_url}{self.ENDPOINT_DRAW}"
-                    async with client.stream("POST", url, headers=self.headers, json=payload) as response:
-                        response.raise_for_status()
-                        final_result = None
-                        async for line in response.aiter_lines():
-                            if line.strip():
-                                json_str = line
-                                if line.startswith("data: "):
-                                    json_str = line[6:]
-                                try:
-                                    import json
-                                    data = json.loads(json_str)
-                                    if data.get("status") == "succeeded":
-                                        final_result = data
-                                        break
-                                    elif data.get("status") == "failed":
-                                        raise Exception(data.get("error") or "Erase failed")
-                                except json.JSONDecodeError:
-                                    continue
-                        
-                        if not final_result:
-                            raise Exception("No result received")
-                        
+                async with upstream_limits.limit("grsai", payload["model"]):
+                    async with self._stream_draw(payload, timeout=300) as response:
+                        final_result = await GrsaiStreamDecoder().read_terminal(
+                            response.aiter_lines(), failure_message="Erase failed"
+                        )
+                    
                         elapsed = time.time() - start_time
                         images = [r["url"] for r in final_result.get("results", [])]
                         
-                        return GenerationResult(
+                        result = GenerationResult(
                             success=True,
                             task_id=final_result.get("id"),
                             images=images,
                             cost=0.18,
                             elapsed_seconds=elapsed
                         )
+                        await self._cache_store(cache_key, result)
+                        return result
             except Exception as e:
                 return GenerationResult(
                     success=False,
                     error=str(e),
+                    transient=is_transient_error(e),
                     elapsed_seconds=time.time() - start_time
                 )
         
@@ -681,52 +872,42 @@ class GrsaiNanoBananaService:
             "imageSize": "4K",
         }
         
+        cache_key, cached = await self._cache_lookup(payload, start_time)
+        if cached is not None:
+            print(f"[Inpaint] 命中结果缓存")
+            return cached
+        
         try:
             # inpaint需要更长超时时间
-            async with httpx.AsyncClient(timeout=300) as client:
-                url = f"{self.base_url}{self.ENDPOINT_DRAW}"
-                print(f"[Inpaint] 调用API: {url}")
-                print(f"[Inpaint] Payload: {payload}")
+            print(f"[Inpaint] 调用API: {self.ENDPOINT_DRAW}")
+            print(f"[Inpaint] Payload: {payload}")
+                
+            async with upstream_limits.limit("grsai", payload["model"]):
+                async with self._stream_draw(payload, timeout=300) as response:
+                    decoder = GrsaiStreamDecoder()
+                    try:
+                        final_result = await decoder.read_terminal(
+                            response.aiter_lines(), failure_message="Inpaint failed"
+                        )
+                    except Exception:
+                        print(f"[Inpaint] 最近响应: {[line[:200] for line in decoder.tail()]}")
+                        raise
                 
-                async with client.stream("POST", url, headers=self.headers, json=payload) as response:
-                    response.raise_for_status()
-                    final_result = None
-                    all_lines = []
-                    async for line in response.aiter_lines():
-                        if line.strip():
-                            all_lines.append(line)
-                            # SSE格式：去掉 "data: " 前缀
-                            json_str = line
-                            if line.startswith("data: "):
-                                json_str = line[6:]
-                            print(f"[Inpaint] 响应行: {json_str[:200]}...")
-                            try:
-                                import json
-                                data = json.loads(json_str)
-                                if data.get("status") == "succeeded":
-                                    final_result = data
-                                    break
-                                elif data.get("status") == "failed":
-                                    raise Exception(data.get("error") or data.get("failure_reason") or "Inpaint failed")
-                            except json.JSONDecodeError:
-                                continue
-                    
-                    if not final_result:
-                        print(f"[Inpaint] 未收到结果，所有响应: {all_lines}")
-                        raise Exception(f"No result received. Lines: {len(all_lines)}")
-                    
                     images = [r["url"] for r in final_result.get("results", [])]
-                    return GenerationResult(
+                    result = GenerationResult(
                         success=True,
                         task_id=final_result.get("id"),
                         images=images,
                         cost=0.20,
                         elapsed_seconds=time.time() - start_time
                     )
+                    await self._cache_store(cache_key, result)
+                    return result
         except Exception as e:
             return GenerationResult(
                 success=False,
                 error=str(e),
+                transient=is_transient_error(e),
                 elapsed_seconds=time.time() - start_time
             )
 
@@ -812,18 +993,19 @@ class GrsaiNanoBananaServiceSync:
             payload["urls"] = [image_url] if isinstance(image_url, str) else image_url
         
         try:
-            # 提交任务
-            url = f"{self.base_url}{self.ENDPOINT_DRAW}"
-            resp = requests.post(url, headers=self.headers, json=payload, timeout=30)
-            resp.raise_for_status()
-            data = resp.json()
-            task_id = data.get("data", {}).get("id", "")
-            
-            if not task_id:
-                raise Exception("Failed to get task ID")
-            
-            # 轮询
-            result = self._poll_result(task_id, max_wait)
+            with upstream_limits.limit_sync("grsai", model):
+                # 提交任务
+                url = f"{self.base_url}{self.ENDPOINT_DRAW}"
+                resp = requests.post(url, headers=self.headers, json=payload, timeout=30)
+                resp.raise_for_status()
+                data = resp.json()
+                task_id = data.get("data", {}).get("id", "")
+                
+                if not task_id:
+                    raise Exception("Failed to get task ID")
+                
+                # 轮询
+                result = self._poll_result(task_id, max_wait, model=model)
             
             elapsed = time.time() - start_time
             images = [r["url"] for r in result.get("results", [])]
@@ -844,35 +1026,57 @@ class GrsaiNanoBananaServiceSync:
             return GenerationResult(
                 success=False,
                 error=str(e),
+                transient=is_transient_error(e),
                 elapsed_seconds=time.time() - start_time
             )
     
-    def _poll_result(self, task_id: str, max_wait: float = 180.0) -> dict:
+    def _poll_result(self, task_id: str, max_wait: float = 180.0, model: str = None) -> dict:
+        """按模型自适应间隔轮询（与异步版共用 PollSchedule）"""
         import requests
         
         url = f"{self.base_url}{self.ENDPOINT_RESULT}"
-        waited = 0.0
+        schedule = PollSchedule(model)
+        deadline = time.monotonic() + max_wait
         
-        while waited < max_wait:
+        time.sleep(min(schedule.first_delay(), max_wait))
+        while time.monotonic() < deadline:
             resp = requests.post(url, headers=self.headers, json={"id": task_id}, timeout=30)
             resp.raise_for_status()
             data = resp.json()
             
-            if data.get("code") == -22:
-                raise Exception("Task not found")
-            
-            result = data.get("data", {})
-            status = result.get("status")
-            
-            if status == "succeeded":
+            result = parse_result_response(data)
+            if result is not None:
                 return result
-            elif status == "failed":
-                raise Exception(result.get("error") or "Generation failed")
             
-            time.sleep(2)
-            waited += 2
+            progress = (data.get("data") or {}).get("progress", 0)
+            time.sleep(min(schedule.observe(progress), max(0.0, deadline - time.monotonic())))
         
-        raise Exception(f"Timeout after {max_wait}s")
+        raise TimeoutError(f"Timeout after {max_wait}s")
+
+
+# 多入口路由（进程级共享延迟统计）
+grsai_host_router = HostRouter(
+    [GrsaiNanoBananaService.HOST_CHINA, GrsaiNanoBananaService.HOST_OVERSEAS],
+    preferred=(
+        GrsaiNanoBananaService.HOST_CHINA
+        if os.getenv("GRSAI_USE_CHINA_HOST", "true").lower() == "true"
+        else GrsaiNanoBananaService.HOST_OVERSEAS
+    ),
+    probe_interval=float(os.getenv("GRSAI_PROBE_INTERVAL", "30")),
+)
+
+# 进程级单例（共享连接池）
+_grsai_service: Optional[GrsaiNanoBananaService] = None
+
+
+def get_grsai_service() -> GrsaiNanoBananaService:
+    """获取进程级单例服务，供 FastAPI 依赖注入使用"""
+    global _grsai_service
+    if _grsai_service is None:
+        _grsai_service = GrsaiNanoBananaService(
+            use_china_host=os.getenv("GRSAI_USE_CHINA_HOST", "true").lower() == "true"
+        )
+    return _grsai_service
 
 
 # 便捷函数
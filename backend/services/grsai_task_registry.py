@@ -0,0 +1,197 @@
+"""
+Grsai 任务登记表（webHook 回调模式）
+
+登记等待回调的任务，由 /api/v1/callbacks/grsai 完成，超时退回轮询；GRSAI_TASK_REGISTRY=redis 时跨 worker 转发回调结果
+"""
+import os
+import json
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from services.grsai_poller import parse_result_response
+
+
+REDIS_KEY_PREFIX = "grsai:task:"
+REDIS_CHANNEL = "grsai:task-results"
+
+
+def extract_task_payload(body: dict) -> dict:
+    """回调体可能是任务本身，也可能包在 {"code":0,"data":{...}} 里"""
+    data = body.get("data")
+    if isinstance(data, dict) and "id" in data:
+        return data
+    return body
+
+
+class GrsaiTaskRegistry:
+    """
+    上游 task_id -> 等待中的请求
+
+    使用示例:
+        task_id = await service.generate_with_webhook(..., webhook_url=callback_url)
+        result = await grsai_task_registry.wait(task_id, timeout=150)
+    """
+
+    def __init__(self, redis_url: str = None, result_ttl: float = 600.0, max_early_results: int = 1000):
+        """
+        Args:
+            redis_url: 不传则只用进程内存储
+            result_ttl: 回调结果的保留时间(秒)
+            max_early_results: 提前到达结果的最大暂存数量
+        """
+        self.redis_url = redis_url
+        self.result_ttl = result_ttl
+        self.max_early_results = max_early_results
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._early: "OrderedDict[str, tuple]" = OrderedDict()
+        self._redis = None
+        self._listener: Optional[asyncio.Task] = None
+        self.callbacks_received = 0
+        self.callbacks_matched = 0
+
+    # ============ 生命周期 ============
+
+    async def start(self):
+        """连接 Redis 并订阅结果频道（仅 Redis 模式）"""
+        if not self.redis_url or self._redis is not None:
+            return
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            print("⚠️ 未安装 redis，任务登记表使用进程内存储")
+            return
+
+        self._redis = aioredis.from_url(self.redis_url, decode_responses=True)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def aclose(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._listener = None
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    async def _listen(self):
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(REDIS_CHANNEL)
+        try:
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                task_id = message.get("data")
+                if task_id in self._pending:
+                    raw = await self._redis.get(REDIS_KEY_PREFIX + task_id)
+                    if raw:
+                        self._resolve(task_id, json.loads(raw))
+        finally:
+            await pubsub.aclose()
+
+    # ============ 登记 / 完成 ============
+
+    def _prune_early(self):
+        now = time.monotonic()
+        while self._early:
+            task_id, (_, expires_at) = next(iter(self._early.items()))
+            if expires_at > now and len(self._early) <= self.max_early_results:
+                break
+            self._early.popitem(last=False)
+
+    def _resolve(self, task_id: str, task: dict) -> bool:
+        """完成本地等待方；返回是否有等待方"""
+        future = self._pending.get(task_id)
+        if future is None or future.done():
+            return False
+        try:
+            result = parse_result_response({"data": task})
+        except Exception as e:
+            future.set_exception(e)
+            return True
+        if result is None:
+            return False
+        future.set_result(result)
+        return True
+
+    async def complete(self, body: dict) -> bool:
+        """
+        处理一次回调
+
+        Returns:
+            是否为终态回调（进度回调返回 False）
+        """
+        self.callbacks_received += 1
+        task = extract_task_payload(body)
+        task_id = task.get("id")
+        if not task_id or task.get("status") not in ("succeeded", "failed"):
+            return False
+
+        if self._resolve(task_id, task):
+            self.callbacks_matched += 1
+        else:
+            self._early[task_id] = (task, time.monotonic() + self.result_ttl)
+            self._prune_early()
+
+        if self._redis is not None:
+            await self._redis.set(REDIS_KEY_PREFIX + task_id, json.dumps(task), ex=int(self.result_ttl))
+            await self._redis.publish(REDIS_CHANNEL, task_id)
+        return True
+
+    def register(self, task_id: str) -> asyncio.Future:
+        """登记等待中的任务；同一 task_id 重复登记返回同一个 Future"""
+        future = self._pending.get(task_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[task_id] = future
+        early = self._early.pop(task_id, None)
+        if early is not None:
+            self._resolve(task_id, early[0])
+            self.callbacks_matched += 1
+        return future
+
+    def discard(self, task_id: str):
+        future = self._pending.pop(task_id, None)
+        if future is not None and not future.done():
+            future.cancel()
+
+    async def wait(self, task_id: str, timeout: float) -> dict:
+        """
+        等待回调完成任务
+
+        Returns:
+            succeeded 状态的结果 dict
+
+        Raises:
+            asyncio.TimeoutError: 截止时间内没有收到回调（调用方应退回轮询）
+            Exception: 任务失败
+        """
+        future = self.register(task_id)
+        try:
+            if self._redis is not None and not future.done():
+                # 回调可能已被其他 worker 收到
+                raw = await self._redis.get(REDIS_KEY_PREFIX + task_id)
+                if raw:
+                    self._resolve(task_id, json.loads(raw))
+            return await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        finally:
+            self.discard(task_id)
+
+    def stats(self) -> dict:
+        """登记表状态（用于监控）"""
+        return {
+            "backend": "redis" if self._redis is not None else "memory",
+            "pending": len(self._pending),
+            "early_results": len(self._early),
+            "callbacks_received": self.callbacks_received,
+            "callbacks_matched": self.callbacks_matched,
+        }
+
+
+grsai_task_registry = GrsaiTaskRegistry(
+    redis_url=os.getenv("REDIS_URL") if os.getenv("GRSAI_TASK_REGISTRY", "memory").lower() == "redis" else None,
+)
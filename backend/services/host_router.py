@@ -0,0 +1,234 @@
+"""
+上游多入口路由（按延迟选择 + 对冲请求）
+
+按首字节时间和错误率选择 Grsai 国内 / 海外入口，可选对冲提交（默认关闭：被取消的提交上游也可能已计费）
+"""
+import time
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
+
+import httpx
+
+
+T = TypeVar("T")
+
+
+class HostStats:
+    """单个入口的延迟与健康统计"""
+
+    EWMA_ALPHA = 0.3
+
+    def __init__(self, window: int = 100):
+        self.ttfb_ewma: Optional[float] = None
+        self.ttfb_samples: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=20)
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+
+    def record(self, ttfb: Optional[float], ok: bool):
+        self.requests += 1
+        self.outcomes.append(ok)
+        if ok:
+            self.consecutive_failures = 0
+            if ttfb is not None:
+                self.ttfb_samples.append(ttfb)
+                self.ttfb_ewma = ttfb if self.ttfb_ewma is None else (
+                    self.EWMA_ALPHA * ttfb + (1 - self.EWMA_ALPHA) * self.ttfb_ewma
+                )
+        else:
+            self.consecutive_failures += 1
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def p95(self) -> Optional[float]:
+        if len(self.ttfb_samples) < 5:
+            return None
+        ordered = sorted(self.ttfb_samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+class HostRouter:
+    """
+    使用示例:
+        router = HostRouter([HOST_CHINA, HOST_OVERSEAS], preferred=HOST_CHINA)
+        host = router.choose()
+        task_id = await router.hedged(lambda host: submit(host, payload))
+    """
+
+    def __init__(
+        self,
+        hosts: List[str],
+        preferred: str = None,
+        probe_path: str = "/",
+        probe_interval: float = 30.0,
+        max_error_rate: float = 0.5,
+        max_consecutive_failures: int = 3,
+        cooldown: float = 30.0,
+        hedge_min_delay: float = 0.2,
+        hedge_max_delay: float = 5.0,
+        hedge_default_delay: float = 1.5,
+    ):
+        """
+        Args:
+            hosts: 候选入口
+            preferred: 没有统计数据时优先使用的入口
+            probe_path: 探测路径（任何 HTTP 响应都视为可达）
+            probe_interval: 探测间隔(秒)
+            max_error_rate: 最近请求错误率超过该值视为不健康
+            max_consecutive_failures: 连续失败次数达到该值进入冷却
+            cooldown: 冷却时间(秒)
+            hedge_min_delay / hedge_max_delay: 对冲延迟的上下限(秒)
+            hedge_default_delay: 样本不足时的对冲延迟(秒)
+        """
+        self.hosts = list(hosts)
+        self.preferred = preferred or self.hosts[0]
+        self.probe_path = probe_path
+        self.probe_interval = probe_interval
+        self.max_error_rate = max_error_rate
+        self.max_consecutive_failures = max_consecutive_failures
+        self.cooldown = cooldown
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.hedge_default_delay = hedge_default_delay
+        self.stats_by_host: Dict[str, HostStats] = {host: HostStats() for host in self.hosts}
+        self._probe_task: Optional[asyncio.Task] = None
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    # ============ 统计 ============
+
+    def record(self, host: str, ttfb: Optional[float], ok: bool):
+        """记录一次请求结果（ttfb 为收到响应头的耗时）"""
+        stats = self.stats_by_host.get(host)
+        if stats is None:
+            return
+        stats.record(ttfb, ok)
+        if not ok and stats.consecutive_failures >= self.max_consecutive_failures:
+            stats.cooldown_until = time.monotonic() + self.cooldown
+
+    def is_healthy(self, host: str) -> bool:
+        stats = self.stats_by_host[host]
+        if stats.cooldown_until > time.monotonic():
+            return False
+        return stats.error_rate <= self.max_error_rate
+
+    def ranked(self, preferred: str = None) -> List[str]:
+        """按 健康 > TTFB 升序 > 是否首选 排序"""
+        preferred = preferred or self.preferred
+
+        def key(host: str):
+            stats = self.stats_by_host[host]
+            ttfb = stats.ttfb_ewma if stats.ttfb_ewma is not None else float("inf")
+            return (not self.is_healthy(host), ttfb, host != preferred)
+        return sorted(self.hosts, key=key)
+
+    def choose(self, preferred: str = None) -> str:
+        """当前最快的健康入口"""
+        return self.ranked(preferred)[0]
+
+    def hedge_delay(self, host: str) -> float:
+        p95 = self.stats_by_host[host].p95()
+        if p95 is None:
+            return self.hedge_default_delay
+        return max(self.hedge_min_delay, min(self.hedge_max_delay, p95))
+
+    # ============ 对冲请求 ============
+
+    async def hedged(
+        self,
+        call: Callable[[str], Awaitable[T]],
+        hedge: bool = True,
+        preferred: str = None,
+    ) -> T:
+        """
+        在最快入口上执行 call(host)；超过该入口 p95 仍未完成（或已失败）时
+        在第二个入口上再执行一次，返回先成功的结果并取消另一个
+        """
+        hosts = self.ranked(preferred)
+        primary = asyncio.create_task(call(hosts[0]))
+        tasks = [primary]
+        try:
+            if not hedge or len(hosts) < 2:
+                return await primary
+
+            await asyncio.wait({primary}, timeout=self.hedge_delay(hosts[0]))
+            if primary.done() and primary.exception() is None:
+                return primary.result()
+
+            self.hedges += 1
+            secondary = asyncio.create_task(call(hosts[1]))
+            tasks.append(secondary)
+            pending = {t for t in tasks if not t.done()}
+            errors = [primary.exception()] if primary.done() else []
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is secondary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    errors.append(task.exception())
+            raise errors[-1]
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    # ============ 探测 ============
+
+    async def probe(self, get_client: Callable[[str], httpx.AsyncClient]):
+        """探测所有入口一次"""
+        async def probe_one(host: str):
+            start = time.monotonic()
+            try:
+                client = get_client(host)
+                async with client.stream("GET", f"{host}{self.probe_path}", timeout=5) as response:
+                    self.record(host, time.monotonic() - start, response.status_code < 500)
+            except (httpx.HTTPError, asyncio.TimeoutError):
+                self.record(host, None, False)
+
+        await asyncio.gather(*(probe_one(host) for host in self.hosts))
+
+    async def start(self, get_client: Callable[[str], httpx.AsyncClient]):
+        """启动后台定期探测"""
+        if self._probe_task is not None or self.probe_interval <= 0:
+            return
+
+        async def loop():
+            while True:
+                await self.probe(get_client)
+                await asyncio.sleep(self.probe_interval)
+
+        self._probe_task = asyncio.create_task(loop())
+
+    async def aclose(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+    def stats(self) -> dict:
+        """各入口统计（用于监控）"""
+        return {
+            "hosts": {
+                host: {
+                    "healthy": self.is_healthy(host),
+                    "ttfb_ewma": stats.ttfb_ewma,
+                    "ttfb_p95": stats.p95(),
+                    "error_rate": stats.error_rate,
+                    "requests": stats.requests,
+                }
+                for host, stats in self.stats_by_host.items()
+            },
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
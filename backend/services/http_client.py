@@ -0,0 +1,108 @@
+"""
+共享 HTTP 连接池
+
+每个上游 host 一个进程级 httpx.AsyncClient（可选 HTTP/2），由 FastAPI 的 startup/shutdown 管理生命周期
+"""
+import os
+import asyncio
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+
+@dataclass
+class HTTPPoolConfig:
+    """连接池配置"""
+    max_connections: int = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+    max_keepalive_connections: int = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+    keepalive_expiry: float = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+    http2: bool = os.getenv("HTTP_ENABLE_HTTP2", "true").lower() == "true"
+    connect_timeout: float = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+    # 按 host 覆盖连接上限，如 {"grsai.dakka.com.cn": 100}
+    per_host_max_connections: Dict[str, int] = field(default_factory=dict)
+
+
+def _http2_available() -> bool:
+    """httpx 的 HTTP/2 支持依赖 h2 包"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class HTTPClientPool:
+    """
+    按 host 管理的共享 AsyncClient 池
+
+    使用示例:
+        client = http_client_pool.get_client("https://grsai.dakka.com.cn")
+        resp = await client.post("/v1/draw/result", json={...}, timeout=30)
+    """
+
+    def __init__(self, config: HTTPPoolConfig = None):
+        self.config = config or HTTPPoolConfig()
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._http2 = self.config.http2 and _http2_available()
+        if self.config.http2 and not self._http2:
+            print("[HTTPPool] 未安装 h2，回退到 HTTP/1.1 (pip install 'httpx[http2]')")
+
+    @staticmethod
+    def _host_key(base_url: str) -> str:
+        parts = urlsplit(base_url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def _build_client(self, host_key: str) -> httpx.AsyncClient:
+        netloc = urlsplit(host_key).netloc
+        max_connections = self.config.per_host_max_connections.get(
+            netloc, self.config.max_connections
+        )
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=min(self.config.max_keepalive_connections, max_connections),
+            keepalive_expiry=self.config.keepalive_expiry,
+        )
+        # 读超时由各调用按接口传入，这里只给默认值
+        timeout = httpx.Timeout(180.0, connect=self.config.connect_timeout)
+        return httpx.AsyncClient(
+            base_url=host_key,
+            http2=self._http2,
+            limits=limits,
+            timeout=timeout,
+        )
+
+    def get_client(self, base_url: str) -> httpx.AsyncClient:
+        """获取（必要时创建）某个 host 的共享 client"""
+        key = self._host_key(base_url)
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            client = self._build_client(key)
+            self._clients[key] = client
+        return client
+
+    def startup(self, *base_urls: str):
+        """预创建常用 host 的 client（FastAPI 启动时调用）"""
+        for base_url in base_urls:
+            self.get_client(base_url)
+
+    async def aclose(self):
+        """关闭所有连接（FastAPI 关闭时调用）"""
+        clients = list(self._clients.values())
+        self._clients.clear()
+        await asyncio.gather(*(c.aclose() for c in clients), return_exceptions=True)
+
+    def stats(self) -> dict:
+        """当前连接池概况"""
+        return {
+            "http2": self._http2,
+            "hosts": sorted(self._clients.keys()),
+            "max_connections": self.config.max_connections,
+            "max_keepalive_connections": self.config.max_keepalive_connections,
+            "keepalive_expiry": self.config.keepalive_expiry,
+        }
+
+
+# 全局连接池实例
+http_client_pool = HTTPClientPool()
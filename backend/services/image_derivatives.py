@@ -0,0 +1,368 @@
+"""
+上传图片的规范化与多分辨率衍生图
+
+上传后在后台解码一次：EXIF 方向、ICC -> sRGB，生成 thumb / work / 2k / original 衍生图阶梯，按内容寻址存储
+"""
+import os
+import io
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+from PIL import Image, ImageOps
+from sqlalchemy import Column, String, Integer, DateTime
+
+from services.database import db_manager, Base
+from services.upload_store import CONTENT_ADDRESSED_NAME
+
+try:
+    from PIL import ImageCms
+except ImportError:  # Pillow 未编译 littlecms 时跳过色彩空间转换
+    ImageCms = None
+
+
+# 阶梯：名称 -> 最长边（None 表示原始尺寸），从大到小排列
+RUNGS = {
+    "original": None,
+    "2k": 2048,
+    "work": 1024,
+    "thumb": 256,
+}
+
+EXIF_ORIENTATION = 0x0112
+
+
+class ImageDerivativeModel(Base):
+    """上传图片的衍生图记录"""
+    __tablename__ = "image_derivatives"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    sha256 = Column(String(64), unique=True, nullable=False, index=True)
+    source_filename = Column(String(128), nullable=False)
+    width = Column(Integer)   # 规范化（旋转）后的尺寸
+    height = Column(Integer)
+    original_url = Column(String(512))
+    url_2k = Column(String(512))
+    work_url = Column(String(512))
+    thumb_url = Column(String(512))
+    created_at = Column(DateTime, default=datetime.now)
+
+
+@dataclass
+class DerivativeSet:
+    """一张上传图片的全部衍生图（URL 为 /static/ 相对路径）"""
+    sha256: str
+    width: int
+    height: int
+    urls: Dict[str, str] = field(default_factory=dict)
+
+    def url(self, rung: str) -> Optional[str]:
+        return self.urls.get(rung)
+
+
+def upload_sha256(url: str) -> Optional[str]:
+    """
+    从上传图片 URL（或本地路径）取出内容哈希；不是内容寻址上传文件时返回 None
+
+    支持 http://host/static/uploads/<sha>.jpg、/static/uploads/<sha>.jpg 和 static/uploads/<sha>.jpg
+    """
+    if not url or url.startswith("data:"):
+        return None
+    path = urlparse(url).path if "://" in url else url
+    parent, _, name = path.rstrip("/").rpartition("/")
+    if not parent.endswith("static/uploads"):
+        return None
+    match = CONTENT_ADDRESSED_NAME.match(name)
+    return match.group(1) if match else None
+
+
+def normalize_image(image: Image.Image) -> Image.Image:
+    """EXIF 方向 + ICC -> sRGB + 统一模式（RGB，有透明通道时 RGBA）"""
+    icc_profile = image.info.get("icc_profile")
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+    target_mode = "RGBA" if has_alpha else "RGB"
+
+    if icc_profile and ImageCms is not None:
+        try:
+            source = ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert(target_mode)
+            image = ImageCms.profileToProfile(
+                image, source, ImageCms.createProfile("sRGB"), outputMode=target_mode
+            )
+        except Exception as e:
+            print(f"⚠️ ICC 配置文件转换失败，按 sRGB 处理: {e}")
+
+    if image.mode != target_mode:
+        image = image.convert(target_mode)
+    image.info.pop("icc_profile", None)
+    return image
+
+
+class DerivativeStore:
+    """
+    衍生图生成与查询
+
+    生成在线程池中执行；同一张图片同时只生成一次，查询时如果还在生成会等待，
+    还没生成（例如服务重启前上传的图片）会当场生成。
+    """
+
+    def __init__(self, source_dir: Path, output_dir: Path = None, workers: int = 2, quality: int = 90):
+        """
+        Args:
+            source_dir: 上传文件目录（static/uploads）
+            output_dir: 衍生图目录（默认 source_dir/derived）
+            workers: 后台生成线程数
+            quality: JPEG 质量
+        """
+        self.source_dir = Path(source_dir)
+        self.output_dir = Path(output_dir) if output_dir else self.source_dir / "derived"
+        self.quality = quality
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="derivative")
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Future] = {}
+        self._table_ready = False
+        # 指标
+        self.generated = 0
+        self.reused = 0
+        self.failures = 0
+
+    def _ensure_table(self):
+        if not self._table_ready:
+            db_manager.init()
+            ImageDerivativeModel.__table__.create(db_manager.get_engine(), checkfirst=True)
+            self._table_ready = True
+
+    # ============ 生成 ============
+
+    def schedule(self, filename: str) -> Optional[Future]:
+        """提交后台生成（上传接口调用，不等待）；不是内容寻址文件名时返回 None"""
+        match = CONTENT_ADDRESSED_NAME.match(filename)
+        if not match:
+            return None
+        sha256 = match.group(1)
+        with self._lock:
+            future = self._pending.get(sha256)
+            if future is None:
+                future = self._executor.submit(self._build_guarded, filename)
+                self._pending[sha256] = future
+                future.add_done_callback(lambda _: self._forget(sha256))
+        return future
+
+    def _forget(self, sha256: str):
+        with self._lock:
+            self._pending.pop(sha256, None)
+
+    def _build_guarded(self, filename: str) -> Optional[DerivativeSet]:
+        try:
+            return self.build(filename)
+        except Exception as e:
+            self.failures += 1
+            print(f"⚠️ 衍生图生成失败 {filename}: {e}")
+            return None
+
+    def build(self, filename: str) -> DerivativeSet:
+        """同步生成全部衍生图并写入数据库（已存在时直接返回记录）"""
+        sha256 = CONTENT_ADDRESSED_NAME.match(filename).group(1)
+        existing = self.lookup(sha256)
+        if existing and all(self._exists(url) for url in existing.urls.values()):
+            self.reused += 1
+            return existing
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        source_path = self.source_dir / filename
+        with Image.open(source_path) as source:
+            if getattr(source, "n_frames", 1) > 1:
+                source.seek(0)  # 动图只取第一帧
+            reuse_original = self._is_normalized(source)
+            width, height = source.size
+            if reuse_original:
+                # 只需要 2k 及以下的尺寸：JPEG 在解码阶段按 1/2、1/4、1/8 缩小，省去大部分解码开销
+                source.draft("RGB", (RUNGS["2k"], RUNGS["2k"]))
+            image = normalize_image(source)
+            if not reuse_original:
+                width, height = image.size
+
+        urls = {}
+        if reuse_original:
+            urls["original"] = f"/static/uploads/{filename}"
+        else:
+            urls["original"] = self._save(image, sha256, "original")
+
+        # 从大到小逐级缩放，每一级都从上一级缩小
+        larger = "original"
+        for rung, size in RUNGS.items():
+            if size is None:
+                continue
+            if max(width, height) <= size:
+                urls[rung] = urls[larger]  # 原图不大于该尺寸，直接复用上一级
+                continue
+            if max(image.size) > size:
+                image = self._resize(image, size)
+            urls[rung] = self._save(image, sha256, rung)
+            larger = rung
+
+        derivatives = DerivativeSet(sha256=sha256, width=width, height=height, urls=urls)
+        self._record(filename, derivatives)
+        self.generated += 1
+        return derivatives
+
+    @staticmethod
+    def _is_normalized(image: Image.Image) -> bool:
+        """原图已经是正向 sRGB 的 RGB JPEG/PNG 时可以直接作为 original"""
+        orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+        return (
+            image.format in ("JPEG", "PNG")
+            and image.mode in ("RGB", "L")
+            and orientation in (0, 1)
+            and not image.info.get("icc_profile")
+        )
+
+    @staticmethod
+    def _resize(image: Image.Image, size: int) -> Image.Image:
+        ratio = size / max(image.size)
+        new_size = (max(1, round(image.width * ratio)), max(1, round(image.height * ratio)))
+        return image.resize(new_size, Image.Resampling.LANCZOS)
+
+    def _save(self, image: Image.Image, sha256: str, rung: str) -> str:
+        """写入衍生图（先写临时文件再原子重命名），返回 /static/ 相对 URL"""
+        ext = "png" if image.mode == "RGBA" else "jpg"
+        name = f"{sha256}_{rung}.{ext}"
+        path = self.output_dir / name
+        if not path.exists():
+            tmp_path = path.with_name(f".{name}.{threading.get_ident()}.tmp")
+            if ext == "png":
+                image.save(tmp_path, format="PNG", optimize=True)
+            else:
+                image.save(tmp_path, format="JPEG", quality=self.quality, optimize=True)
+            os.replace(tmp_path, path)
+        return f"/static/uploads/{self.output_dir.name}/{name}"
+
+    def _record(self, filename: str, derivatives: DerivativeSet):
+        self._ensure_table()
+        try:
+            with db_manager.get_session() as session:
+                record = session.query(ImageDerivativeModel).filter_by(sha256=derivatives.sha256).first()
+                if record is None:
+                    record = ImageDerivativeModel(sha256=derivatives.sha256, source_filename=filename)
+                    session.add(record)
+                record.width = derivatives.width
+                record.height = derivatives.height
+                record.original_url = derivatives.urls["original"]
+                record.url_2k = derivatives.urls["2k"]
+                record.work_url = derivatives.urls["work"]
+                record.thumb_url = derivatives.urls["thumb"]
+        except Exception as e:
+            # 并发上传同一张图片时另一个进程可能已写入
+            print(f"⚠️ 衍生图记录写入失败: {e}")
+
+    # ============ 查询 ============
+
+    def lookup(self, sha256: str) -> Optional[DerivativeSet]:
+        """从数据库读取衍生图记录"""
+        self._ensure_table()
+        with db_manager.get_session() as session:
+            record = session.query(ImageDerivativeModel).filter_by(sha256=sha256).first()
+            if record is None:
+                return None
+            return DerivativeSet(
+                sha256=record.sha256,
+                width=record.width,
+                height=record.height,
+                urls={
+                    "original": record.original_url,
+                    "2k": record.url_2k,
+                    "work": record.work_url,
+                    "thumb": record.thumb_url,
+                },
+            )
+
+    def get(self, sha256: str, filename: str = None, timeout: float = 60) -> Optional[DerivativeSet]:
+        """取得衍生图：正在后台生成时等待，还没有时当场生成（需要 filename）"""
+        with self._lock:
+            future = self._pending.get(sha256)
+        if future is not None:
+            result = future.result(timeout=timeout)
+            if result is not None:
+                return result
+        existing = self.lookup(sha256)
+        if existing and all(self._exists(url) for url in existing.urls.values()):
+            return existing
+        if filename is None:
+            filename = self._find_source(sha256)
+        if filename is None:
+            return None
+        return self.build(filename)
+
+    def resolve(self, url: str, rung: str = "work") -> Optional[Path]:
+        """
+        上传图片 URL -> 指定衍生图的本地路径；不是上传图片或生成失败时返回 None，
+        调用方按原来的方式处理
+        """
+        sha256 = upload_sha256(url)
+        if sha256 is None:
+            return None
+        try:
+            derivatives = self.get(sha256)
+        except Exception as e:
+            print(f"⚠️ 衍生图不可用 {url}: {e}")
+            return None
+        if derivatives is None:
+            return None
+        return self._local_path(derivatives.url(rung))
+
+    def resolve_for_size(self, url: str, size: int) -> Optional[Path]:
+        """取最长边不小于 size 的最小一级衍生图"""
+        rung = "original"
+        for name, rung_size in RUNGS.items():
+            if rung_size is not None and rung_size >= size:
+                rung = name
+        return self.resolve(url, rung)
+
+    def thumbnail_url(self, url: str) -> Optional[str]:
+        """上传图片的缩略图 URL（只查已有记录，不触发生成）"""
+        sha256 = upload_sha256(url)
+        if sha256 is None:
+            return None
+        try:
+            derivatives = self.lookup(sha256)
+        except Exception:
+            return None
+        return derivatives.url("thumb") if derivatives else None
+
+    def _find_source(self, sha256: str) -> Optional[str]:
+        for ext in ("jpg", "png", "webp", "gif"):
+            if (self.source_dir / f"{sha256}.{ext}").exists():
+                return f"{sha256}.{ext}"
+        return None
+
+    def _local_path(self, url: Optional[str]) -> Optional[Path]:
+        if not url or not url.startswith("/static/uploads/"):
+            return None
+        return self.source_dir / url[len("/static/uploads/"):]
+
+    def _exists(self, url: Optional[str]) -> bool:
+        path = self._local_path(url)
+        return path is not None and path.exists()
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "generated": self.generated,
+            "reused": self.reused,
+            "failures": self.failures,
+            "pending": pending,
+        }
+
+
+derivative_store = DerivativeStore(
+    Path(__file__).parent.parent / "static" / "uploads",
+    workers=int(os.getenv("DERIVATIVE_WORKERS", "2")),
+    quality=int(os.getenv("DERIVATIVE_QUALITY", "90")),
+)
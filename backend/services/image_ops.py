@@ -0,0 +1,307 @@
+"""
+图片处理执行器
+
+把局部重绘的解码、缩放、mask 合并、PNG 编码等 CPU 密集操作放到进程池（或线程池）执行，并按操作名记录耗时
+"""
+import os
+import io
+import time
+import base64
+import asyncio
+import multiprocessing
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Callable, Deque, Dict, List
+
+
+# backend 目录（/static/... 相对于此）
+BACKEND_DIR = Path(__file__).parent.parent
+
+
+# ============ 图片操作（在执行器中运行） ============
+
+def _decode_data_url(data: str) -> tuple:
+    """data URL -> (header, bytes)，容忍空白字符、URL 安全编码和缺失的 padding"""
+    header, b64_data = data.split(",", 1)
+    b64_data = b64_data.strip().replace(' ', '+').replace('\n', '').replace('\r', '')
+    missing_padding = len(b64_data) % 4
+    if missing_padding:
+        b64_data += '=' * (4 - missing_padding)
+    return header, base64.b64decode(b64_data)
+
+
+def compress_image_base64(data: str, max_size: int = 1024) -> str:
+    """压缩 data URL 图片到指定最大尺寸（不是 data URL 时原样返回）"""
+    from PIL import Image
+
+    if not data.startswith("data:"):
+        return data
+
+    try:
+        header, img_bytes = _decode_data_url(data)
+    except Exception as e:
+        print(f"[Inpaint] base64解码失败: {e}, 数据前100字符: {data[:100]}")
+        raise
+
+    try:
+        img = Image.open(io.BytesIO(img_bytes))
+    except Exception as e:
+        print(f"[Inpaint] PIL无法识别图片: {e}, 数据长度: {len(img_bytes)}, 前16字节: {img_bytes[:16]}")
+        raise
+
+    ratio = min(max_size / img.width, max_size / img.height, 1.0)
+    if ratio < 1.0:
+        new_size = (int(img.width * ratio), int(img.height * ratio))
+        img = img.resize(new_size, Image.Resampling.LANCZOS)
+
+    buffer = io.BytesIO()
+    img_format = "PNG" if "png" in header else "JPEG"
+    img.save(buffer, format=img_format, quality=85)
+    return f"{header},{base64.b64encode(buffer.getvalue()).decode()}"
+
+
+def url_to_base64(url: str, prefix: str = "data:image/png;base64,") -> str:
+    """本地静态文件 URL（/static/... 或 localhost）转 data URL；找不到文件时返回空字符串"""
+    if url.startswith("data:"):
+        return url
+
+    local_path = None
+    if url.startswith("/static/"):
+        local_path = url.lstrip("/")
+    elif "localhost" in url or "127.0.0.1" in url:
+        local_path = url.replace("http://localhost:8000/static/", "static/")
+        local_path = local_path.replace("http://127.0.0.1:8000/static/", "static/")
+        local_path = local_path.replace("http://localhost:3000/static/", "static/")
+
+    if local_path:
+        candidates = dict.fromkeys([
+            BACKEND_DIR / local_path,
+            BACKEND_DIR / "static" / "masks" / Path(local_path).name,
+            BACKEND_DIR / local_path.replace("static/", ""),
+        ])
+        for path in candidates:
+            if path.exists():
+                return prefix + base64.b64encode(path.read_bytes()).decode()
+            print(f"[url_to_base64] 文件不存在: {path}")
+
+    print(f"[url_to_base64] 无法找到文件: {url}")
+    return ""
+
+
+# 灰度 >= 此值视为 mask 区域（彩色可视化 mask 转灰度后最低约 100，JPEG 噪声远低于此）
+MASK_THRESHOLD = 64
+
+
+def _mask_from_image(image):
+    """任意 mask 图片 -> CompactMask"""
+    import numpy as np
+    from services.compact_mask import CompactMask
+
+    return CompactMask.from_array(np.asarray(image.convert('L')) >= MASK_THRESHOLD)
+
+
+def _fit_mask(mask, height: int, width: int):
+    """缩小用最近邻；放大（工作分辨率的 mask 对齐更大的图）按包围框局部平滑放大"""
+    if height > mask.height or width > mask.width:
+        return mask.upsample(height, width)
+    return mask.resize(height, width)
+
+
+def _union_masks(masks: list, max_size: int = 1024):
+    """在紧凑形式上求并集：第一张缩放到不超过 max_size，其余对齐到同一尺寸后按位或"""
+    first = masks[0]
+    ratio = min(max_size / first.width, max_size / first.height, 1.0)
+    height, width = int(first.height * ratio), int(first.width * ratio)
+
+    merged = first.resize(height, width)
+    for mask in masks[1:]:
+        merged = merged | _fit_mask(mask, height, width)
+    return merged
+
+
+def _encode_mask_png(mask) -> str:
+    """CompactMask -> 黑白 PNG data URL（白色 255 = 编辑区域）"""
+    import numpy as np
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.fromarray(mask.to_array().astype(np.uint8) * 255, mode='L').save(buffer, format='PNG')
+    return f"data:image/png;base64,{base64.b64encode(buffer.getvalue()).decode()}"
+
+
+def merge_masks(mask_data_list: List[str], max_size: int = 1024) -> str:
+    """合并多个黑白 mask（data URL），白色区域叠加"""
+    from PIL import Image
+
+    if len(mask_data_list) == 1:
+        return mask_data_list[0]
+
+    masks = [
+        _mask_from_image(Image.open(io.BytesIO(_decode_data_url(mask_data)[1])))
+        for mask_data in mask_data_list if mask_data.startswith("data:")
+    ]
+    if not masks:
+        return mask_data_list[0]
+    return _encode_mask_png(_union_masks(masks, max_size))
+
+
+def _load_mask(ref: str):
+    """mask 引用 -> CompactMask：mask 存储的 URL 直接读位图，其余按 data URL / 本地文件解码"""
+    from PIL import Image
+    from services.mask_store import MaskNotFound, mask_store, parse_mask_url
+
+    mask_id = parse_mask_url(ref)
+    if mask_id is not None:
+        try:
+            return mask_store.get(mask_id)
+        except MaskNotFound:
+            print(f"[Inpaint] mask 不存在: {mask_id}")
+            return None
+    if not ref.startswith("data:"):
+        ref = url_to_base64(ref)
+    if not ref.startswith("data:"):
+        return None
+    return _mask_from_image(Image.open(io.BytesIO(_decode_data_url(ref)[1])))
+
+
+def prepare_inpaint_mask(mask_list: List[str], max_size: int = 1024) -> str:
+    """局部重绘的 mask：读取 -> 紧凑形式求并集 -> 编码 PNG，一次在执行器里完成；没有有效 mask 时返回空字符串"""
+    masks = []
+    for mask in mask_list:
+        compact = _load_mask(str(mask))
+        if compact is not None:
+            masks.append(compact)
+        else:
+            print(f"[Inpaint] 警告: mask 转换失败，跳过: {str(mask)[:50]}")
+    if not masks:
+        return ""
+    return _encode_mask_png(_union_masks(masks, max_size))
+
+
+def prepare_inpaint_image(image_url: str, max_size: int = 1024) -> str:
+    """局部重绘的原图：本地 URL 转 base64 后压缩（远程 URL 原样返回）"""
+    if not image_url.startswith("data:"):
+        converted = url_to_base64(image_url, "data:image/jpeg;base64,")
+        image_url = converted or image_url
+    return compress_image_base64(image_url, max_size=max_size)
+
+
+def read_file_base64(path: str, prefix: str) -> str:
+    """读取本地文件为 data URL"""
+    return prefix + base64.b64encode(Path(path).read_bytes()).decode()
+
+
+# ============ 执行器 ============
+
+class _OpStats:
+    """单个操作的耗时统计"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.samples: Deque[float] = deque(maxlen=200)
+
+    def record(self, elapsed: float, ok: bool):
+        self.calls += 1
+        if not ok:
+            self.errors += 1
+        self.total_seconds += elapsed
+        self.max_seconds = max(self.max_seconds, elapsed)
+        self.samples.append(elapsed)
+
+    def snapshot(self) -> dict:
+        ordered = sorted(self.samples)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else 0.0
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_ms": round(self.total_seconds / self.calls * 1000, 1) if self.calls else 0.0,
+            "p95_ms": round(p95 * 1000, 1),
+            "max_ms": round(self.max_seconds * 1000, 1),
+        }
+
+
+class ImageOpsExecutor:
+    """
+    CPU 密集图片操作的执行器（进程池或线程池），执行器在第一次使用时创建
+    """
+
+    def __init__(self, mode: str = "process", workers: int = 2, start_method: str = "spawn"):
+        """
+        Args:
+            mode: process（进程池）或 thread（线程池）
+            workers: 并发数
+            start_method: 进程启动方式
+        """
+        self.mode = mode if mode in ("process", "thread") else "process"
+        self.workers = max(1, workers)
+        self.start_method = start_method
+        self._executor: Executor = None
+        self._ops: Dict[str, _OpStats] = {}
+        self.restarts = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.mode == "process":
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="image-ops")
+        return self._executor
+
+    def start(self):
+        """预先创建执行器（进程池预热子进程，避免第一次请求承担启动开销）"""
+        executor = self._get_executor()
+        if self.mode == "process":
+            for _ in range(self.workers):
+                executor.submit(time.sleep, 0)
+
+    async def run(self, name: str, fn: Callable, *args):
+        """在执行器中运行 fn(*args) 并记录耗时；子进程崩溃时重建进程池并重试一次"""
+        loop = asyncio.get_running_loop()
+        stats = self._ops.setdefault(name, _OpStats())
+        started = time.monotonic()
+        ok = False
+        try:
+            try:
+                result = await loop.run_in_executor(self._get_executor(), fn, *args)
+            except BrokenProcessPool:
+                self._reset()
+                result = await loop.run_in_executor(self._get_executor(), fn, *args)
+            ok = True
+            return result
+        finally:
+            stats.record(time.monotonic() - started, ok)
+
+    def _reset(self):
+        print("⚠️ 图片处理进程池异常退出，重建")
+        self.restarts += 1
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "restarts": self.restarts,
+            "ops": {name: stats.snapshot() for name, stats in self._ops.items()},
+        }
+
+
+image_ops = ImageOpsExecutor(
+    mode=os.getenv("IMAGE_OPS_MODE", "process").lower(),
+    workers=int(os.getenv("IMAGE_OPS_WORKERS") or min(4, os.cpu_count() or 1)),
+    start_method=os.getenv("IMAGE_OPS_START_METHOD", "spawn"),
+)
@@ -9,6 +9,8 @@ import requests
 from typing import Optional
 from dataclasses import dataclass
 
+from services.rate_limiter import upstream_limits
+
 
 @dataclass
 class InpaintingResult:
@@ -120,34 +122,35 @@ class InpaintingService:
         }
         
         try:
-            resp = requests.post(
-                f"{self.BASE_URL}/predictions",
-                headers=self.headers,
-                json=payload,
-                timeout=120
-            )
-            resp.raise_for_status()
-            result = resp.json()
+            with upstream_limits.limit_sync("replicate", self.MODEL):
+                resp = requests.post(
+                    f"{self.BASE_URL}/predictions",
+                    headers=self.headers,
+                    json=payload,
+                    timeout=120
+                )
+                resp.raise_for_status()
+                result = resp.json()
             
-            if result.get("status") == "succeeded":
-                output = result.get("output")
-                image_url = output[0] if isinstance(output, list) else output
+                if result.get("status") == "succeeded":
+                    output = result.get("output")
+                    image_url = output[0] if isinstance(output, list) else output
                 
-                return InpaintingResult(
-                    success=True,
-                    image_url=image_url,
-                    request_id=result.get("id"),
-                    cost=self.COST_PER_RUN,
-                    elapsed_seconds=time.time() - start_time
-                )
-            elif result.get("status") == "failed":
-                return InpaintingResult(
-                    success=False,
-                    error=result.get("error", "Inpainting failed"),
-                    elapsed_seconds=time.time() - start_time
-                )
-            else:
-                return self._poll_result(result.get("id"), start_time)
+                    return InpaintingResult(
+                        success=True,
+                        image_url=image_url,
+                        request_id=result.get("id"),
+                        cost=self.COST_PER_RUN,
+                        elapsed_seconds=time.time() - start_time
+                    )
+                elif result.get("status") == "failed":
+                    return InpaintingResult(
+                        success=False,
+                        error=result.get("error", "Inpainting failed"),
+                        elapsed_seconds=time.time() - start_time
+                    )
+                else:
+                    return self._poll_result(result.get("id"), start_time)
                 
         except Exception as e:
             return InpaintingResult(
@@ -0,0 +1,552 @@
+"""
+生成任务队列（异步提交 + 后台 worker 池）
+
+任务写入 generation_jobs 表并立即返回 job_id，worker 以租约认领执行，支持重试、取消和崩溃后重新排队，可选 Redis 通知
+"""
+import os
+import json
+import uuid
+import random
+import asyncio
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from dataclasses import dataclass
+from enum import Enum
+
+from sqlalchemy import Column, Integer, String, Float, Text, DateTime, Index, Enum as SQLEnum, func, update
+
+from services.database import db_manager, Base
+
+
+REDIS_CHANNEL = "nanobanana:jobs"
+
+
+class JobStatus(str, Enum):
+    """生成任务（generation_jobs）的状态，与 models.TaskStatus / grsai_service.TaskStatus 无关"""
+    PENDING = "pending"
+    QUEUED = "queued"
+    PROCESSING = "processing"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+# 已结束的状态
+FINISHED_STATUSES = (JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.CANCELLED)
+
+
+class PermanentJobError(Exception):
+    """不需要重试的失败（参数错误、积分不足等）"""
+
+
+class GenerationJobModel(Base):
+    """生成任务队列表"""
+    __tablename__ = "generation_jobs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_uuid = Column(String(64), unique=True, nullable=False, index=True)
+    user_id = Column(String(64), index=True)
+
+    # 任务参数
+    kind = Column(String(32), nullable=False, default="generate")
+    params = Column(Text, nullable=False)  # JSON
+
+    # API调用（与 generation_tasks 对齐）
+    api_provider = Column(String(32))
+    api_request_id = Column(String(128))
+    api_cost = Column(Float, default=0)
+
+    # 状态
+    status = Column(SQLEnum(JobStatus), default=JobStatus.QUEUED)
+    error_message = Column(Text)
+    result = Column(Text)  # JSON
+
+    # 调度
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    next_run_at = Column(DateTime, default=datetime.now)
+    lease_until = Column(DateTime)
+    worker_id = Column(String(64))
+    cancel_requested = Column(Integer, default=0)
+
+    # 时间
+    started_at = Column(DateTime)
+    completed_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        Index('idx_job_queue', 'status', 'next_run_at'),
+    )
+
+
+@dataclass
+class JobInfo:
+    """任务信息DTO"""
+    job_id: str
+    kind: str
+    user_id: Optional[str]
+    status: str
+    attempts: int
+    max_attempts: int
+    params: dict
+    result: Optional[dict]
+    error: Optional[str]
+    provider: Optional[str]
+    cancel_requested: bool
+    next_run_at: Optional[datetime]
+    started_at: Optional[datetime]
+    completed_at: Optional[datetime]
+    created_at: datetime
+
+
+@dataclass
+class ClaimedJob:
+    """worker 认领到的任务"""
+    job_id: str
+    kind: str
+    params: dict
+    attempts: int
+    max_attempts: int
+
+
+class JobStore:
+    """任务表读写（同步，worker 通过 asyncio.to_thread 调用）"""
+
+    def __init__(self):
+        self._table_ready = False
+
+    def ensure_table(self):
+        if not self._table_ready:
+            db_manager.init()
+            GenerationJobModel.__table__.create(db_manager.get_engine(), checkfirst=True)
+            self._table_ready = True
+
+    def _to_info(self, record: GenerationJobModel) -> JobInfo:
+        return JobInfo(
+            job_id=record.job_uuid,
+            kind=record.kind,
+            user_id=record.user_id,
+            status=record.status.value if record.status else JobStatus.QUEUED.value,
+            attempts=record.attempts or 0,
+            max_attempts=record.max_attempts or 1,
+            params=json.loads(record.params) if record.params else {},
+            result=json.loads(record.result) if record.result else None,
+            error=record.error_message,
+            provider=record.api_provider,
+            cancel_requested=bool(record.cancel_requested),
+            next_run_at=record.next_run_at,
+            started_at=record.started_at,
+            completed_at=record.completed_at,
+            created_at=record.created_at,
+        )
+
+    def create(self, kind: str, params: dict, user_id: str = None, max_attempts: int = 3) -> JobInfo:
+        self.ensure_table()
+        with db_manager.get_session() as session:
+            record = GenerationJobModel(
+                job_uuid=uuid.uuid4().hex,
+                user_id=str(user_id) if user_id is not None else None,
+                kind=kind,
+                params=json.dumps(params, ensure_ascii=False),
+                status=JobStatus.QUEUED,
+                attempts=0,
+                max_attempts=max_attempts,
+                next_run_at=datetime.now(),
+                created_at=datetime.now(),
+            )
+            session.add(record)
+            session.flush()
+            return self._to_info(record)
+
+    def get(self, job_id: str) -> Optional[JobInfo]:
+        self.ensure_table()
+        with db_manager.get_session() as session:
+            record = session.query(GenerationJobModel).filter_by(job_uuid=job_id).first()
+            return self._to_info(record) if record else None
+
+    def claim(self, worker_id: str, lease_seconds: float) -> Optional[ClaimedJob]:
+        """认领一个到期的排队任务；条件 UPDATE 保证同一任务只被一个 worker 认领"""
+        self.ensure_table()
+        now = datetime.now()
+        with db_manager.get_session() as session:
+            candidates = (
+                session.query(GenerationJobModel.id)
+                .filter(GenerationJobModel.status == JobStatus.QUEUED, GenerationJobModel.next_run_at <= now)
+                .order_by(GenerationJobModel.next_run_at, GenerationJobModel.id)
+                .limit(5)
+                .all()
+            )
+            for (job_pk,) in candidates:
+                claimed = session.execute(
+                    update(GenerationJobModel)
+                    .where(GenerationJobModel.id == job_pk, GenerationJobModel.status == JobStatus.QUEUED)
+                    .values(
+                        status=JobStatus.PROCESSING,
+                        worker_id=worker_id,
+                        attempts=GenerationJobModel.attempts + 1,
+                        lease_until=now + timedelta(seconds=lease_seconds),
+                        started_at=now,
+                        updated_at=now,
+                    )
+                ).rowcount
+                if claimed == 1:
+                    record = session.get(GenerationJobModel, job_pk)
+                    session.refresh(record)
+                    return ClaimedJob(
+                        job_id=record.job_uuid,
+                        kind=record.kind,
+                        params=json.loads(record.params),
+                        attempts=record.attempts,
+                        max_attempts=record.max_attempts or 1,
+                    )
+        return None
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        """续租；返回是否已请求取消（或任务已不属于该 worker）"""
+        with db_manager.get_session() as session:
+            renewed = session.execute(
+                update(GenerationJobModel)
+                .where(
+                    GenerationJobModel.job_uuid == job_id,
+                    GenerationJobModel.worker_id == worker_id,
+                    GenerationJobModel.status == JobStatus.PROCESSING,
+                )
+                .values(lease_until=datetime.now() + timedelta(seconds=lease_seconds))
+            ).rowcount
+            if renewed != 1:
+                return True
+            record = session.query(GenerationJobModel).filter_by(job_uuid=job_id).first()
+            return bool(record.cancel_requested)
+
+    def _finish(self, job_id: str, worker_id: str, **values) -> bool:
+        with db_manager.get_session() as session:
+            return session.execute(
+                update(GenerationJobModel)
+                .where(
+                    GenerationJobModel.job_uuid == job_id,
+                    GenerationJobModel.worker_id == worker_id,
+                    GenerationJobModel.status == JobStatus.PROCESSING,
+                )
+                .values(lease_until=None, updated_at=datetime.now(), **values)
+            ).rowcount == 1
+
+    def complete(self, job_id: str, worker_id: str, result: dict) -> bool:
+        return self._finish(
+            job_id, worker_id,
+            status=JobStatus.COMPLETED,
+            result=json.dumps(result, ensure_ascii=False, default=str),
+            api_provider=result.get("provider"),
+            api_request_id=result.get("task_id"),
+            api_cost=result.get("cost_rmb") or 0,
+            error_message=None,
+            completed_at=datetime.now(),
+        )
+
+    def fail(self, job_id: str, worker_id: str, error: str, retry_at: datetime = None) -> bool:
+        """执行失败：retry_at 不为空时重新排队，否则标记失败"""
+        if retry_at is not None:
+            return self._finish(job_id, worker_id, status=JobStatus.QUEUED, error_message=error, next_run_at=retry_at)
+        return self._finish(job_id, worker_id, status=JobStatus.FAILED, error_message=error, completed_at=datetime.now())
+
+    def mark_cancelled(self, job_id: str, worker_id: str) -> bool:
+        return self._finish(job_id, worker_id, status=JobStatus.CANCELLED, completed_at=datetime.now())
+
+    def release(self, job_id: str, worker_id: str) -> bool:
+        """进程关闭时归还执行中的任务，本次不计入执行次数"""
+        return self._finish(
+            job_id, worker_id,
+            status=JobStatus.QUEUED,
+            attempts=GenerationJobModel.attempts - 1,
+            next_run_at=datetime.now(),
+        )
+
+    def request_cancel(self, job_id: str) -> Tuple[bool, str]:
+        """排队中的任务直接取消；执行中的任务标记取消，由执行它的 worker 处理"""
+        self.ensure_table()
+        with db_manager.get_session() as session:
+            record = session.query(GenerationJobModel).filter_by(job_uuid=job_id).first()
+            if not record:
+                return False, "任务不存在"
+            if record.status in FINISHED_STATUSES:
+                return False, "任务已结束"
+            if record.status == JobStatus.PROCESSING:
+                record.cancel_requested = 1
+                return True, "正在取消"
+            record.status = JobStatus.CANCELLED
+            record.completed_at = datetime.now()
+            return True, "已取消"
+
+    def retry(self, job_id: str) -> Tuple[bool, str]:
+        """失败或已取消的任务重新排队（重新计算执行次数）"""
+        self.ensure_table()
+        with db_manager.get_session() as session:
+            record = session.query(GenerationJobModel).filter_by(job_uuid=job_id).first()
+            if not record:
+                return False, "任务不存在"
+            if record.status not in (JobStatus.FAILED, JobStatus.CANCELLED):
+                return False, "只能重试失败或已取消的任务"
+            record.status = JobStatus.QUEUED
+            record.attempts = 0
+            record.cancel_requested = 0
+            record.error_message = None
+            record.next_run_at = datetime.now()
+            record.completed_at = None
+            return True, "已重新排队"
+
+    def recover_expired(self) -> int:
+        """租约过期的执行中任务（worker 崩溃 / 重启）重新排队，次数用完的标记失败"""
+        self.ensure_table()
+        now = datetime.now()
+        recovered = 0
+        with db_manager.get_session() as session:
+            expired = (
+                session.query(GenerationJobModel)
+                .filter(GenerationJobModel.status == JobStatus.PROCESSING, GenerationJobModel.lease_until < now)
+                .all()
+            )
+            for record in expired:
+                record.lease_until = None
+                record.worker_id = None
+                if record.cancel_requested:
+                    record.status = JobStatus.CANCELLED
+                    record.completed_at = now
+                elif (record.attempts or 0) >= (record.max_attempts or 1):
+                    record.status = JobStatus.FAILED
+                    record.error_message = "worker 中断且重试次数已用完"
+                    record.completed_at = now
+                else:
+                    record.status = JobStatus.QUEUED
+                    record.next_run_at = now
+                    recovered += 1
+        return recovered
+
+    def counts(self) -> Dict[str, int]:
+        self.ensure_table()
+        with db_manager.get_session() as session:
+            rows = (
+                session.query(GenerationJobModel.status, func.count(GenerationJobModel.id))
+                .group_by(GenerationJobModel.status)
+                .all()
+            )
+            return {status.value: count for status, count in rows if status is not None}
+
+
+class JobQueue:
+    """任务队列：worker 池 + 重试 + 取消 + 重启恢复"""
+
+    def __init__(
+        self,
+        store: JobStore = None,
+        workers: int = 4,
+        poll_interval: float = 1.0,
+        max_attempts: int = 3,
+        retry_backoff: float = 2.0,
+        retry_backoff_max: float = 60.0,
+        lease_seconds: float = 60.0,
+        redis_url: str = None,
+    ):
+        """
+        Args:
+            store: 任务表，默认使用 services.database 的数据库
+            workers: worker 数（同时执行的任务上限）
+            poll_interval: 空闲时轮询间隔(秒)
+            max_attempts: 默认最多执行次数
+            retry_backoff / retry_backoff_max: 重试退避基数与上限(秒)
+            lease_seconds: 执行租约(秒)，超过未续租视为 worker 中断
+            redis_url: 不传则只靠轮询发现其他进程提交的任务
+        """
+        self.store = store or JobStore()
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.lease_seconds = lease_seconds
+        self.redis_url = redis_url
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._handlers: Dict[str, Callable[[dict], Awaitable[dict]]] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._cancelled: Set[str] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._redis = None
+        # 指标
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.cancelled = 0
+        self.recovered = 0
+
+    def register(self, kind: str, handler: Callable[[dict], Awaitable[dict]]):
+        """注册任务类型的 handler：成功返回可 JSON 序列化的 dict，失败抛出异常"""
+        self._handlers[kind] = handler
+
+    # ============ 生命周期 ============
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        await asyncio.to_thread(self.store.ensure_table)
+        self.recovered += await asyncio.to_thread(self.store.recover_expired)
+
+        if self.redis_url:
+            try:
+                import redis.asyncio as aioredis
+            except ImportError:
+                print("⚠️ 未安装 redis，任务队列只使用轮询")
+            else:
+                self._redis = aioredis.from_url(self.redis_url, decode_responses=True)
+                self._tasks.append(asyncio.create_task(self._listen()))
+
+        for index in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(index)))
+        self._tasks.append(asyncio.create_task(self._recover_loop()))
+
+    async def aclose(self):
+        """停止 worker；执行中的任务归还队列，下次启动（或其他进程）继续执行"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    # ============ API ============
+
+    async def submit(self, kind: str, params: dict, user_id: str = None, max_attempts: int = None) -> JobInfo:
+        job = await asyncio.to_thread(
+            self.store.create, kind, params, user_id, max_attempts or self.max_attempts
+        )
+        self._notify_local()
+        if self._redis is not None:
+            await self._redis.publish(REDIS_CHANNEL, job.job_id)
+        return job
+
+    def get(self, job_id: str) -> Optional[JobInfo]:
+        return self.store.get(job_id)
+
+    def cancel(self, job_id: str) -> Tuple[bool, str]:
+        success, message = self.store.request_cancel(job_id)
+        task = self._running.get(job_id)
+        if success and task is not None:
+            self._cancelled.add(job_id)
+            task.cancel()
+        return success, message
+
+    def retry(self, job_id: str) -> Tuple[bool, str]:
+        success, message = self.store.retry(job_id)
+        if success:
+            self._notify_local()
+        return success, message
+
+    # ============ worker ============
+
+    def _notify_local(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _listen(self):
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(REDIS_CHANNEL)
+        try:
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    self._notify_local()
+        finally:
+            await pubsub.aclose()
+
+    async def _recover_loop(self):
+        while True:
+            await asyncio.sleep(self.lease_seconds)
+            self.recovered += await asyncio.to_thread(self.store.recover_expired)
+
+    async def _worker(self, index: int):
+        while True:
+            self._wakeup.clear()
+            job = await asyncio.to_thread(self.store.claim, self.worker_id, self.lease_seconds)
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._execute(job)
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.retry_backoff_max, self.retry_backoff * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.8, 1.2)
+
+    async def _heartbeat(self, job_id: str, task: asyncio.Task):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if await asyncio.to_thread(self.store.heartbeat, job_id, self.worker_id, self.lease_seconds):
+                # 其他进程发起的取消
+                self._cancelled.add(job_id)
+                task.cancel()
+                return
+
+    async def _execute(self, job: ClaimedJob):
+        handler = self._handlers.get(job.kind)
+        if handler is None:
+            await asyncio.to_thread(self.store.fail, job.job_id, self.worker_id, f"未知任务类型: {job.kind}")
+            self.failed += 1
+            return
+
+        task = asyncio.create_task(handler(job.params))
+        self._running[job.job_id] = task
+        heartbeat = asyncio.create_task(self._heartbeat(job.job_id, task))
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if job.job_id not in self._cancelled:
+                # 进程关闭：归还任务
+                task.cancel()
+                self.store.release(job.job_id, self.worker_id)
+                raise
+            await asyncio.to_thread(self.store.mark_cancelled, job.job_id, self.worker_id)
+            self.cancelled += 1
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+            retry_at = None
+            if not isinstance(e, PermanentJobError) and job.attempts < job.max_attempts:
+                retry_at = datetime.now() + timedelta(seconds=self._backoff(job.attempts))
+                self.retried += 1
+            else:
+                self.failed += 1
+            print(f"[Job] {job.job_id} 第 {job.attempts} 次执行失败: {error}" + (" (稍后重试)" if retry_at else ""))
+            await asyncio.to_thread(self.store.fail, job.job_id, self.worker_id, error, retry_at)
+        else:
+            await asyncio.to_thread(self.store.complete, job.job_id, self.worker_id, result or {})
+            self.completed += 1
+        finally:
+            heartbeat.cancel()
+            self._running.pop(job.job_id, None)
+            self._cancelled.discard(job.job_id)
+
+    def stats(self) -> dict:
+        """队列指标（用于监控）"""
+        return {
+            "worker_id": self.worker_id,
+            "workers": self.workers,
+            "running": len(self._running),
+            "backend": "redis" if self._redis is not None else "poll",
+            "statuses": self.store.counts(),
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "cancelled": self.cancelled,
+            "recovered": self.recovered,
+        }
+
+
+job_queue = JobQueue(
+    workers=int(os.getenv("JOB_WORKERS", "4")),
+    poll_interval=float(os.getenv("JOB_POLL_INTERVAL", "1")),
+    max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "3")),
+    retry_backoff=float(os.getenv("JOB_RETRY_BACKOFF", "2")),
+    retry_backoff_max=float(os.getenv("JOB_RETRY_BACKOFF_MAX", "60")),
+    lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", "60")),
+    redis_url=os.getenv("REDIS_URL") if os.getenv("JOB_QUEUE_NOTIFY", "poll").lower() == "redis" else None,
+)
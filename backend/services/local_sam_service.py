@@ -11,31 +11,147 @@ import os
 import io
 import base64
 import time
-import uuid
+import hashlib
 import numpy as np
 from PIL import Image
 from typing import List, Optional, Tuple
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 from pathlib import Path
 
+from services.compact_mask import CompactMask, pairwise_iou
+from services.mask_store import mask_store, mask_url
+
 # 延迟导入，避免启动时加载模型
 _sam3_model = None
 _sam3_processor = None
 
+# 文本提示批量解码：一次前向最多处理的标签数（限制解码器显存/内存峰值），1 为逐个标签
+TEXT_BATCH_SIZE = int(os.getenv("SAM_TEXT_BATCH_SIZE", "8"))
+
+# 推理工作分辨率（最长边，0 为原图）：图片缩放到此尺寸后编码，mask 也按此分辨率保存，
+# 需要原图分辨率时（/api/v1/masks/{id}?size=full）再按包围框局部放大
+WORK_SIZE = int(os.getenv("SAM_WORK_SIZE", "1024"))
+
+# 推理后端：torch（默认，自动选择 CUDA / MPS / CPU）或 onnx（ONNX Runtime CPU，动态 int8 量化，见 services/sam_onnx.py）
+SAM_BACKEND = os.getenv("SAM_BACKEND", "torch").lower()
+# 模型权重（Hugging Face 模型 ID 或本地目录）
+SAM_MODEL_ID = os.getenv("SAM_MODEL_ID", "facebook/sam3")
+
+# 跨标签去重：IoU 不低于此值的检测视为同一物体（合并标签，保留得分最高的一个）
+NMS_IOU_THRESHOLD = float(os.getenv("SAM_NMS_IOU", "0.7"))
+# 面积小于图片面积该比例的碎片直接丢弃
+MIN_AREA_RATIO = float(os.getenv("SAM_MIN_AREA_RATIO", "0.0005"))
+
+
+def _expand_batch(value, n: int):
+    """把 batch=1 的图像特征扩展为 batch=n（expand 只生成视图，不复制数据）"""
+    if n == 1:
+        return value
+    if hasattr(value, "expand") and hasattr(value, "dim"):
+        if value.dim() > 0 and value.shape[0] == 1:
+            return value.expand(n, *value.shape[1:])
+        return value
+    if isinstance(value, dict):  # transformers 的 ModelOutput 也是 dict 子类
+        return type(value)(**{k: _expand_batch(v, n) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return type(value)(_expand_batch(v, n) for v in value)
+    return value
+
+
+def _select_batch(value, index: int, n: int):
+    """从 batch=n 的图像特征中取出第 index 张（保留 batch 维，复制出独立存储以便缓存按实际大小计算）"""
+    if hasattr(value, "clone") and hasattr(value, "dim"):
+        if value.dim() > 0 and value.shape[0] == n:
+            return value[index:index + 1].clone()
+        return value
+    if isinstance(value, dict):
+        return type(value)(**{k: _select_batch(v, index, n) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return type(value)(_select_batch(v, index, n) for v in value)
+    return value
+
+
+def encode_image_batch(images: List[Image.Image]) -> List["ImageEmbeddings"]:
+    """批量图像编码（由 sam_encoder_batcher 在批处理线程中调用）"""
+    import torch
+    
+    inputs = _sam3_processor(images=images, return_tensors="pt")
+    device = _sam3_model.device
+    with torch.no_grad():
+        vision_embeds = _sam3_model.get_vision_features(pixel_values=inputs["pixel_values"].to(device))
+    original_sizes = inputs["original_sizes"]
+    if len(images) == 1:
+        return [ImageEmbeddings(vision_embeds=vision_embeds, original_sizes=original_sizes)]
+    return [
+        ImageEmbeddings(vision_embeds=_select_batch(vision_embeds, i, len(images)), original_sizes=original_sizes[i:i + 1])
+        for i in range(len(images))
+    ]
+
 
 @dataclass
 class SegmentedObject:
     """分割出的单个对象"""
     label: str
     label_zh: str
-    mask: np.ndarray = None  # numpy mask
-    mask_url: str = ""       # 保存后的彩色 mask URL（用于可视化）
+    labels: List[str] = field(default_factory=list)  # 去重合并后的全部标签（第一个为 label）
+    mask: CompactMask = None  # 按行打包的位图（每像素 1 bit）
+    mask_id: str = ""        # mask 存储中的 ID
+    label_index: int = 0     # 在标签索引图中的值（0 = 背景 / 不在图中）
+    mask_rle: dict = None    # COCO 风格 RLE（{"size": [h, w], "counts": "..."}），随 JSON 返回
+    mask_url: str = ""       # 彩色 mask URL（用于可视化，首次访问时渲染）
     inpaint_mask_url: str = ""  # 黑白 mask URL（用于 inpaint API）
-    inpaint_mask_base64: str = ""  # 黑白 mask base64（直接传递给 API）
+    inpaint_mask_base64: str = ""  # 黑白 mask base64（按需通过 /api/v1/masks/{id}?format=base64 获取）
     bbox: List[int] = field(default_factory=list)
     confidence: float = 0.0
 
 
+@dataclass
+class ImageEmbeddings:
+    """一张图片的 SAM 图像编码器输出"""
+    vision_embeds: object  # get_vision_features 的输出（留在模型所在设备上）
+    original_sizes: object  # 处理器给出的输入图尺寸 [[h, w]]（工作分辨率），用于框坐标归一化和 mask 后处理
+    source_size: Tuple[int, int] = None  # 原图尺寸 (h, w)；客户端的点击坐标和返回的 bbox 都以原图为准
+    image: Optional[Image.Image] = None  # 编码时的工作分辨率图片，合成标注图时直接使用，不再解码
+    
+    @property
+    def width(self) -> int:
+        return int(self.original_sizes[0][1])
+    
+    @property
+    def height(self) -> int:
+        return int(self.original_sizes[0][0])
+    
+    @property
+    def scale(self) -> Tuple[float, float]:
+        """原图 / 工作分辨率 的 (x, y) 缩放比例"""
+        if self.source_size is None:
+            return 1.0, 1.0
+        return self.source_size[1] / self.width, self.source_size[0] / self.height
+    
+    def to_source_box(self, box: List[float]) -> List[int]:
+        """工作分辨率下的框 -> 原图坐标"""
+        sx, sy = self.scale
+        return [int(box[0] * sx), int(box[1] * sy), int(box[2] * sx), int(box[3] * sy)]
+
+
+@dataclass
+class LabelMapEntry:
+    """一张图片最近一次分割的标签索引图（工作分辨率）+ 物体表，点击选择时直接查表"""
+    label_map: np.ndarray
+    objects: List[SegmentedObject]  # objects[i].label_index == i + 1，不含位图
+    source_size: Tuple[int, int]    # 原图尺寸 (h, w)
+    
+    def object_at(self, x: int, y: int) -> Optional[SegmentedObject]:
+        """原图坐标 (x, y) 处的物体；背景或越界返回 None"""
+        height, width = self.label_map.shape
+        work_x = int(x * width / self.source_size[1])
+        work_y = int(y * height / self.source_size[0])
+        if not (0 <= work_x < width and 0 <= work_y < height):
+            return None
+        index = int(self.label_map[work_y, work_x])
+        return self.objects[index - 1] if index else None
+
+
 @dataclass
 class LocalSegmentationResult:
     """分割结果"""
@@ -43,6 +159,7 @@ class LocalSegmentationResult:
     objects: List[SegmentedObject] = field(default_factory=list)
     combined_mask_url: str = None
     annotated_image_url: str = None
+    label_map_url: str = None  # 标签索引图（原值灰度 PNG，像素值 = label_index）
     error: str = None
     elapsed_seconds: float = 0.0
 
@@ -86,6 +203,15 @@ class LocalSAMService:
         "object": "物体", "furniture": "家具"
     }
     
+    # 默认检测标签
+    DEFAULT_LABELS = [
+        # 核心家具（8个）
+        "sofa", "chair", "table", "bed", "cabinet", "lamp",
+        "curtain", "rug",
+        # 常见物品（6个）
+        "tv", "plant", "pillow", "vase", "painting", "mirror"
+    ]
+    
     def __init__(self, output_dir: str = None):
         """
         初始化服务
@@ -108,12 +234,20 @@ class LocalSAMService:
         if _sam3_model is not None:
             return
         
-        print("正在加载 SAM 3 模型 (facebook/sam3)...")
+        print(f"正在加载 SAM 3 模型 ({SAM_MODEL_ID}, backend={SAM_BACKEND})...")
         from transformers import Sam3Model, Sam3Processor
         import torch
         
-        model_id = "facebook/sam3"
+        model_id = SAM_MODEL_ID
         _sam3_processor = Sam3Processor.from_pretrained(model_id)
+        
+        if SAM_BACKEND == "onnx":
+            from services.sam_onnx import OnnxSam3Model
+            _sam3_model = OnnxSam3Model.load()
+            self._sam_loaded = True
+            print(f"SAM 3 模型已加载到 ONNX Runtime CPU (quantized={_sam3_model.manifest['quantized']})")
+            return
+        
         _sam3_model = Sam3Model.from_pretrained(model_id)
         
         # 选择设备
@@ -138,6 +272,12 @@ class LocalSAMService:
             image_data = base64.b64decode(image_base64)
             return Image.open(io.BytesIO(image_data)).convert("RGB")
         elif image_url:
+            # 上传图片使用规范化后的原尺寸副本（已按 EXIF 旋转、转 sRGB），
+            # 与前端显示的方向和像素坐标一致，也不再通过 HTTP 下载自己的静态文件
+            from services.image_derivatives import derivative_store
+            local_path = derivative_store.resolve(image_url, "original")
+            if local_path is not None:
+                return Image.open(local_path).convert("RGB")
             if image_url.startswith('http'):
                 import requests
                 response = requests.get(image_url, timeout=30)
@@ -147,87 +287,233 @@ class LocalSAMService:
         else:
             raise ValueError("需要提供 image_url 或 image_base64")
     
-    def _save_mask(self, mask: np.ndarray, prefix: str = "mask", color: tuple = None) -> str:
-        """保存 mask 为彩色半透明 PNG 并返回 URL（用于可视化）"""
-        filename = f"{prefix}_{uuid.uuid4().hex[:8]}.png"
-        filepath = os.path.join(self.output_dir, filename)
+    def _load_work_image(self, image_url: str = None, image_base64: str = None) -> Tuple[Image.Image, Tuple[int, int]]:
+        """
+        加载工作分辨率的图片，返回 (图片, 原图尺寸 (h, w))
         
-        # 使用随机颜色或指定颜色
-        if color is None:
-            import random
-            color = (
-                random.randint(100, 255),
-                random.randint(100, 255), 
-                random.randint(100, 255)
-            )
+        上传图片直接读取不小于工作分辨率的最小一级衍生图，不再解码原图
+        """
+        size = WORK_SIZE
+        if image_url and not image_base64:
+            from services.image_derivatives import derivative_store
+            original = derivative_store.resolve(image_url, "original")
+            if original is not None:
+                with Image.open(original) as header:
+                    source_size = (header.height, header.width)
+                path = derivative_store.resolve_for_size(image_url, size) if size else original
+                return self._fit_work_size(Image.open(path).convert("RGB"), size), source_size
         
-        # 创建 RGBA 彩色半透明 mask
-        h, w = mask.shape
-        rgba = np.zeros((h, w, 4), dtype=np.uint8)
-        rgba[mask, 0] = color[0]  # R
-        rgba[mask, 1] = color[1]  # G
-        rgba[mask, 2] = color[2]  # B
-        rgba[mask, 3] = 180  # Alpha (半透明)
+        image = self._load_image(image_url, image_base64)
+        return self._fit_work_size(image, size), (image.height, image.width)
+    
+    @staticmethod
+    def _fit_work_size(image: Image.Image, size: int) -> Image.Image:
+        if not size or max(image.size) <= size:
+            return image
+        ratio = size / max(image.size)
+        return image.resize((round(image.width * ratio), round(image.height * ratio)), Image.Resampling.LANCZOS)
+    
+    def _source_key(self, image_url: str = None, image_base64: str = None) -> Optional[str]:
+        """不解码图片取得内容哈希（特征缓存键）：上传文件取文件名中的哈希，base64 取字节哈希"""
+        from services.result_cache import content_digest
+        if image_base64:
+            if not image_base64.startswith('data:'):
+                image_base64 = "data:," + image_base64
+            return content_digest(image_base64)
+        if image_url:
+            digest = content_digest(image_url)
+            if not digest.startswith("url:"):
+                return digest
+        return None
+    
+    def _get_embeddings(self, image_url: str = None, image_base64: str = None) -> "ImageEmbeddings":
+        """
+        图像编码器输出，按图片内容缓存；文本提示和框/点提示共用
+        
+        缓存命中时不再解码图片，只剩提示编码和 mask 解码的耗时
+        """
+        from services.embedding_cache import sam_embedding_cache
+        from services.sam_batcher import sam_encoder_batcher
         
-        mask_img = Image.fromarray(rgba, mode='RGBA')
-        mask_img.save(filepath)
+        loaded = None
+        key = self._source_key(image_url, image_base64)
+        if key is None:
+            # 远程 URL 的内容可能变化，按解码后的像素计算
+            loaded = self._load_work_image(image_url, image_base64)
+            key = "pixels:" + hashlib.sha256(loaded[0].tobytes()).hexdigest()
         
-        # 返回相对 URL
-        return f"/static/masks/{filename}"
+        def compute() -> ImageEmbeddings:
+            image, source_size = loaded or self._load_work_image(image_url, image_base64)
+            # 其他请求同时编码时合并成一个批次
+            embeddings = sam_encoder_batcher.submit(image)
+            return replace(embeddings, source_size=source_size, image=image)
+        
+        return sam_embedding_cache.get_or_compute(f"sam3:{key}:{WORK_SIZE}", compute)
     
-    def _save_inpaint_mask(self, mask: np.ndarray, prefix: str = "inpaint_mask") -> str:
-        """保存用于 inpaint 的黑白 mask
+    def _store_mask(self, mask: CompactMask, source_shape: Tuple[int, int] = None) -> dict:
+        """
+        把紧凑 mask（工作分辨率）存入存储，返回 SegmentedObject 的 mask 字段
         
-        格式：白色 (255) = 要编辑的区域，黑色 (0) = 保持不变
-        这是 AI inpaint API 需要的标准格式
+        source_shape 为原图尺寸，?size=full 时按它放大；
+        彩色/黑白 PNG 在第一次访问 /api/v1/masks/{id} 时才渲染；
+        inpaint_mask_base64 留空，局部重绘直接按 inpaint_mask_url 从存储读取位图
+        """
+        mask_id = mask_store.put(mask, source_shape)
+        return {
+            "mask_id": mask_id,
+            "mask_rle": mask.to_rle(),
+            "mask_url": mask_url(mask_id, "color"),
+            "inpaint_mask_url": mask_url(mask_id, "bw"),
+        }
+    
+    def _suppress_duplicates(
+        self,
+        candidates: List[SegmentedObject],
+        iou_threshold: float = None,
+        min_area_ratio: float = None,
+    ) -> List[SegmentedObject]:
         """
-        filename = f"{prefix}_{uuid.uuid4().hex[:8]}.png"
-        filepath = os.path.join(self.output_dir, filename)
+        跨标签去重（在存储 mask 之前执行，重复的检测不再生成任何产物）
         
-        # 创建黑白 mask：白色=编辑区域，黑色=保持不变
-        h, w = mask.shape
-        bw_mask = np.zeros((h, w), dtype=np.uint8)
-        bw_mask[mask] = 255  # 白色区域为要编辑的部分
+        1. 丢弃面积小于 min_area_ratio × 图片面积的碎片
+        2. 在打包位图上一次算出所有检测两两之间的 IoU
+        3. 按得分从高到低，每个簇（IoU >= iou_threshold）只保留得分最高的一个，
+           簇内其他检测的标签合并到 labels
+        """
+        iou_threshold = NMS_IOU_THRESHOLD if iou_threshold is None else iou_threshold
+        min_area_ratio = MIN_AREA_RATIO if min_area_ratio is None else min_area_ratio
+        if not candidates:
+            return []
+        
+        height, width = candidates[0].mask.shape
+        min_area = min_area_ratio * height * width
+        candidates = [c for c in candidates if c.mask.area() >= max(min_area, 1)]
+        if not candidates:
+            return []
         
-        mask_img = Image.fromarray(bw_mask, mode='L')
-        mask_img.save(filepath)
+        scores = np.array([c.confidence for c in candidates])
+        boxes = np.array([c.mask.bbox() for c in candidates], dtype=np.int64)
+        iou = pairwise_iou([c.mask for c in candidates], boxes)
         
-        return f"/static/masks/{filename}"
+        kept = []
+        suppressed = np.zeros(len(candidates), dtype=bool)
+        for i in np.argsort(-scores, kind="stable"):
+            if suppressed[i]:
+                continue
+            cluster = np.flatnonzero((iou[i] >= iou_threshold) & ~suppressed)
+            cluster = cluster[np.argsort(-scores[cluster], kind="stable")]
+            suppressed[cluster] = True
+            labels = list(dict.fromkeys(candidates[j].label for j in [i, *cluster]))
+            kept.append(replace(candidates[i], labels=labels))
+        return kept
     
-    def _mask_to_base64(self, mask: np.ndarray) -> str:
-        """将 mask 转换为 base64 格式（用于直接传递给 API）
+    def _compose(
+        self, label_map: Optional[np.ndarray], image: Optional[Image.Image]
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """
+        由标签索引图和编码时的工作分辨率图片渲染标注图和合并 mask（各编码一次）
         
-        格式：白色 (255) = 要编辑的区域，黑色 (0) = 保持不变
+        合成失败不影响分割结果，返回 (None, None)
         """
-        # 创建黑白 mask
-        h, w = mask.shape
-        bw_mask = np.zeros((h, w), dtype=np.uint8)
-        bw_mask[mask] = 255
+        if label_map is None:
+            return None, None
+        from services.mask_compositor import segmentation_compositor
         
-        mask_img = Image.fromarray(bw_mask, mode='L')
+        try:
+            if image is not None and image.size != (label_map.shape[1], label_map.shape[0]):
+                image = None
+            return segmentation_compositor.compose(image, label_map)
+        except Exception as e:
+            print(f"⚠️ 分割结果合成失败: {e}")
+            return None, None
+    
+    def _index_label_map(
+        self,
+        key: Optional[str],
+        label_map: Optional[np.ndarray],
+        objects: List[SegmentedObject],
+        source_size: Tuple[int, int],
+    ):
+        """记录这张图片的标签索引图，之后的点击直接查表（远程 URL 没有稳定的内容键，不记录）"""
+        from services.embedding_cache import sam_label_maps
         
-        # 转为 base64
-        buffer = io.BytesIO()
-        mask_img.save(buffer, format='PNG')
-        b64_data = base64.b64encode(buffer.getvalue()).decode()
+        if key is None or label_map is None or not sam_label_maps.enabled:
+            return
+        table = [replace(obj, mask=None) for obj in objects]
+        sam_label_maps.put(f"labels:{key}:{WORK_SIZE}", LabelMapEntry(label_map, table, source_size))
+    
+    def lookup_point(
+        self, image_url: str = None, image_base64: str = None, x: int = 0, y: int = 0
+    ) -> Optional[LocalSegmentationResult]:
+        """
+        点击选择先查这张图片已有的标签索引图（O(1)，不加载模型）；没有分割过或点在背景上时返回 None，
+        由调用方回退到 segment_at_point
+        """
+        from services.embedding_cache import sam_label_maps
         
-        return f"data:image/png;base64,{b64_data}"
+        start_time = time.time()
+        key = self._source_key(image_url, image_base64)
+        if key is None:
+            return None
+        entry = sam_label_maps.get(f"labels:{key}:{WORK_SIZE}")
+        hit = entry.object_at(x, y) if entry is not None else None
+        if hit is None:
+            return None
+        return LocalSegmentationResult(
+            success=True,
+            objects=[hit],
+            elapsed_seconds=time.time() - start_time
+        )
     
     def get_label_zh(self, label: str) -> str:
         """获取中文标签"""
         return self.LABEL_ZH.get(label.lower(), label)
     
+    def _decode_text_prompts(self, embeddings: ImageEmbeddings, labels: List[str], threshold: float, batch_size: int):
+        """
+        文本提示解码：每批最多 batch_size 个标签堆叠成一个 batch，一次前向 + 一次批量后处理
+        
+        Yields:
+            (label, 后处理结果)
+        """
+        import torch
+        
+        device = _sam3_model.device
+        batch_size = max(1, batch_size)
+        for start in range(0, len(labels), batch_size):
+            chunk = labels[start:start + batch_size]
+            inputs = _sam3_processor(text=chunk, return_tensors="pt")
+            inputs = {k: v.to(device) for k, v in inputs.items()}
+            
+            with torch.no_grad():
+                outputs = _sam3_model(vision_embeds=_expand_batch(embeddings.vision_embeds, len(chunk)), **inputs)
+            
+            # SAM 3 后处理（整个 batch 一起）
+            results = _sam3_processor.post_process_instance_segmentation(
+                outputs,
+                threshold=threshold,
+                mask_threshold=0.5,
+                target_sizes=embeddings.original_sizes.tolist() * len(chunk)
+            )
+            yield from zip(chunk, results)
+    
     def segment_furniture(
         self,
         image_url: str = None,
         image_base64: str = None,
         labels: List[str] = None,
         box_threshold: float = 0.15,  # 降低阈值提高识别率
+        batch_size: int = None,
+        include_label_map: bool = False,
     ) -> LocalSegmentationResult:
         """
         分割图片中的家具
         
-        使用 Grounding DINO 检测 + SAM 分割
+        使用 SAM 3 文本提示分割；所有标签共用一次图像编码，
+        标签按 batch_size（默认 SAM_TEXT_BATCH_SIZE）分批批量解码，
+        结果跨标签去重（重叠的 couch/sofa 等只返回一个，标签合并到 labels），
+        并合成一张标注图（annotated_image_url）和一张合并 mask（combined_mask_url）；
+        标签索引图按图片记录下来供点击查表，include_label_map 时同时返回它的 URL（label_map_url）
         """
         start_time = time.time()
         
@@ -235,75 +521,61 @@ class LocalSAMService:
             # 加载 SAM 3 模型
             self._load_sam3_model()
             
-            # 加载图片
-            image = self._load_image(image_url, image_base64)
+            # 图像只编码一次（同一张图片之前分割/点击过时直接命中缓存）
+            embeddings = self._get_embeddings(image_url, image_base64)
             
             # 默认检测标签 - 精简核心家具列表（提高速度）
             if labels is None:
-                labels = [
-                    # 核心家具（8个）
-                    "sofa", "chair", "table", "bed", "cabinet", "lamp",
-                    "curtain", "rug",
-                    # 常见物品（6个）
-                    "tv", "plant", "pillow", "vase", "painting", "mirror"
-                ]
-            
-            import torch
+                labels = list(self.DEFAULT_LABELS)
             
-            objects = []
+            candidates = []
             
-            # SAM 3 支持文本提示分割 - 逐个标签检测
-            for label in labels:
-                inputs = _sam3_processor(
-                    images=image, 
-                    text=label,
-                    return_tensors="pt"
-                )
-                
-                device = next(_sam3_model.parameters()).device
-                inputs = {k: v.to(device) for k, v in inputs.items()}
-                
-                with torch.no_grad():
-                    outputs = _sam3_model(**inputs)
-                
-                # SAM 3 后处理
-                results = _sam3_processor.post_process_instance_segmentation(
-                    outputs,
-                    threshold=box_threshold,
-                    mask_threshold=0.5,
-                    target_sizes=inputs.get("original_sizes").tolist()
-                )[0]
-                
+            # SAM 3 支持文本提示分割 - 多个标签堆叠成一个 batch 解码
+            decoded = self._decode_text_prompts(
+                embeddings, labels, box_threshold, batch_size or TEXT_BATCH_SIZE
+            )
+            for label, results in decoded:
                 # 处理检测到的物体
                 for i, (mask, box, score) in enumerate(zip(
                     results.get("masks", []),
                     results.get("boxes", []),
                     results.get("scores", [])
                 )):
-                    mask_np = mask.cpu().numpy().astype(bool)
                     box_list = box.cpu().numpy().tolist()
                     
-                    # 保存彩色 mask（用于可视化）
-                    mask_url = self._save_mask(mask_np, f"mask_{label}_{i}")
-                    # 保存黑白 mask（用于 inpaint）
-                    inpaint_mask_url = self._save_inpaint_mask(mask_np, f"inpaint_{label}_{i}")
-                    # 生成 base64 格式（用于直接传递给 API）
-                    inpaint_mask_base64 = self._mask_to_base64(mask_np)
-                    
-                    objects.append(SegmentedObject(
+                    candidates.append(SegmentedObject(
                         label=label,
                         label_zh=self.get_label_zh(label),
-                        mask=mask_np,
-                        mask_url=mask_url,
-                        inpaint_mask_url=inpaint_mask_url,
-                        inpaint_mask_base64=inpaint_mask_base64,
-                        bbox=[int(x) for x in box_list],
+                        mask=CompactMask.from_array(mask.cpu().numpy()),
+                        bbox=embeddings.to_source_box(box_list),
                         confidence=float(score)
                     ))
             
+            # 跨标签去重后只存储保留下来的 mask
+            objects = [
+                replace(obj, label_index=i + 1, **self._store_mask(obj.mask, embeddings.source_size))
+                for i, obj in enumerate(self._suppress_duplicates(candidates))
+            ]
+            
+            # 所有物体合成一张标签索引图：标注图 / 合并 mask / 点击查表共用
+            label_map = None
+            if objects:
+                from services.mask_compositor import build_label_map, segmentation_compositor
+                label_map = build_label_map([obj.mask for obj in objects], [obj.confidence for obj in objects])
+            annotated_image_url, combined_mask_url = self._compose(label_map, embeddings.image)
+            self._index_label_map(
+                self._source_key(image_url, image_base64), label_map, objects, embeddings.source_size
+            )
+            label_map_url = None
+            if include_label_map and label_map is not None:
+                label_map_url = segmentation_compositor.write_label_map(label_map)
+            
             return LocalSegmentationResult(
                 success=True,
                 objects=objects,
+                annotated_image_url=annotated_image_url,
+                combined_mask_url=combined_mask_url,
+                label_map_url=label_map_url,
                 elapsed_seconds=time.time() - start_time
             )
             
@@ -332,41 +604,45 @@ class LocalSAMService:
         try:
             self._load_sam3_model()
             
-            image = self._load_image(image_url, image_base64)
+            # 同一张图片的图像特征已缓存时，点击只需要跑提示编码和解码
+            embeddings = self._get_embeddings(image_url, image_base64)
             
             import torch
             
-            # SAM 3 使用边界框，创建一个以点击位置为中心的小框
+            # SAM 3 使用边界框，创建一个以点击位置为中心的小框（点击坐标为原图坐标，换算到工作分辨率）
             box_size = 50
+            sx, sy = embeddings.scale
+            work_x, work_y = x / sx, y / sy
             box_xyxy = [
-                max(0, x - box_size),
-                max(0, y - box_size),
-                min(image.width, x + box_size),
-                min(image.height, y + box_size)
+                max(0, work_x - box_size),
+                max(0, work_y - box_size),
+                min(embeddings.width, work_x + box_size),
+                min(embeddings.height, work_y + box_size)
             ]
             
             input_boxes = [[box_xyxy]]
             input_boxes_labels = [[1]]  # 1 = positive
             
             inputs = _sam3_processor(
-                images=image,
                 input_boxes=input_boxes,
                 input_boxes_labels=input_boxes_labels,
+                original_sizes=embeddings.original_sizes,
                 return_tensors="pt"
             )
+            inputs.pop("original_sizes", None)
             
-            device = next(_sam3_model.parameters()).device
+            device = _sam3_model.device
             inputs = {k: v.to(device) for k, v in inputs.items()}
             
             with torch.no_grad():
-                outputs = _sam3_model(**inputs)
+                outputs = _sam3_model(vision_embeds=embeddings.vision_embeds, **inputs)
             
             # SAM 3 后处理
             results = _sam3_processor.post_process_instance_segmentation(
                 outputs,
                 threshold=0.3,
                 mask_threshold=0.5,
-                target_sizes=inputs.get("original_sizes").tolist()
+                target_sizes=embeddings.original_sizes.tolist()
             )[0]
             
             if len(results.get("masks", [])) > 0:
@@ -374,24 +650,15 @@ class LocalSAMService:
                 box = results["boxes"][0]
                 score = results["scores"][0]
                 
-                mask_np = mask.cpu().numpy().astype(bool)
+                compact = CompactMask.from_array(mask.cpu().numpy())
                 box_list = box.cpu().numpy().tolist()
                 
-                # 保存彩色 mask（用于可视化）
-                mask_url = self._save_mask(mask_np, "point_mask")
-                # 保存黑白 mask（用于 inpaint）
-                inpaint_mask_url = self._save_inpaint_mask(mask_np, "point_inpaint")
-                # 生成 base64 格式
-                inpaint_mask_base64 = self._mask_to_base64(mask_np)
-                
                 obj = SegmentedObject(
                     label="object",
                     label_zh="选中区域",
-                    mask=mask_np,
-                    mask_url=mask_url,
-                    inpaint_mask_url=inpaint_mask_url,
-                    inpaint_mask_base64=inpaint_mask_base64,
-                    bbox=[int(x) for x in box_list],
+                    mask=compact,
+                    **self._store_mask(compact, embeddings.source_size),
+                    bbox=embeddings.to_source_box(box_list),
                     confidence=float(score)
                 )
             else:
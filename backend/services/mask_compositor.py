@@ -0,0 +1,170 @@
+"""
+分割结果合成
+
+把所有物体画进一张标签索引图，生成 combined mask（调色板 PNG）和 annotated image（JPEG），文件名为内容哈希
+"""
+import io
+import os
+import hashlib
+import threading
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from services.compact_mask import CompactMask
+
+
+# 固定调色板（第 i 个物体取 PALETTE[i % 20]），饱和度适中，叠在室内照片上容易区分
+PALETTE = np.array([
+    (230, 25, 75), (60, 180, 75), (255, 225, 25), (0, 130, 200), (245, 130, 48),
+    (145, 30, 180), (70, 240, 240), (240, 50, 230), (210, 245, 60), (250, 190, 212),
+    (0, 128, 128), (220, 190, 255), (170, 110, 40), (255, 250, 200), (128, 0, 0),
+    (170, 255, 195), (128, 128, 0), (255, 215, 180), (0, 0, 128), (128, 128, 128),
+], dtype=np.uint8)
+
+# 叠加不透明度（与单个物体 mask 的 alpha 180 / 255 接近，但原图仍清晰可见）
+OVERLAY_ALPHA = 115
+
+
+def object_color(index: int) -> Tuple[int, int, int]:
+    """第 index 个物体（从 0 开始）在合成图中的颜色"""
+    return tuple(int(c) for c in PALETTE[index % len(PALETTE)])
+
+
+def build_label_map(masks: Sequence[CompactMask], scores: Sequence[float] = None) -> np.ndarray:
+    """
+    所有 mask 画进一张标签索引图
+
+    重叠处归得分更高的物体（按得分从低到高绘制）；每个 mask 只解包自己的包围框区域
+    """
+    if not masks:
+        raise ValueError("没有 mask")
+    height, width = masks[0].shape
+    dtype = np.uint8 if len(masks) < 255 else np.uint16
+    label_map = np.zeros((height, width), dtype=dtype)
+    order = np.argsort(np.asarray(scores), kind="stable") if scores is not None else range(len(masks))
+    for i in order:
+        mask = masks[i]
+        if mask.shape != (height, width):
+            raise ValueError(f"mask 尺寸不一致: {mask.shape} vs {(height, width)}")
+        box = mask.bbox()
+        if box is None:
+            continue
+        x0, y0, x1, y1 = box
+        region = np.unpackbits(mask.bits[y0:y1], axis=1, count=width)[:, x0:x1].astype(bool)
+        label_map[y0:y1, x0:x1][region] = i + 1
+    return label_map
+
+
+def _color_table(count: int) -> np.ndarray:
+    """标签 -> RGB（0 为背景）"""
+    table = np.zeros((count + 1, 3), dtype=np.uint8)
+    if count:
+        table[1:] = PALETTE[np.arange(count) % len(PALETTE)]
+    return table
+
+
+def render_combined(label_map: np.ndarray) -> bytes:
+    """标签索引图 -> PNG：uint8 直接存调色板 PNG（索引 0 透明），uint16 时展开成 RGBA"""
+    count = int(label_map.max())
+    table = _color_table(count)
+    buffer = io.BytesIO()
+    if label_map.dtype == np.uint8:
+        image = Image.fromarray(label_map, mode="P")
+        image.putpalette(table.ravel().tolist())
+        alpha = bytes([0] + [OVERLAY_ALPHA + 65] * count)  # 单独查看时更醒目一些
+        image.save(buffer, format="PNG", transparency=alpha, optimize=False)
+    else:
+        rgba = np.zeros((*label_map.shape, 4), dtype=np.uint8)
+        rgba[..., :3] = table[label_map]
+        rgba[..., 3] = np.where(label_map > 0, OVERLAY_ALPHA + 65, 0)
+        Image.fromarray(rgba, mode="RGBA").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def render_label_map(label_map: np.ndarray) -> bytes:
+    """标签索引图按原值编码：uint8 为 8 位灰度 PNG，uint16 为 16 位灰度 PNG"""
+    buffer = io.BytesIO()
+    Image.fromarray(label_map).save(buffer, format="PNG")  # uint8 -> L，uint16 -> I;16
+    return buffer.getvalue()
+
+
+def render_annotated(image: Image.Image, label_map: np.ndarray, quality: int = 90) -> bytes:
+    """原图与调色板颜色按 alpha 混合（一次查表 + 一次整数混合），编码 JPEG"""
+    rgb = np.asarray(image.convert("RGB"))
+    if rgb.shape[:2] != label_map.shape:
+        raise ValueError(f"图片尺寸 {rgb.shape[:2]} 与标签图 {label_map.shape} 不一致")
+    count = int(label_map.max())
+    alpha_table = np.full(count + 1, OVERLAY_ALPHA, dtype=np.uint16)
+    alpha_table[0] = 0
+
+    alpha = alpha_table[label_map][..., None]
+    blended = (rgb * (255 - alpha) + _color_table(count)[label_map] * alpha + 127) // 255
+    buffer = io.BytesIO()
+    Image.fromarray(blended.astype(np.uint8), mode="RGB").save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+class SegmentationCompositor:
+    """
+    把合成图写到静态目录（内容哈希命名），返回 URL
+    """
+
+    def __init__(self, output_dir: Path, url_prefix: str = "/static/masks", quality: int = 90):
+        self.output_dir = Path(output_dir)
+        self.url_prefix = url_prefix.rstrip("/")
+        self.quality = quality
+        self._lock = threading.Lock()
+        self.composed = 0
+        self.reused = 0
+
+    def _write(self, filename: str, render) -> str:
+        path = self.output_dir / filename
+        if path.exists():
+            with self._lock:
+                self.reused += 1
+        else:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f".{filename}.{threading.get_ident()}")
+            tmp_path.write_bytes(render())
+            os.replace(tmp_path, path)
+        return f"{self.url_prefix}/{filename}"
+
+    @staticmethod
+    def _digest(label_map: np.ndarray) -> str:
+        return hashlib.sha256(
+            np.array(label_map.shape, dtype=np.int32).tobytes() + label_map.tobytes()
+        ).hexdigest()[:24]
+
+    def compose(self, image: Optional[Image.Image], label_map: np.ndarray) -> Tuple[Optional[str], str]:
+        """
+        Returns:
+            (annotated_image_url, combined_mask_url)；没有图片时 annotated 为 None
+        """
+        digest = self._digest(label_map)
+        combined_url = self._write(f"combined_{digest}.png", lambda: render_combined(label_map))
+        annotated_url = None
+        if image is not None:
+            image_digest = hashlib.sha256(image.tobytes()).hexdigest()[:12]
+            annotated_url = self._write(
+                f"annotated_{digest}_{image_digest}.jpg",
+                lambda: render_annotated(image, label_map, self.quality),
+            )
+        with self._lock:
+            self.composed += 1
+        return annotated_url, combined_url
+
+    def write_label_map(self, label_map: np.ndarray) -> str:
+        """标签索引图（原值灰度 PNG）的 URL"""
+        return self._write(f"labels_{self._digest(label_map)}.png", lambda: render_label_map(label_map))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"composed": self.composed, "reused": self.reused}
+
+
+segmentation_compositor = SegmentationCompositor(
+    Path(__file__).parent.parent / "static" / "masks",
+)
@@ -0,0 +1,215 @@
+"""
+分割 mask 存储与按需渲染
+
+mask 以 CompactMask 按内容哈希保存（内存 LRU + 磁盘 npz），彩色 / 黑白 / base64 / rle 渲染在首次访问时生成并缓存
+"""
+import os
+import io
+import re
+import json
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+import numpy as np
+
+from services.compact_mask import CompactMask
+
+
+MASK_FORMATS = ("color", "bw", "base64", "rle")
+
+# /api/v1/masks/<id>（可带 ?format= 和 host 前缀）
+MASK_URL_PATTERN = re.compile(r"/api/v1/masks/([0-9a-f]{32})(?:[?#]|$)")
+
+
+class MaskNotFound(Exception):
+    """mask ID 不存在（已过期或从未生成）"""
+
+
+def mask_url(mask_id: str, fmt: str = "color") -> str:
+    """mask 的访问 URL（相对路径）"""
+    return f"/api/v1/masks/{mask_id}?format={fmt}"
+
+
+def parse_mask_url(ref: str) -> Optional[str]:
+    """mask URL -> mask ID；不是 mask 存储的 URL 时返回 None"""
+    if not ref or ref.startswith("data:"):
+        return None
+    match = MASK_URL_PATTERN.search(ref)
+    return match.group(1) if match else None
+
+
+def mask_color(mask_id: str) -> tuple:
+    """按 mask ID 取固定的可视化颜色（每个分量 100-255，与原来的随机颜色范围一致）"""
+    digest = bytes.fromhex(mask_id[:6])
+    return tuple(100 + b % 156 for b in digest)
+
+
+class _ByteLRU:
+    """按字节数限制大小的 LRU（线程安全）"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[object, tuple]" = OrderedDict()  # key -> (value, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, nbytes: int):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            if nbytes > self.max_bytes:
+                return
+            self._items[key] = (value, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self._bytes -= evicted
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._items), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+class MaskStore:
+    """
+    紧凑 mask 存储（分割推理线程写入，接口和局部重绘读取）
+    """
+
+    def __init__(self, directory: Path, memory_max_bytes: int = 64 * 1024 * 1024,
+                 render_max_bytes: int = 64 * 1024 * 1024):
+        """
+        Args:
+            directory: 磁盘存储目录
+            memory_max_bytes: 位图内存缓存上限
+            render_max_bytes: 渲染结果缓存上限
+        """
+        self.directory = Path(directory)
+        self._bits = _ByteLRU(memory_max_bytes)    # mask_id -> (CompactMask, 原图尺寸)
+        self._renders = _ByteLRU(render_max_bytes)  # (mask_id, format, full) -> bytes
+        self.stored = 0
+        self.renders = 0
+
+    def _path(self, mask_id: str) -> Path:
+        return self.directory / f"{mask_id}.npz"
+
+    def put(self, mask: Union[CompactMask, np.ndarray], source_shape: Tuple[int, int] = None) -> str:
+        """
+        保存 mask（CompactMask 或 bool 数组），返回 mask ID
+
+        source_shape: 原图尺寸 (h, w)，mask 是缩小后的工作分辨率时传入
+        """
+        if not isinstance(mask, CompactMask):
+            mask = CompactMask.from_array(mask)
+        source_shape = tuple(source_shape or mask.shape)
+        shape = np.array([*mask.shape, *source_shape], dtype=np.int32)
+        mask_id = hashlib.sha256(shape.tobytes() + mask.bits.tobytes()).hexdigest()[:32]
+
+        self._bits.put(mask_id, (mask, source_shape), mask.nbytes)
+        path = self._path(mask_id)
+        if not path.exists():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f".{mask_id}.{threading.get_ident()}.npz")
+            np.savez_compressed(tmp_path, bits=mask.bits, shape=shape)
+            os.replace(tmp_path, path)
+            self.stored += 1
+        return mask_id
+
+    def _load(self, mask_id: str) -> Tuple[CompactMask, Tuple[int, int]]:
+        cached = self._bits.get(mask_id)
+        if cached is None:
+            path = self._path(mask_id)
+            if not re.fullmatch(r"[0-9a-f]{32}", mask_id) or not path.exists():
+                raise MaskNotFound(mask_id)
+            with np.load(path) as data:
+                height, width, *source_shape = (int(v) for v in data["shape"])
+                mask = CompactMask(data["bits"], height, width)
+            cached = (mask, tuple(source_shape) or mask.shape)
+            self._bits.put(mask_id, cached, mask.nbytes)
+        return cached
+
+    def get(self, mask_id: str, full: bool = False) -> CompactMask:
+        """
+        读取 mask；不存在时抛出 MaskNotFound
+
+        full: 放大到原图分辨率（默认返回保存时的工作分辨率）
+        """
+        mask, source_shape = self._load(mask_id)
+        return mask.upsample(*source_shape) if full else mask
+
+    def source_shape(self, mask_id: str) -> Tuple[int, int]:
+        """原图尺寸 (h, w)"""
+        return self._load(mask_id)[1]
+
+    def render(self, mask_id: str, fmt: str = "color", full: bool = False) -> Tuple[bytes, str]:
+        """
+        渲染 mask，返回 (内容, media_type)；full=True 时渲染原图分辨率
+
+        color: 彩色半透明 RGBA PNG（可视化）
+        bw: 黑白 PNG，白色 (255) = 要编辑的区域，黑色 (0) = 保持不变（inpaint 标准格式）
+        base64: 黑白 PNG 的 data URL 文本
+        rle: COCO 风格 RLE 的 JSON（{"size": [h, w], "counts": "..."}）
+        """
+        if fmt not in MASK_FORMATS:
+            raise ValueError(f"不支持的格式: {fmt}")
+        cached = self._renders.get((mask_id, fmt, full))
+        if cached is not None:
+            return cached, self._media_type(fmt)
+
+        from PIL import Image
+
+        if fmt == "base64":
+            png, _ = self.render(mask_id, "bw", full)
+            content = f"data:image/png;base64,{base64.b64encode(png).decode()}".encode()
+        elif fmt == "rle":
+            content = json.dumps(self.get(mask_id, full).to_rle()).encode()
+        else:
+            mask = self.get(mask_id, full).to_array()
+            if fmt == "bw":
+                image = Image.fromarray(mask.astype(np.uint8) * 255, mode="L")
+            else:
+                rgba = np.zeros((*mask.shape, 4), dtype=np.uint8)
+                rgba[mask] = (*mask_color(mask_id), 180)  # Alpha 180 = 半透明
+                image = Image.fromarray(rgba, mode="RGBA")
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+            content = buffer.getvalue()
+
+        self.renders += 1
+        self._renders.put((mask_id, fmt, full), content, len(content))
+        return content, self._media_type(fmt)
+
+    @staticmethod
+    def _media_type(fmt: str) -> str:
+        return {"base64": "text/plain", "rle": "application/json"}.get(fmt, "image/png")
+
+    def stats(self) -> dict:
+        return {
+            "stored": self.stored,
+            "renders": self.renders,
+            "bits_cache": self._bits.stats(),
+            "render_cache": self._renders.stats(),
+        }
+
+
+mask_store = MaskStore(
+    Path(__file__).parent.parent / "data" / "masks",
+    memory_max_bytes=int(float(os.getenv("MASK_STORE_MEMORY_MB", "64")) * 1024 * 1024),
+    render_max_bytes=int(float(os.getenv("MASK_RENDER_CACHE_MB", "64")) * 1024 * 1024),
+)
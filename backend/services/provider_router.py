@@ -0,0 +1,362 @@
+"""
+生成服务熔断与自动切换
+
+每个 provider 一个熔断器（closed / open / half_open），ProviderRouter 按 PROVIDER_FAILOVER_ORDER 依次尝试，支持异步和同步调用方
+"""
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+
+class CircuitOpenError(Exception):
+    """所有候选 provider 都处于熔断状态"""
+
+
+@dataclass
+class BreakerConfig:
+    """单个熔断器的配置"""
+    window: int = 20                 # 统计最近多少次调用
+    min_calls: int = 5               # 样本少于该值时不熔断
+    failure_rate: float = 0.5        # 失败率阈值
+    slow_call_seconds: float = 90.0  # 超过该耗时视为慢调用
+    slow_call_rate: float = 0.5      # 慢调用比例阈值
+    open_seconds: float = 30.0       # 熔断多久后进入半开
+    half_open_calls: int = 1         # 半开状态允许的探测请求数
+    call_timeout: float = 0.0        # 单次调用超时(秒)，0 表示不额外限制
+
+
+# 默认配置（按 provider），可被环境变量覆盖
+DEFAULT_BREAKERS = {
+    "grsai": BreakerConfig(slow_call_seconds=90.0, call_timeout=0.0),
+    "replicate": BreakerConfig(slow_call_seconds=60.0),
+    "controlnet": BreakerConfig(slow_call_seconds=60.0),
+}
+
+DEFAULT_FAILOVER_ORDER = ["grsai", "replicate", "controlnet"]
+
+
+def load_breaker_config(provider: str) -> BreakerConfig:
+    """按 provider 读取配置：provider 级环境变量 > 全局环境变量 > 默认值"""
+    base = DEFAULT_BREAKERS.get(provider, BreakerConfig())
+    scopes = [f"BREAKER_{provider.upper()}", "BREAKER"]
+
+    def lookup(suffix: str, default, cast):
+        for scope in scopes:
+            value = os.getenv(f"{scope}_{suffix}")
+            if value:
+                return cast(value)
+        return default
+
+    return BreakerConfig(
+        window=lookup("WINDOW", base.window, int),
+        min_calls=lookup("MIN_CALLS", base.min_calls, int),
+        failure_rate=lookup("FAILURE_RATE", base.failure_rate, float),
+        slow_call_seconds=lookup("SLOW_CALL_SECONDS", base.slow_call_seconds, float),
+        slow_call_rate=lookup("SLOW_CALL_RATE", base.slow_call_rate, float),
+        open_seconds=lookup("OPEN_SECONDS", base.open_seconds, float),
+        half_open_calls=lookup("HALF_OPEN_CALLS", base.half_open_calls, int),
+        call_timeout=lookup("CALL_TIMEOUT", base.call_timeout, float),
+    )
+
+
+def failover_order(primary: str = None) -> List[str]:
+    """切换顺序：PROVIDER_FAILOVER_ORDER，primary 排在最前"""
+    configured = os.getenv("PROVIDER_FAILOVER_ORDER")
+    order = [p.strip() for p in configured.split(",") if p.strip()] if configured else list(DEFAULT_FAILOVER_ORDER)
+    if primary:
+        order = [primary] + [p for p in order if p != primary]
+    return order
+
+
+class CircuitBreaker:
+    """单个 provider 的熔断器（线程安全）"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, config: BreakerConfig):
+        self.name = name
+        self.config = config
+        self._lock = threading.Lock()
+        self._calls: Deque[Tuple[bool, bool]] = deque(maxlen=config.window)  # (ok, slow)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        # 指标
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+
+    # ============ 状态（持有 _lock 时调用） ============
+
+    def _state_locked(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.config.open_seconds:
+            self._state = self.HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def _open_locked(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probes = 0
+        self.opened += 1
+        print(f"[Breaker] {self.name} 熔断 {self.config.open_seconds}s")
+
+    def _should_open_locked(self) -> bool:
+        if len(self._calls) < self.config.min_calls:
+            return False
+        total = len(self._calls)
+        failures = sum(1 for ok, _ in self._calls if not ok)
+        slow = sum(1 for _, is_slow in self._calls if is_slow)
+        return failures / total >= self.config.failure_rate or slow / total >= self.config.slow_call_rate
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state_locked()
+
+    # ============ 调用 ============
+
+    def allow(self) -> bool:
+        """是否放行一次调用；放行后必须调用 record() 或 cancel()"""
+        with self._lock:
+            state = self._state_locked()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and self._probes < self.config.half_open_calls:
+                self._probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, ok: bool, elapsed: float):
+        """记录一次调用结果"""
+        slow = elapsed >= self.config.slow_call_seconds
+        with self._lock:
+            self.calls += 1
+            if not ok:
+                self.failures += 1
+            state = self._state_locked()
+            if state == self.HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                if ok and not slow:
+                    self._state = self.CLOSED
+                    self._calls.clear()
+                    print(f"[Breaker] {self.name} 恢复")
+                else:
+                    self._open_locked()
+                return
+            if state == self.OPEN:
+                # 熔断前已放行的调用结束，不影响状态
+                return
+            self._calls.append((ok, slow))
+            if self._should_open_locked():
+                self._open_locked()
+
+    def cancel(self):
+        """调用被取消（客户端断开等），不计入统计，仅归还半开探测名额"""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+
+    def stats(self) -> dict:
+        """熔断器指标（用于监控）"""
+        with self._lock:
+            total = len(self._calls)
+            return {
+                "state": self._state_locked(),
+                "calls": self.calls,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "opened": self.opened,
+                "window_error_rate": sum(1 for ok, _ in self._calls if not ok) / total if total else 0.0,
+                "window_slow_rate": sum(1 for _, slow in self._calls if slow) / total if total else 0.0,
+            }
+
+
+@dataclass
+class RoutedResult:
+    """切换执行结果"""
+    provider: str                     # 实际返回结果的 provider
+    result: Any
+    attempts: List[Dict[str, str]] = field(default_factory=list)  # 之前失败或跳过的 provider
+
+    @property
+    def failed_over(self) -> bool:
+        return bool(self.attempts)
+
+
+def _transient_status(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """
+    上游故障：网络错误、超时、429、5xx、本地限流排队超时
+
+    只有这类失败计入熔断并切换 provider；内容审核、图片无效、任务失败等由请求本身导致，
+    换 provider 也不会成功，反而要在备用 provider 上再付一次费
+    """
+    import httpx
+    from services.rate_limiter import RateLimitTimeout
+
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, RateLimitTimeout, httpx.TransportError)):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return _transient_status(error.response.status_code)
+    try:
+        import requests
+    except ImportError:
+        return False
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return _transient_status(error.response.status_code)
+    return False
+
+
+def _succeeded(result: Any) -> bool:
+    return bool(getattr(result, "success", True))
+
+
+def _transient(result: Any) -> bool:
+    """失败结果是否为上游故障（结果对象的 transient 字段由各 provider 按 is_transient_error 设置）"""
+    return bool(getattr(result, "transient", False))
+
+
+class ProviderRouter:
+    """按 provider 管理熔断器，并按顺序切换"""
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self.served: Dict[str, int] = {}
+        self.failovers = 0
+
+    def breaker(self, provider: str) -> CircuitBreaker:
+        breaker = self._breakers.get(provider)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(provider)
+                if breaker is None:
+                    breaker = CircuitBreaker(provider, load_breaker_config(provider))
+                    self._breakers[provider] = breaker
+        return breaker
+
+    def _served(self, provider: str, attempts: List[Dict[str, str]]):
+        with self._lock:
+            self.served[provider] = self.served.get(provider, 0) + 1
+            if attempts:
+                self.failovers += 1
+        if attempts:
+            tried = ", ".join(f"{a['provider']}({a['error']})" for a in attempts)
+            print(f"[Failover] 由 {provider} 提供服务，之前: {tried}")
+
+    def _settle(
+        self, breaker: CircuitBreaker, provider: str, result: Any, elapsed: float, attempts: List[Dict[str, str]],
+    ) -> Optional[RoutedResult]:
+        """
+        记录一次返回了结果的调用；成功或非上游故障的失败直接作为最终结果，上游故障返回 None 继续切换
+
+        非上游故障说明 provider 正常响应，按成功计入熔断窗口（仍参与慢调用统计）
+        """
+        ok = _succeeded(result)
+        if not ok and _transient(result):
+            breaker.record(False, elapsed)
+            return None
+        breaker.record(True, elapsed)
+        if ok:
+            self._served(provider, attempts)
+        return RoutedResult(provider=provider, result=result, attempts=attempts)
+
+    async def run(self, calls: List[Tuple[str, Callable[[], Awaitable[Any]]]]) -> RoutedResult:
+        """
+        按顺序调用 (provider, call)，返回第一个成功的结果
+
+        只有上游故障（异常或 transient=True 的失败结果，见 is_transient_error）计入熔断并切换；
+        其余失败结果原样返回，其余异常直接抛出。
+        全部上游故障时返回最后一个失败结果，全部熔断时抛出 CircuitOpenError
+        """
+        attempts: List[Dict[str, str]] = []
+        last: Optional[RoutedResult] = None
+        for provider, call in calls:
+            breaker = self.breaker(provider)
+            if not breaker.allow():
+                attempts.append({"provider": provider, "error": "circuit open"})
+                continue
+
+            start = time.monotonic()
+            try:
+                timeout = breaker.config.call_timeout or None
+                result = await asyncio.wait_for(call(), timeout=timeout)
+            except asyncio.CancelledError:
+                breaker.cancel()
+                raise
+            except asyncio.TimeoutError:
+                breaker.record(False, time.monotonic() - start)
+                attempts.append({"provider": provider, "error": f"timeout ({breaker.config.call_timeout}s)"})
+                continue
+            except Exception as e:
+                if not is_transient_error(e):
+                    breaker.cancel()
+                    raise
+                breaker.record(False, time.monotonic() - start)
+                attempts.append({"provider": provider, "error": str(e)})
+                continue
+
+            routed = self._settle(breaker, provider, result, time.monotonic() - start, attempts)
+            if routed is not None:
+                return routed
+            last = RoutedResult(provider=provider, result=result, attempts=list(attempts))
+            attempts.append({"provider": provider, "error": str(getattr(result, "error", "failed"))})
+
+        if last is None:
+            raise CircuitOpenError("; ".join(f"{a['provider']}: {a['error']}" for a in attempts) or "没有可用的 provider")
+        return last
+
+    def run_sync(self, calls: List[Tuple[str, Callable[[], Any]]]) -> RoutedResult:
+        """同步调用方（NanoBananaPipeline）；不支持 call_timeout"""
+        attempts: List[Dict[str, str]] = []
+        last: Optional[RoutedResult] = None
+        for provider, call in calls:
+            breaker = self.breaker(provider)
+            if not breaker.allow():
+                attempts.append({"provider": provider, "error": "circuit open"})
+                continue
+
+            start = time.monotonic()
+            try:
+                result = call()
+            except Exception as e:
+                if not is_transient_error(e):
+                    breaker.cancel()
+                    raise
+                breaker.record(False, time.monotonic() - start)
+                attempts.append({"provider": provider, "error": str(e)})
+                continue
+
+            routed = self._settle(breaker, provider, result, time.monotonic() - start, attempts)
+            if routed is not None:
+                return routed
+            last = RoutedResult(provider=provider, result=result, attempts=list(attempts))
+            attempts.append({"provider": provider, "error": str(getattr(result, "error", "failed"))})
+
+        if last is None:
+            raise CircuitOpenError("; ".join(f"{a['provider']}: {a['error']}" for a in attempts) or "没有可用的 provider")
+        return last
+
+    def stats(self) -> dict:
+        return {
+            "breakers": {name: breaker.stats() for name, breaker in list(self._breakers.items())},
+            "served": dict(self.served),
+            "failovers": self.failovers,
+        }
+
+
+provider_router = ProviderRouter()
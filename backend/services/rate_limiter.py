@@ -0,0 +1,284 @@
+"""
+上游 AI 服务限流器
+
+按 provider + 模型 限制在途任务数和请求速率（令牌桶），等待方 FIFO 排队，支持异步和同步调用方
+"""
+import os
+import re
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional
+
+
+class RateLimitTimeout(Exception):
+    """排队超过 queue_timeout 仍未获得名额"""
+
+
+@dataclass
+class LimitConfig:
+    """单个限流器的配置"""
+    max_in_flight: int = 8
+    rate_per_second: float = 0.0   # 0 表示不限速率
+    burst: int = 1
+    queue_timeout: float = 120.0
+
+
+# 默认配置（按 provider），可被环境变量覆盖
+DEFAULT_LIMITS = {
+    "grsai": LimitConfig(max_in_flight=16, rate_per_second=5.0, burst=5),
+    "replicate": LimitConfig(max_in_flight=4, rate_per_second=2.0, burst=2),
+    "svd": LimitConfig(max_in_flight=2, rate_per_second=0.5, burst=1, queue_timeout=300.0),
+}
+
+
+def _env_name(*parts: str) -> str:
+    return "LIMIT_" + "_".join(re.sub(r"[^A-Za-z0-9]+", "_", p).strip("_").upper() for p in parts if p)
+
+
+def load_limit_config(provider: str, model: str = None) -> LimitConfig:
+    """按 provider/模型 读取配置：模型级环境变量 > provider 级环境变量 > 默认值"""
+    base = DEFAULT_LIMITS.get(provider, LimitConfig())
+    scopes = [_env_name(provider, model), _env_name(provider)] if model else [_env_name(provider)]
+
+    def lookup(suffix: str, default, cast):
+        for scope in scopes:
+            value = os.getenv(f"{scope}_{suffix}")
+            if value:
+                return cast(value)
+        return default
+
+    return LimitConfig(
+        max_in_flight=lookup("MAX_IN_FLIGHT", base.max_in_flight, int),
+        rate_per_second=lookup("RPS", base.rate_per_second, float),
+        burst=lookup("BURST", base.burst, int),
+        queue_timeout=lookup("QUEUE_TIMEOUT", base.queue_timeout, float),
+    )
+
+
+class TokenBucket:
+    """
+    令牌桶（预约式）
+
+    reserve() 立即扣除一个令牌并返回需要等待的秒数；令牌可以透支，
+    后面的预约相应等待更久，因此按预约顺序放行。
+    """
+
+    def __init__(self, rate_per_second: float, burst: int = 1):
+        self.rate = rate_per_second
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+
+    def reserve(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        self._tokens -= 1
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class _Waiter:
+    """排队中的调用方：异步用 Future 唤醒，同步用 Event 唤醒"""
+
+    __slots__ = ("loop", "future", "event", "granted", "delay")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop = None):
+        self.loop = loop
+        self.future = loop.create_future() if loop else None
+        self.event = None if loop else threading.Event()
+        self.granted = False
+        self.delay = 0.0
+
+    def wake(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._set_future)
+        else:
+            self.event.set()
+
+    def _set_future(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class ProviderLimiter:
+    """单个 provider/模型 的限流器"""
+
+    def __init__(self, name: str, config: LimitConfig):
+        self.name = name
+        self.config = config
+        self._bucket = TokenBucket(config.rate_per_second, config.burst)
+        self._lock = threading.Lock()
+        self._queue: Deque[_Waiter] = deque()
+        self.in_flight = 0
+        # 指标
+        self.acquired = 0
+        self.timeouts = 0
+        self.max_queue_depth = 0
+        self.total_wait_seconds = 0.0
+
+    # ============ 名额分配（持有 _lock 时调用） ============
+
+    def _try_grant_locked(self) -> Optional[float]:
+        """队列为空且有空闲名额时直接获得，返回令牌等待时间"""
+        if self._queue or self.in_flight >= self.config.max_in_flight:
+            return None
+        self.in_flight += 1
+        return self._bucket.reserve()
+
+    def _enqueue_locked(self, waiter: _Waiter):
+        self._queue.append(waiter)
+        self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+
+    def _abandon_locked(self, waiter: _Waiter) -> bool:
+        """放弃排队；返回 True 表示已经获得名额（需要调用方归还）"""
+        if waiter.granted:
+            return True
+        try:
+            self._queue.remove(waiter)
+        except ValueError:
+            pass
+        return False
+
+    def release(self):
+        """归还名额（线程安全，异步/同步调用方共用）"""
+        with self._lock:
+            self.in_flight -= 1
+            # 按 FIFO 顺序把空出的名额交给排队方，令牌按同样顺序预约
+            while self._queue and self.in_flight < self.config.max_in_flight:
+                waiter = self._queue.popleft()
+                self.in_flight += 1
+                waiter.granted = True
+                waiter.delay = self._bucket.reserve()
+                waiter.wake()
+
+    def _record(self, started: float):
+        with self._lock:
+            self.acquired += 1
+            self.total_wait_seconds += time.monotonic() - started
+
+    def _timeout_error(self) -> RateLimitTimeout:
+        with self._lock:
+            self.timeouts += 1
+        return RateLimitTimeout(f"{self.name} 排队超时 ({self.config.queue_timeout}s)")
+
+    # ============ 异步 ============
+
+    async def acquire(self):
+        started = time.monotonic()
+        with self._lock:
+            delay = self._try_grant_locked()
+            if delay is None:
+                waiter = _Waiter(asyncio.get_running_loop())
+                self._enqueue_locked(waiter)
+
+        if delay is None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.config.queue_timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                with self._lock:
+                    granted = self._abandon_locked(waiter)
+                if not granted:
+                    if isinstance(e, asyncio.TimeoutError):
+                        raise self._timeout_error()
+                    raise
+                if isinstance(e, asyncio.CancelledError):
+                    self.release()
+                    raise
+                # 超时与获得名额同时发生：按获得处理
+            delay = waiter.delay
+
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.release()
+                raise
+        self._record(started)
+
+    # ============ 同步 ============
+
+    def acquire_sync(self):
+        started = time.monotonic()
+        with self._lock:
+            delay = self._try_grant_locked()
+            if delay is None:
+                waiter = _Waiter()
+                self._enqueue_locked(waiter)
+
+        if delay is None:
+            if not waiter.event.wait(timeout=self.config.queue_timeout):
+                with self._lock:
+                    granted = self._abandon_locked(waiter)
+                if not granted:
+                    raise self._timeout_error()
+            delay = waiter.delay
+
+        if delay > 0:
+            time.sleep(delay)
+        self._record(started)
+
+    def stats(self) -> dict:
+        """限流器指标（用于监控）"""
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "queue_depth": len(self._queue),
+                "max_queue_depth": self.max_queue_depth,
+                "acquired": self.acquired,
+                "timeouts": self.timeouts,
+                "avg_wait_seconds": self.total_wait_seconds / self.acquired if self.acquired else 0.0,
+                "max_in_flight": self.config.max_in_flight,
+                "rate_per_second": self.config.rate_per_second,
+            }
+
+
+class UpstreamLimits:
+    """按 provider + 模型 管理限流器"""
+
+    def __init__(self):
+        self._limiters: Dict[str, ProviderLimiter] = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str, model: str = None) -> ProviderLimiter:
+        model = getattr(model, "value", model)
+        name = f"{provider}:{model}" if model else provider
+        limiter = self._limiters.get(name)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.get(name)
+                if limiter is None:
+                    limiter = ProviderLimiter(name, load_limit_config(provider, model))
+                    self._limiters[name] = limiter
+        return limiter
+
+    @asynccontextmanager
+    async def limit(self, provider: str, model: str = None):
+        """异步调用方：获得名额后执行，结束时归还"""
+        limiter = self.get(provider, model)
+        await limiter.acquire()
+        try:
+            yield limiter
+        finally:
+            limiter.release()
+
+    @contextmanager
+    def limit_sync(self, provider: str, model: str = None):
+        """同步调用方（requests / replicate.run）"""
+        limiter = self.get(provider, model)
+        limiter.acquire_sync()
+        try:
+            yield limiter
+        finally:
+            limiter.release()
+
+    def stats(self) -> dict:
+        return {name: limiter.stats() for name, limiter in list(self._limiters.items())}
+
+
+upstream_limits = UpstreamLimits()
@@ -0,0 +1,244 @@
+"""
+生成结果缓存（内容寻址）
+
+按输入图片内容哈希 + 最终 prompt + 参数缓存成功结果（内存 LRU + SQLite），读文件和 SQLite 的方法应在线程中调用
+"""
+import os
+import json
+import time
+import base64
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlparse
+
+
+STATIC_DIR = Path(__file__).parent.parent / "static"
+# 本服务的域名：这些域名下的 /static/ URL 才对应本地文件，其他域名的同名路径是别人的文件
+LOCAL_HOSTS = {
+    host.strip().lower() for host in os.getenv("RESULT_CACHE_LOCAL_HOSTS", "localhost,127.0.0.1").split(",")
+    if host.strip()
+}
+# 只影响结果返回方式、不影响生成内容的字段
+_DELIVERY_FIELDS = ("webHook", "shutProgress")
+
+
+def content_digest(ref: str) -> str:
+    """图片引用 -> 内容哈希"""
+    if ref.startswith("data:"):
+        _, b64_data = ref.split(",", 1)
+        try:
+            data = base64.b64decode(b64_data + "=" * (-len(b64_data) % 4))
+        except ValueError:
+            data = ref.encode("utf-8")
+        return "sha256:" + hashlib.sha256(data).hexdigest()
+
+    parsed = urlparse(ref)
+    if parsed.netloc and (parsed.hostname or "").lower() not in LOCAL_HOSTS:
+        return "url:" + ref
+    path = parsed.path
+    if path.startswith("/static/uploads/"):
+        # 上传文件名即内容哈希（upload_store），无需读取文件
+        from services.upload_store import CONTENT_ADDRESSED_NAME
+        match = CONTENT_ADDRESSED_NAME.match(path[len("/static/uploads/"):])
+        if match:
+            return "sha256:" + match.group(1)
+    if path.startswith("/static/"):
+        static_dir = STATIC_DIR.resolve()
+        local_path = (static_dir / path[len("/static/"):]).resolve()
+        # 含 .. 的路径不能读到 static 目录以外
+        if local_path.is_relative_to(static_dir) and local_path.is_file():
+            with open(local_path, "rb") as f:
+                return "sha256:" + hashlib.sha256(f.read()).hexdigest()
+
+    return "url:" + ref
+
+
+class ResultCache:
+    """
+    两级结果缓存
+
+    使用示例:
+        key = result_cache.make_key(payload)
+        cached = result_cache.get(key)
+        if cached is None:
+            ...
+            result_cache.put(key, {"images": [...], "cost": 0.18})
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        ttl: float = 7200.0,
+        memory_max_bytes: int = 8 * 1024 * 1024,
+        disk_max_bytes: int = 256 * 1024 * 1024,
+        enabled: bool = True,
+    ):
+        """
+        Args:
+            db_path: SQLite 文件路径，不传则只用内存层
+            ttl: 结果有效期(秒)
+            memory_max_bytes: 内存层总字节上限
+            disk_max_bytes: 磁盘层总字节上限
+            enabled: 为 False 时 get 总是未命中、put 不写入
+        """
+        self.ttl = ttl
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.enabled = enabled
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (raw, expires_at)
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+
+        if enabled and db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS result_cache ("
+                " cache_key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_result_cache_accessed ON result_cache (accessed_at)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(payload: dict) -> str:
+        """
+        由上游请求 payload 计算缓存键
+
+        payload 中的 urls 替换为内容哈希，返回方式相关字段不参与计算
+        """
+        canonical = {k: v for k, v in payload.items() if k not in _DELIVERY_FIELDS}
+        canonical["urls"] = [content_digest(u) for u in payload.get("urls", [])]
+        raw = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    # ============ 内存层 ============
+
+    def _memory_put(self, key: str, raw: str, expires_at: float):
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old[0])
+        if len(raw) > self.memory_max_bytes:
+            return
+        self._memory[key] = (raw, expires_at)
+        self._memory_bytes += len(raw)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, (evicted, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _memory_get(self, key: str, now: float) -> Optional[str]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        raw, expires_at = entry
+        if expires_at <= now:
+            del self._memory[key]
+            self._memory_bytes -= len(raw)
+            return None
+        self._memory.move_to_end(key)
+        return raw
+
+    # ============ 磁盘层 ============
+
+    def _disk_get(self, key: str, now: float) -> Optional[tuple]:
+        row = self._db.execute(
+            "SELECT value, expires_at FROM result_cache WHERE cache_key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] <= now:
+            self._db.execute("DELETE FROM result_cache WHERE cache_key = ?", (key,))
+            self._db.commit()
+            return None
+        self._db.execute("UPDATE result_cache SET accessed_at = ? WHERE cache_key = ?", (now, key))
+        self._db.commit()
+        return row
+
+    def _disk_put(self, key: str, raw: str, expires_at: float, now: float):
+        self._db.execute(
+            "INSERT OR REPLACE INTO result_cache (cache_key, value, size, expires_at, accessed_at)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (key, raw, len(raw), expires_at, now),
+        )
+        self._db.execute("DELETE FROM result_cache WHERE expires_at <= ?", (now,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM result_cache").fetchone()[0]
+        if total > self.disk_max_bytes:
+            # 按最久未访问淘汰，直到回到上限以内
+            rows = self._db.execute("SELECT cache_key, size FROM result_cache ORDER BY accessed_at").fetchall()
+            evict = []
+            for cache_key, size in rows:
+                if total <= self.disk_max_bytes:
+                    break
+                evict.append((cache_key,))
+                total -= size
+            self._db.executemany("DELETE FROM result_cache WHERE cache_key = ?", evict)
+        self._db.commit()
+
+    # ============ 对外接口 ============
+
+    def get(self, key: str) -> Optional[dict]:
+        """命中返回缓存的 dict，未命中返回 None"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            raw = self._memory_get(key, now)
+            if raw is None and self._db is not None:
+                row = self._disk_get(key, now)
+                if row is not None:
+                    raw = row[0]
+                    self._memory_put(key, raw, row[1])
+            if raw is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(raw)
+
+    def put(self, key: str, value: dict):
+        """写入成功结果"""
+        if not self.enabled:
+            return
+        now = time.time()
+        raw = json.dumps(value, ensure_ascii=False)
+        expires_at = now + self.ttl
+        with self._lock:
+            self._memory_put(key, raw, expires_at)
+            if self._db is not None:
+                self._disk_put(key, raw, expires_at, now)
+
+    def stats(self) -> dict:
+        """缓存状态（用于监控）"""
+        with self._lock:
+            stats = {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+            }
+            if self._db is not None:
+                count, size = self._db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM result_cache"
+                ).fetchone()
+                stats.update(disk_entries=count, disk_bytes=size)
+        return stats
+
+
+result_cache = ResultCache(
+    db_path=os.getenv("RESULT_CACHE_PATH")
+    or os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "result_cache.db"),
+    ttl=float(os.getenv("RESULT_CACHE_TTL", "7200")),
+    memory_max_bytes=int(os.getenv("RESULT_CACHE_MEMORY_MAX_BYTES", str(8 * 1024 * 1024))),
+    disk_max_bytes=int(os.getenv("RESULT_CACHE_DISK_MAX_BYTES", str(256 * 1024 * 1024))),
+    enabled=os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true",
+)
@@ -0,0 +1,177 @@
+"""
+SAM 图像编码的跨请求微批处理
+
+多个推理线程同时遇到特征缓存未命中时合并成一次批量编码，记录排队延迟和批大小
+"""
+import os
+import time
+import queue
+import threading
+from bisect import bisect_left
+from concurrent.futures import Future
+from typing import Any, Callable, List, Sequence
+
+
+class Histogram:
+    """固定桶直方图（线程安全由调用方保证）"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个桶为 +Inf
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def snapshot(self) -> dict:
+        labels = [f"le_{b:g}" for b in self.buckets] + ["le_inf"]
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 2) if self.count else 0.0,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class _Request:
+    __slots__ = ("item", "future", "enqueued_at")
+
+    def __init__(self, item: Any):
+        self.item = item
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class MicroBatcher:
+    """
+    把多个线程的单条请求合并成批次执行
+    """
+
+    QUEUE_DELAY_BUCKETS_MS = (1, 5, 10, 20, 50, 100, 250, 500, 1000)
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch: int = 4,
+                 max_wait_ms: float = 20.0, name: str = "micro-batcher"):
+        """
+        Args:
+            batch_fn: 批处理函数，输入 N 条请求，按顺序返回 N 个结果
+            max_batch: 单批最多请求数，1 表示不合并（在调用方线程直接执行）
+            max_wait_ms: 第一条请求最多等待多久凑批
+            name: 批处理线程名
+        """
+        self.batch_fn = batch_fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.queue_delay_ms = Histogram(self.QUEUE_DELAY_BUCKETS_MS)
+        self.batch_sizes = Histogram(range(1, self.max_batch + 1))
+        self.batches = 0
+        self.failures = 0
+
+    def submit(self, item: Any, timeout: float = None) -> Any:
+        """提交一条请求并等待结果（在推理线程中调用）"""
+        if self.max_batch == 1:
+            started = time.monotonic()
+            result = self.batch_fn([item])[0]
+            self._record([started], time.monotonic())
+            return result
+        self._ensure_thread()
+        request = _Request(item)
+        self._queue.put(request)
+        return request.future.result(timeout=timeout)
+
+    def _ensure_thread(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _collect(self) -> List[_Request]:
+        """取第一条请求，再在截止时间前尽量凑满一批"""
+        batch = [self._queue.get()]
+        if batch[0] is None:
+            return []
+        deadline = batch[0].enqueued_at + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)  # 处理完这一批后退出
+                break
+            batch.append(request)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                return
+            started = time.monotonic()
+            try:
+                results = self.batch_fn([r.item for r in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"批处理返回 {len(results)} 个结果，期望 {len(batch)}")
+            except BaseException as e:
+                with self._stats_lock:
+                    self.failures += 1
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            finally:
+                self._record([r.enqueued_at for r in batch], started)
+            for request, result in zip(batch, results):
+                request.future.set_result(result)
+
+    def _record(self, enqueued: List[float], started: float):
+        with self._stats_lock:
+            self.batches += 1
+            self.batch_sizes.observe(len(enqueued))
+            for enqueued_at in enqueued:
+                self.queue_delay_ms.observe((started - enqueued_at) * 1000)
+
+    def shutdown(self):
+        """处理完已提交的请求后停止批处理线程"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=30)
+        self._thread = None
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self.batches,
+                "failures": self.failures,
+                "pending": self._queue.qsize(),
+                "batch_size": self.batch_sizes.snapshot(),
+                "queue_delay_ms": self.queue_delay_ms.snapshot(),
+            }
+
+
+def _encode_images(images: list) -> list:
+    """批量图像编码：一次 get_vision_features，按图片拆分为 batch=1 的特征"""
+    from services.local_sam_service import encode_image_batch
+    return encode_image_batch(images)
+
+
+def _default_max_batch() -> int:
+    from services.sam_executor import sam_executor
+    # 同时遇到缓存未命中的调用方最多 SAM_WORKERS 个，更大的批次永远凑不满
+    return min(int(os.getenv("SAM_BATCH_MAX_SIZE", "4")), sam_executor.workers)
+
+
+sam_encoder_batcher = MicroBatcher(
+    _encode_images,
+    max_batch=_default_max_batch(),
+    max_wait_ms=float(os.getenv("SAM_BATCH_MAX_WAIT_MS", "20")),
+    name="sam-encoder-batcher",
+)
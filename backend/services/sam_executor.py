@@ -0,0 +1,135 @@
+"""
+SAM 推理执行器
+
+在专用线程池中执行 SAM 推理，并发数与 torch 线程数匹配，有界队列满时抛出 InferenceOverloaded（503 + Retry-After）
+"""
+import os
+import math
+import time
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+
+class InferenceOverloaded(Exception):
+    """推理队列已满"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _set_torch_threads(threads: int):
+    """推理线程启动时设置 torch intra-op 线程数（未安装 torch 时跳过）"""
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+
+
+class InferenceExecutor:
+    """
+    有界的推理线程池（单事件循环内使用）
+    """
+
+    SERVICE_EWMA_ALPHA = 0.2
+
+    def __init__(self, workers: int = 1, max_queue: int = 4, torch_threads: int = None,
+                 initial_service_seconds: float = 5.0):
+        """
+        Args:
+            workers: 同时执行的推理数
+            max_queue: 排队上限（不含执行中的）
+            torch_threads: 每个推理的 torch 线程数
+            initial_service_seconds: 没有样本时估算 Retry-After 用的单次耗时
+        """
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // self.workers)
+        self.service_seconds = initial_service_seconds
+        self._executor = None
+        self._outstanding = 0
+        self._lock = threading.Lock()
+        # 指标
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="sam-inference",
+                initializer=_set_torch_threads,
+                initargs=(self.torch_threads,),
+            )
+        return self._executor
+
+    @property
+    def queued(self) -> int:
+        return max(0, self._outstanding - self.workers)
+
+    def retry_after(self) -> int:
+        """按当前积压和平均耗时估算多少秒后再试"""
+        rounds = self._outstanding / self.workers
+        return max(1, math.ceil(rounds * self.service_seconds))
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """在推理线程中执行 fn；队列已满时抛出 InferenceOverloaded"""
+        if self._outstanding >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise InferenceOverloaded(
+                f"分割服务繁忙（{self._outstanding} 个请求处理中）", self.retry_after()
+            )
+
+        with self._lock:
+            self._outstanding += 1
+        future = self._get_executor().submit(functools.partial(self._timed, fn, *args, **kwargs))
+        # 名额在推理线程真正结束（或排队中被取消）时释放；等待的请求被取消时推理仍在执行，不能提前放行新请求
+        future.add_done_callback(self._release)
+        try:
+            result, elapsed = await asyncio.wrap_future(future)
+            self.completed += 1
+            self.service_seconds += self.SERVICE_EWMA_ALPHA * (elapsed - self.service_seconds)
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+
+    def _release(self, _future):
+        with self._lock:
+            self._outstanding -= 1
+
+    @staticmethod
+    def _timed(fn: Callable, *args, **kwargs):
+        started = time.monotonic()
+        result = fn(*args, **kwargs)
+        return result, time.monotonic() - started
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "torch_threads": self.torch_threads,
+            "max_queue": self.max_queue,
+            "in_flight": min(self._outstanding, self.workers),
+            "queued": self.queued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_service_seconds": self.service_seconds,
+        }
+
+
+sam_executor = InferenceExecutor(
+    workers=int(os.getenv("SAM_WORKERS", "1")),
+    max_queue=int(os.getenv("SAM_MAX_QUEUE", "4")),
+    torch_threads=int(os.getenv("SAM_TORCH_THREADS") or 0) or None,
+)
@@ -0,0 +1,354 @@
+"""
+SAM 3 的 ONNX Runtime CPU 推理后端（动态 int8 量化）
+
+导出（部署时执行）: cd backend && python -m services.sam_onnx export
+"""
+import os
+import json
+import argparse
+import importlib
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+from PIL import Image
+
+
+BACKEND_DIR = Path(__file__).parent.parent
+
+MODEL_ID = os.getenv("SAM_MODEL_ID", "facebook/sam3")
+ONNX_DIR = BACKEND_DIR / os.getenv("SAM_ONNX_DIR", "models/sam3_onnx")
+QUANTIZE = os.getenv("SAM_ONNX_QUANTIZE", "1") not in ("0", "false", "False")
+INTRA_THREADS = int(os.getenv("SAM_ONNX_INTRA_THREADS", "0"))
+INTER_THREADS = int(os.getenv("SAM_ONNX_INTER_THREADS", "1"))
+DECODE_BATCH = int(os.getenv("SAM_ONNX_DECODE_BATCH", "1"))
+
+MANIFEST = "manifest.json"
+OPSET = 17
+
+
+# ============ 嵌套结构 <-> 张量列表 ============
+
+def _is_tensor(value: Any) -> bool:
+    return hasattr(value, "shape") and hasattr(value, "dtype")
+
+
+def _flatten(value: Any) -> Tuple[list, Any]:
+    """
+    嵌套的 dict / ModelOutput / list / tuple / 张量 -> (张量列表, 结构描述)
+
+    结构描述可 JSON 序列化；dict 子类（ModelOutput）记录类名，还原时按原类型构造
+    """
+    if _is_tensor(value):
+        return [value], "tensor"
+    if isinstance(value, dict):
+        leaves, fields = [], {}
+        for key, item in value.items():
+            if item is None:
+                continue
+            sub_leaves, fields[key] = _flatten(item)
+            leaves.extend(sub_leaves)
+        cls = type(value)
+        spec = {"dict": fields}
+        if cls is not dict:
+            spec["class"] = f"{cls.__module__}:{cls.__qualname__}"
+        return leaves, spec
+    if isinstance(value, (list, tuple)):
+        leaves, items = [], []
+        for item in value:
+            sub_leaves, sub_spec = _flatten(item)
+            leaves.extend(sub_leaves)
+            items.append(sub_spec)
+        return leaves, {"tuple" if isinstance(value, tuple) else "list": items}
+    raise TypeError(f"无法导出的类型: {type(value)!r}")
+
+
+def _unflatten(leaves: Iterator, spec: Any) -> Any:
+    """_flatten 的逆操作（leaves 为迭代器，按顺序消费）"""
+    if spec == "tensor":
+        return next(leaves)
+    if "dict" in spec:
+        fields = {key: _unflatten(leaves, sub_spec) for key, sub_spec in spec["dict"].items()}
+        if "class" in spec:
+            module, qualname = spec["class"].split(":")
+            cls = importlib.import_module(module)
+            for part in qualname.split("."):
+                cls = getattr(cls, part)
+            return cls(**fields)
+        return fields
+    if "tuple" in spec:
+        return tuple(_unflatten(leaves, sub_spec) for sub_spec in spec["tuple"])
+    return [_unflatten(leaves, sub_spec) for sub_spec in spec["list"]]
+
+
+# ============ 导出 ============
+
+def _export_kwargs() -> dict:
+    """torch>=2.5 的 torch.onnx.export 默认走 dynamo 导出，不支持包装模块的变长参数；固定用 TorchScript 追踪"""
+    import inspect
+    import torch
+    return {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+
+
+def _sample_prompts(processor, image: Image.Image) -> Dict[str, dict]:
+    """导出用的示例提示（与 LocalSAMService 的调用方式一致）"""
+    text_inputs = dict(processor(text=["sofa", "chair"], return_tensors="pt"))
+    box_inputs = dict(processor(
+        input_boxes=[[[image.width * 0.25, image.height * 0.25, image.width * 0.5, image.height * 0.5]]],
+        input_boxes_labels=[[1]],
+        original_sizes=[[image.height, image.width]],
+        return_tensors="pt",
+    ))
+    box_inputs.pop("original_sizes", None)
+    return {"text_decoder": text_inputs, "box_decoder": box_inputs}
+
+
+# 只量化 MatMul / Gemm（Transformer 的线性层，绝大部分参数在这里）。
+# 卷积量化成 ConvInteger 后在 CPU 上反而比 fp32 慢数倍（大特征图上逐次动态量化激活），保持 fp32
+QUANTIZE_OP_TYPES = ["MatMul", "Gemm"]
+
+
+def quantize_graph(fp32_path: Path, int8_path: Path):
+    """动态 int8 量化（权重离线量化，激活在运行时按批动态量化，无需校准数据）"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(
+        str(fp32_path), str(int8_path),
+        op_types_to_quantize=QUANTIZE_OP_TYPES,
+        weight_type=QuantType.QInt8,
+        use_external_data_format=True,
+    )
+
+
+def export(
+    output_dir: Path = ONNX_DIR,
+    quantize: bool = QUANTIZE,
+    sample_image: Image.Image = None,
+    model=None,
+    processor=None,
+) -> Path:
+    """
+    导出 SAM 3 为 ONNX（可选动态 int8 量化），返回 manifest 路径
+
+    需要 torch + transformers + onnx（量化另需 onnxruntime）；fp32 图超过 2GB 时权重存为外部数据文件。
+    model / processor 默认从 MODEL_ID 加载
+    """
+    import torch
+    from transformers import Sam3Model, Sam3Processor
+    from services.local_sam_service import _expand_batch
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    print(f"正在导出 SAM 3 ONNX ({MODEL_ID}) -> {output_dir}")
+
+    processor = processor or Sam3Processor.from_pretrained(MODEL_ID)
+    model = (model or Sam3Model.from_pretrained(MODEL_ID)).eval()
+    image = sample_image or Image.new("RGB", (1024, 768), (128, 128, 128))
+    pixel_values = processor(images=image, return_tensors="pt")["pixel_values"]
+
+    with torch.no_grad():
+        vision_embeds = model.get_vision_features(pixel_values=pixel_values)
+    vision_leaves, vision_spec = _flatten(vision_embeds)
+    export_kwargs = _export_kwargs()
+    vision_names = [f"vision_{i}" for i in range(len(vision_leaves))]
+
+    class VisionEncoder(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, pixel_values):
+            return tuple(_flatten(self.model.get_vision_features(pixel_values=pixel_values))[0])
+
+    class PromptDecoder(torch.nn.Module):
+        def __init__(self, prompt_keys: List[str]):
+            super().__init__()
+            self.model = model
+            self.prompt_keys = prompt_keys
+
+        def forward(self, *args):
+            vision = _unflatten(iter(args[:len(vision_names)]), vision_spec)
+            prompts = dict(zip(self.prompt_keys, args[len(vision_names):]))
+            return tuple(_flatten(self.model(vision_embeds=vision, **prompts))[0])
+
+    graphs = {}
+    fp32_files = {}
+
+    # 图像编码器
+    fp32_files["vision_encoder"] = output_dir / "vision_encoder.fp32.onnx"
+    torch.onnx.export(
+        VisionEncoder(), (pixel_values,), str(fp32_files["vision_encoder"]),
+        input_names=["pixel_values"], output_names=vision_names,
+        dynamic_axes={name: {0: "batch"} for name in ["pixel_values", *vision_names]},
+        opset_version=OPSET, **export_kwargs,
+    )
+    graphs["vision_encoder"] = {"inputs": ["pixel_values"], "outputs": vision_names}
+
+    # 提示解码器（文本 / 框各一张图）
+    for name, prompts in _sample_prompts(processor, image).items():
+        prompt_keys = list(prompts)
+        batch = next(iter(prompts.values())).shape[0]
+        vision_batch = [leaf.contiguous() for leaf in _flatten(_expand_batch(vision_embeds, batch))[0]]
+        with torch.no_grad():
+            sample_outputs = model(vision_embeds=_unflatten(iter(vision_batch), vision_spec), **prompts)
+        output_leaves, output_spec = _flatten(sample_outputs)
+        output_names = [f"out_{i}" for i in range(len(output_leaves))]
+
+        # 各输出的 batch 维不一定是第 0 维（decoder_reference_boxes 为 [层, batch, ...]）：与 batch=1 的输出对比形状确定
+        batch_axes = None
+        if batch > 1:
+            with torch.no_grad():
+                single = model(vision_embeds=vision_embeds, **{k: v[:1] for k, v in prompts.items()})
+            batch_axes = [
+                next(axis for axis, (a, b) in enumerate(zip(one.shape, full.shape)) if a != b)
+                for one, full in zip(_flatten(single)[0], output_leaves)
+            ]
+
+        dynamic_axes = {n: {0: "batch"} for n in vision_names}
+        for i, output_name in enumerate(output_names):
+            dynamic_axes[output_name] = {batch_axes[i] if batch_axes else 0: "batch"}
+        for key, value in prompts.items():
+            dynamic_axes[key] = {0: "batch", **({1: f"{key}_len"} if value.dim() > 1 else {})}
+
+        fp32_files[name] = output_dir / f"{name}.fp32.onnx"
+        torch.onnx.export(
+            PromptDecoder(prompt_keys), (*vision_batch, *prompts.values()), str(fp32_files[name]),
+            input_names=[*vision_names, *prompt_keys], output_names=output_names,
+            dynamic_axes=dynamic_axes, opset_version=OPSET, **export_kwargs,
+        )
+        graphs[name] = {
+            "inputs": [*vision_names, *prompt_keys],
+            "outputs": output_names,
+            "output_spec": output_spec,
+            "batch_axes": batch_axes,
+        }
+
+    for name, fp32_path in fp32_files.items():
+        if quantize:
+            int8_path = output_dir / f"{name}.int8.onnx"
+            quantize_graph(fp32_path, int8_path)
+            graphs[name]["file"] = int8_path.name
+        else:
+            graphs[name]["file"] = fp32_path.name
+
+    manifest_path = output_dir / MANIFEST
+    manifest_path.write_text(json.dumps({
+        "model_id": MODEL_ID,
+        "quantized": quantize,
+        "opset": OPSET,
+        "vision_spec": vision_spec,
+        "graphs": graphs,
+    }, ensure_ascii=False, indent=2))
+    print(f"SAM 3 ONNX 导出完成 (quantized={quantize})")
+    return manifest_path
+
+
+# ============ 运行时 ============
+
+class OnnxModelNotExported(Exception):
+    """SAM_BACKEND=onnx 但还没有导出 ONNX 模型"""
+    pass
+
+
+def check_exported(directory: Path = ONNX_DIR):
+    """确认导出结果存在（启动时和加载模型时调用）"""
+    if not (Path(directory) / MANIFEST).exists():
+        raise OnnxModelNotExported(
+            f"{directory} 下没有 SAM 3 ONNX 模型，请先在部署时执行: cd backend && python -m services.sam_onnx export"
+        )
+
+
+class OnnxSam3Model:
+    """
+    用 ONNX Runtime 执行的 SAM 3，提供 LocalSAMService 用到的 Sam3Model 接口子集：
+    device、get_vision_features(pixel_values=...)、__call__(vision_embeds=..., **提示)
+    """
+
+    backend = "onnx"
+
+    def __init__(self, directory: Path = ONNX_DIR, intra_threads: int = INTRA_THREADS, inter_threads: int = INTER_THREADS):
+        import torch
+        import onnxruntime as ort
+
+        self.directory = Path(directory)
+        self.manifest = json.loads((self.directory / MANIFEST).read_text())
+        self.device = torch.device("cpu")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # 解码器的输入形状随标签数变化，内存池会按每种形状继续扩张且不归还，常驻内存持续上涨
+        options.enable_cpu_mem_arena = False
+        options.intra_op_num_threads = intra_threads
+        options.inter_op_num_threads = max(1, inter_threads)
+        options.execution_mode = (
+            ort.ExecutionMode.ORT_PARALLEL if inter_threads > 1 else ort.ExecutionMode.ORT_SEQUENTIAL
+        )
+        self._sessions = {
+            name: ort.InferenceSession(str(self.directory / graph["file"]), options, providers=["CPUExecutionProvider"])
+            for name, graph in self.manifest["graphs"].items()
+        }
+        # 导出时会裁掉图中没用到的输入（解码器只读取部分图像特征），按会话实际的输入喂数据
+        self._input_names = {name: [i.name for i in session.get_inputs()] for name, session in self._sessions.items()}
+
+    @classmethod
+    def load(cls, directory: Path = ONNX_DIR) -> "OnnxSam3Model":
+        """加载导出结果（不在请求中隐式导出：导出需要 fp32 模型、耗时数分钟，应在部署时完成）"""
+        check_exported(directory)
+        return cls(directory)
+
+    def eval(self) -> "OnnxSam3Model":
+        return self
+
+    def _run(self, graph: str, feeds: Dict[str, Any]) -> list:
+        import numpy as np
+        import torch
+
+        arrays = {
+            name: np.ascontiguousarray(feeds[name].detach().cpu().numpy())
+            for name in self._input_names[graph]
+        }
+        return [torch.from_numpy(output) for output in self._sessions[graph].run(None, arrays)]
+
+    def get_vision_features(self, pixel_values):
+        outputs = self._run("vision_encoder", {"pixel_values": pixel_values})
+        return _unflatten(iter(outputs), self.manifest["vision_spec"])
+
+    def __call__(self, vision_embeds=None, **prompts):
+        import torch
+
+        graph = "box_decoder" if "input_boxes" in prompts else "text_decoder"
+        spec = self.manifest["graphs"][graph]
+        leaves, _ = _flatten(vision_embeds)
+        batch = next(iter(prompts.values())).shape[0]
+
+        # ONNX Runtime 不像 torch 那样及时释放中间结果，大批量解码的峰值内存成倍增长：按 DECODE_BATCH 拆分后拼接
+        step = batch if not spec.get("batch_axes") or DECODE_BATCH <= 0 else DECODE_BATCH
+        chunks = []
+        for start in range(0, batch, step):
+            end = min(start + step, batch)
+            feeds = {
+                f"vision_{i}": leaf[start:end] if batch > step and leaf.shape[0] == batch else leaf
+                for i, leaf in enumerate(leaves)
+            }
+            feeds.update({key: value[start:end] for key, value in prompts.items()})
+            chunks.append(self._run(graph, feeds))
+
+        if len(chunks) == 1:
+            outputs = chunks[0]
+        else:
+            outputs = [torch.cat(parts, dim=axis) for parts, axis in zip(zip(*chunks), spec["batch_axes"])]
+        return _unflatten(iter(outputs), spec["output_spec"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出 SAM 3 ONNX 模型")
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("--output", default=str(ONNX_DIR))
+    parser.add_argument("--no-quantize", action="store_true")
+    parser.add_argument("--image", help="导出时使用的示例图片（默认纯色 1024x768）")
+    args = parser.parse_args()
+
+    sample = Image.open(args.image).convert("RGB") if args.image else None
+    export(Path(args.output), quantize=not args.no_quantize, sample_image=sample)
+
+
+if __name__ == "__main__":
+    main()
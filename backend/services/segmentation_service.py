@@ -12,6 +12,8 @@ import requests
 from typing import List, Dict, Optional
 from dataclasses import dataclass, field
 
+from services.rate_limiter import upstream_limits
+
 
 @dataclass
 class SegmentedObject:
@@ -142,25 +144,26 @@ class SegmentationService:
         }
         
         try:
-            resp = requests.post(
-                f"{self.BASE_URL}/predictions",
-                headers=self.headers,
-                json=payload,
-                timeout=120
-            )
-            resp.raise_for_status()
-            result = resp.json()
-            
-            if result.get("status") == "succeeded":
-                return self._parse_result(result, start_time)
-            elif result.get("status") == "failed":
-                return SegmentationResult(
-                    success=False,
-                    error=result.get("error", "Segmentation failed"),
-                    elapsed_seconds=time.time() - start_time
+            with upstream_limits.limit_sync("replicate", self.MODEL):
+                resp = requests.post(
+                    f"{self.BASE_URL}/predictions",
+                    headers=self.headers,
+                    json=payload,
+                    timeout=120
                 )
-            else:
-                return self._poll_result(result.get("id"), start_time)
+                resp.raise_for_status()
+                result = resp.json()
+            
+                if result.get("status") == "succeeded":
+                    return self._parse_result(result, start_time)
+                elif result.get("status") == "failed":
+                    return SegmentationResult(
+                        success=False,
+                        error=result.get("error", "Segmentation failed"),
+                        elapsed_seconds=time.time() - start_time
+                    )
+                else:
+                    return self._poll_result(result.get("id"), start_time)
                 
         except Exception as e:
             return SegmentationResult(
@@ -302,36 +305,37 @@ class SAM2Service:
         }
         
         try:
-            resp = requests.post(
-                f"{self.BASE_URL}/predictions",
-                headers=self.headers,
-                json=payload,
-                timeout=60
-            )
-            resp.raise_for_status()
-            result = resp.json()
+            with upstream_limits.limit_sync("replicate", self.MODEL):
+                resp = requests.post(
+                    f"{self.BASE_URL}/predictions",
+                    headers=self.headers,
+                    json=payload,
+                    timeout=60
+                )
+                resp.raise_for_status()
+                result = resp.json()
             
-            if result.get("status") == "succeeded":
-                output = result.get("output")
-                mask_url = output if isinstance(output, str) else output.get("mask") if isinstance(output, dict) else None
+                if result.get("status") == "succeeded":
+                    output = result.get("output")
+                    mask_url = output if isinstance(output, str) else output.get("mask") if isinstance(output, dict) else None
                 
-                return SegmentationResult(
-                    success=True,
-                    objects=[SegmentedObject(label="selected", mask_url=mask_url or "")] if mask_url else [],
-                    combined_mask_url=mask_url,
-                    request_id=result.get("id"),
-                    cost=self.COST_PER_RUN,
-                    elapsed_seconds=time.time() - start_time
-                )
-            elif result.get("status") == "failed":
-                return SegmentationResult(
-                    success=False,
-                    error=result.get("error", "SAM failed"),
-                    elapsed_seconds=time.time() - start_time
-                )
-            else:
-                # 轮询
-                return self._poll_result(result.get("id"), start_time)
+                    return SegmentationResult(
+                        success=True,
+                        objects=[SegmentedObject(label="selected", mask_url=mask_url or "")] if mask_url else [],
+                        combined_mask_url=mask_url,
+                        request_id=result.get("id"),
+                        cost=self.COST_PER_RUN,
+                        elapsed_seconds=time.time() - start_time
+                    )
+                elif result.get("status") == "failed":
+                    return SegmentationResult(
+                        success=False,
+                        error=result.get("error", "SAM failed"),
+                        elapsed_seconds=time.time() - start_time
+                    )
+                else:
+                    # 轮询
+                    return self._poll_result(result.get("id"), start_time)
                 
         except Exception as e:
             return SegmentationResult(
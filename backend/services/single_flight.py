@@ -0,0 +1,91 @@
+"""
+Single-flight 请求合并
+
+同一时刻 key 相同的调用只执行一次上游请求，其余调用等待并共享结果（不做结果缓存）
+"""
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Hashable, Set
+
+
+@dataclass
+class FlightOutcome:
+    """一次 do() 调用的结果"""
+    value: Any
+    shared: bool             # 是否复用了其他调用发起的上游请求
+    first_for_member: bool   # 该 member 是否首次加入这次调用
+
+
+@dataclass
+class _Flight:
+    task: asyncio.Task
+    members: Set[Hashable] = field(default_factory=set)
+    waiters: int = 0
+
+
+class SingleFlight:
+    """
+    使用示例:
+        flights = SingleFlight()
+        outcome = await flights.do(key, lambda: service.generate(...), member=user_id)
+        result = outcome.value
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.calls = 0
+        self.shared_calls = 0
+
+    async def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Awaitable[Any]],
+        member: Hashable = None,
+    ) -> FlightOutcome:
+        """
+        执行或加入 key 对应的调用
+
+        Args:
+            key: 合并键
+            fn: 无参协程函数，只有首个调用方会执行
+            member: 调用方标识（如用户ID），用于区分同一调用方的重复请求
+        """
+        self.calls += 1
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if flight is None:
+            # 上游调用放在独立 Task 中，首个调用方被取消时不影响其他等待方
+            flight = _Flight(task=asyncio.create_task(fn()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._release(key, flight))
+        else:
+            self.shared_calls += 1
+
+        first_for_member = member is None or member not in flight.members
+        if member is not None:
+            flight.members.add(member)
+
+        flight.waiters += 1
+        try:
+            value = await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+        return FlightOutcome(value=value, shared=shared, first_for_member=first_for_member)
+
+    def _release(self, key: Hashable, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> dict:
+        """合并统计（用于监控）"""
+        return {
+            "in_flight": len(self._flights),
+            "calls": self.calls,
+            "shared_calls": self.shared_calls,
+        }
+
+
+# 生成请求合并（进程级）
+generation_flights = SingleFlight()
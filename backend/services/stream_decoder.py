@@ -0,0 +1,123 @@
+"""
+Grsai 流式响应解码器
+
+兼容 SSE 和裸 NDJSON 分帧，只关心最终状态时跳过中间进度帧，保留最近 N 行原始响应用于排查
+"""
+from collections import deque
+from typing import AsyncIterator, Deque, List, Optional
+
+try:
+    import orjson
+
+    def _json_loads(data: str):
+        return orjson.loads(data)
+
+    _JSONDecodeError = orjson.JSONDecodeError
+except ImportError:
+    import json
+
+    _json_loads = json.loads
+    _JSONDecodeError = json.JSONDecodeError
+
+
+SSE_PREFIX = "data:"
+TERMINAL_STATUSES = ("succeeded", "failed")
+# 终态帧一定包含其中一个状态字面量，缺少时可以跳过解析
+_TERMINAL_MARKERS = tuple(f'"{s}"' for s in TERMINAL_STATUSES)
+
+
+class GrsaiStreamDecoder:
+    """
+    增量式流解码器
+
+    使用示例:
+        decoder = GrsaiStreamDecoder()
+        async with client.stream("POST", url, json=payload) as response:
+            result = await decoder.read_terminal(response.aiter_lines())
+    """
+
+    def __init__(self, history_size: int = 20):
+        """
+        Args:
+            history_size: 环形缓冲保留的最近原始行数
+        """
+        self.history: Deque[str] = deque(maxlen=history_size)
+        self.frames_seen = 0
+        self.frames_parsed = 0
+
+    @staticmethod
+    def _strip_framing(line: str) -> Optional[str]:
+        """去掉 SSE 前缀，返回 JSON 文本；空行、注释行、结束标记返回 None"""
+        line = line.strip()
+        if not line or line.startswith(":"):
+            return None
+        if line.startswith(SSE_PREFIX):
+            line = line[len(SSE_PREFIX):].lstrip()
+        if not line or line == "[DONE]":
+            return None
+        return line
+
+    def decode_line(self, line: str, terminal_only: bool = False) -> Optional[dict]:
+        """
+        解码单行
+
+        Args:
+            line: 原始响应行
+            terminal_only: 为 True 时跳过非终态帧（不解析 JSON）
+
+        Returns:
+            解析后的 dict，跳过或无法解析时返回 None
+        """
+        payload = self._strip_framing(line)
+        if payload is None:
+            return None
+
+        self.frames_seen += 1
+        self.history.append(payload)
+
+        if terminal_only and not any(m in payload for m in _TERMINAL_MARKERS):
+            return None
+
+        try:
+            data = _json_loads(payload)
+        except _JSONDecodeError:
+            return None
+        self.frames_parsed += 1
+        return data if isinstance(data, dict) else None
+
+    async def iter_frames(
+        self,
+        lines: AsyncIterator[str],
+        terminal_only: bool = False,
+    ) -> AsyncIterator[dict]:
+        """逐帧产出解析后的 dict"""
+        async for line in lines:
+            data = self.decode_line(line, terminal_only=terminal_only)
+            if data is not None:
+                yield data
+
+    async def read_terminal(
+        self,
+        lines: AsyncIterator[str],
+        failure_message: str = "Generation failed",
+    ) -> dict:
+        """
+        读取到终态为止
+
+        Returns:
+            status == succeeded 的结果帧
+
+        Raises:
+            Exception: 任务失败或流结束仍未收到结果
+        """
+        async for data in self.iter_frames(lines, terminal_only=True):
+            status = data.get("status")
+            if status == "succeeded":
+                return data
+            if status == "failed":
+                raise Exception(data.get("error") or data.get("failure_reason") or failure_message)
+        raise Exception(f"No result received. Lines: {self.frames_seen}")
+
+    def tail(self) -> List[str]:
+        """最近的原始响应（用于日志）"""
+        return list(self.history)
@@ -0,0 +1,285 @@
+"""
+会员等级优先调度
+
+在 AI 服务调用前按会员等级加权公平分配上游名额，支持预留名额、防饿死和排队位置 / 预计等待时间
+"""
+import os
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional
+
+from services.auth_service import MembershipType
+from services.rate_limiter import load_limit_config
+
+
+class SchedulerTimeout(Exception):
+    """排队超过 queue_timeout 仍未获得名额"""
+
+
+@dataclass
+class TierConfig:
+    """单个会员等级的调度配置"""
+    weight: float = 1.0
+    reserved: int = 0
+
+
+DEFAULT_TIERS = {
+    MembershipType.FREE.value: TierConfig(weight=1, reserved=0),
+    MembershipType.PERSONAL.value: TierConfig(weight=2, reserved=1),
+    MembershipType.DESIGNER.value: TierConfig(weight=4, reserved=2),
+    MembershipType.ENTERPRISE.value: TierConfig(weight=6, reserved=3),
+}
+
+
+def load_tier_configs() -> Dict[str, TierConfig]:
+    """读取各等级配置：SCHEDULER_<TIER>_WEIGHT / _RESERVED > 默认值"""
+    configs = {}
+    for tier, base in DEFAULT_TIERS.items():
+        weight = os.getenv(f"SCHEDULER_{tier.upper()}_WEIGHT")
+        reserved = os.getenv(f"SCHEDULER_{tier.upper()}_RESERVED")
+        configs[tier] = TierConfig(
+            weight=float(weight) if weight else base.weight,
+            reserved=int(reserved) if reserved else base.reserved,
+        )
+    return configs
+
+
+class Ticket:
+    """一次排队请求"""
+
+    __slots__ = ("tier", "enqueued_at", "granted_at", "future")
+
+    def __init__(self, tier: str):
+        self.tier = tier
+        self.enqueued_at = time.monotonic()
+        self.granted_at: Optional[float] = None
+        self.future = asyncio.get_running_loop().create_future()
+
+    @property
+    def granted(self) -> bool:
+        return self.granted_at is not None
+
+
+class _TierState:
+    """单个等级的队列与统计"""
+
+    def __init__(self, config: TierConfig):
+        self.config = config
+        self.queue: Deque[Ticket] = deque()
+        self.in_flight = 0
+        self.vtime = 0.0
+        self.served = 0
+        self.waits: Deque[float] = deque(maxlen=200)
+
+    def wait_p95(self) -> float:
+        if not self.waits:
+            return 0.0
+        ordered = sorted(self.waits)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+class TierScheduler:
+    """
+    加权公平 + 预留名额 + 防饿死的调度器（单事件循环内使用）
+    """
+
+    SERVICE_EWMA_ALPHA = 0.2
+
+    def __init__(
+        self,
+        capacity: int = 16,
+        tiers: Dict[str, TierConfig] = None,
+        starvation_seconds: float = 30.0,
+        queue_timeout: float = 300.0,
+        default_tier: str = MembershipType.FREE.value,
+        initial_service_seconds: float = 30.0,
+    ):
+        """
+        Args:
+            capacity: 总名额（同时执行的请求数）
+            tiers: 各等级配置，预留名额之和不应超过 capacity
+            starvation_seconds: 队首等待超过该值的请求优先放行
+            queue_timeout: 排队超时(秒)
+            default_tier: 未知用户/等级使用的等级
+            initial_service_seconds: 没有样本时估算 ETA 用的单次耗时
+        """
+        self.capacity = capacity
+        self.tiers: Dict[str, _TierState] = {
+            tier: _TierState(config) for tier, config in (tiers or load_tier_configs()).items()
+        }
+        if sum(s.config.reserved for s in self.tiers.values()) >= capacity:
+            # 预留占满总名额时没有预留的等级永远无法执行
+            print(f"⚠️ 会员预留名额之和不小于总名额 {capacity}，忽略预留")
+            for state in self.tiers.values():
+                state.config = TierConfig(weight=state.config.weight, reserved=0)
+        self.starvation_seconds = starvation_seconds
+        self.queue_timeout = queue_timeout
+        self.default_tier = default_tier if default_tier in self.tiers else next(iter(self.tiers))
+        self.service_seconds = initial_service_seconds
+        self._virtual_clock = 0.0
+        self.timeouts = 0
+        self.aged_grants = 0
+
+    # ============ 名额 ============
+
+    @property
+    def shared_capacity(self) -> int:
+        reserved = sum(state.config.reserved for state in self.tiers.values())
+        return max(0, self.capacity - reserved)
+
+    def _shared_in_use(self) -> int:
+        return sum(max(0, s.in_flight - s.config.reserved) for s in self.tiers.values())
+
+    def _can_run(self, state: _TierState) -> bool:
+        if state.in_flight < state.config.reserved:
+            return True
+        return self._shared_in_use() < self.shared_capacity
+
+    def _resolve(self, tier: Optional[str]) -> str:
+        tier = getattr(tier, "value", tier)
+        return tier if tier in self.tiers else self.default_tier
+
+    def _dispatch(self):
+        """把空出的名额按 防饿死 > 虚拟时间 的顺序分配给排队方"""
+        now = time.monotonic()
+        while True:
+            candidates = [s for s in self.tiers.values() if s.queue and self._can_run(s)]
+            if not candidates:
+                return
+            aged = [s for s in candidates if now - s.queue[0].enqueued_at >= self.starvation_seconds]
+            if aged:
+                state = min(aged, key=lambda s: s.queue[0].enqueued_at)
+                self.aged_grants += 1
+            else:
+                state = min(candidates, key=lambda s: (s.vtime, -s.config.weight))
+            ticket = state.queue.popleft()
+            self._grant(state, ticket, now)
+            self._virtual_clock = state.vtime
+            state.vtime += 1.0 / max(state.config.weight, 1e-6)
+
+    def _grant(self, state: _TierState, ticket: Ticket, now: float):
+        state.in_flight += 1
+        state.served += 1
+        state.waits.append(now - ticket.enqueued_at)
+        ticket.granted_at = now
+        if not ticket.future.done():
+            ticket.future.set_result(None)
+
+    # ============ 排队 ============
+
+    def enqueue(self, tier: str = None) -> Ticket:
+        """加入对应等级的队列；有空闲名额时立即获得"""
+        tier = self._resolve(tier)
+        state = self.tiers[tier]
+        ticket = Ticket(tier)
+        if not state.queue:
+            # 空闲后重新排队的 tier 不能用之前攒下的虚拟时间插队
+            state.vtime = max(state.vtime, self._virtual_clock)
+        state.queue.append(ticket)
+        self._dispatch()
+        return ticket
+
+    async def wait(self, ticket: Ticket, timeout: float = None) -> bool:
+        """
+        等待获得名额；timeout 到期仍在排队返回 False（用于推送排队进度），
+        总排队时间超过 queue_timeout 抛出 SchedulerTimeout
+        """
+        if ticket.granted:
+            return True
+        remaining = self.queue_timeout - (time.monotonic() - ticket.enqueued_at)
+        wait_for = remaining if timeout is None else min(timeout, remaining)
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), timeout=max(0.0, wait_for))
+            return True
+        except asyncio.TimeoutError:
+            if ticket.granted:
+                return True
+            if time.monotonic() - ticket.enqueued_at >= self.queue_timeout:
+                self.release(ticket)
+                self.timeouts += 1
+                raise SchedulerTimeout(f"{ticket.tier} 排队超时 ({self.queue_timeout}s)")
+            return False
+
+    def release(self, ticket: Ticket):
+        """归还名额或放弃排队"""
+        state = self.tiers[ticket.tier]
+        if ticket.granted:
+            state.in_flight -= 1
+            elapsed = time.monotonic() - ticket.granted_at
+            self.service_seconds += self.SERVICE_EWMA_ALPHA * (elapsed - self.service_seconds)
+            ticket.granted_at = None  # 防止重复归还
+        else:
+            try:
+                state.queue.remove(ticket)
+            except ValueError:
+                return
+            if not ticket.future.done():
+                ticket.future.cancel()
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, tier: str = None):
+        """获得名额后执行，结束时归还"""
+        ticket = self.enqueue(tier)
+        try:
+            await self.wait(ticket)
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    # ============ 排队进度 ============
+
+    def position(self, ticket: Ticket) -> int:
+        """在本等级队列中的位置（1 开始），已获得名额为 0"""
+        if ticket.granted:
+            return 0
+        try:
+            return self.tiers[ticket.tier].queue.index(ticket) + 1
+        except ValueError:
+            return 0
+
+    def eta(self, ticket: Ticket) -> float:
+        """
+        预计等待秒数：按本等级在排队等级中的权重份额估算可用名额，
+        再乘以平均单次耗时（粗略估算，用于前端展示）
+        """
+        position = self.position(ticket)
+        if position == 0:
+            return 0.0
+        state = self.tiers[ticket.tier]
+        active_weight = sum(s.config.weight for s in self.tiers.values() if s.queue)
+        share = state.config.weight / active_weight if active_weight else 1.0
+        slots = max(state.config.reserved, min(self.capacity, share * self.capacity), 1.0)
+        return position * self.service_seconds / slots
+
+    def stats(self) -> dict:
+        """调度指标（用于监控）"""
+        return {
+            "capacity": self.capacity,
+            "shared_capacity": self.shared_capacity,
+            "shared_in_use": self._shared_in_use(),
+            "avg_service_seconds": self.service_seconds,
+            "timeouts": self.timeouts,
+            "aged_grants": self.aged_grants,
+            "tiers": {
+                tier: {
+                    "weight": state.config.weight,
+                    "reserved": state.config.reserved,
+                    "queued": len(state.queue),
+                    "in_flight": state.in_flight,
+                    "served": state.served,
+                    "wait_p95": state.wait_p95(),
+                }
+                for tier, state in self.tiers.items()
+            },
+        }
+
+
+tier_scheduler = TierScheduler(
+    capacity=int(os.getenv("SCHEDULER_CAPACITY") or load_limit_config("grsai").max_in_flight),
+    starvation_seconds=float(os.getenv("SCHEDULER_STARVATION_SECONDS", "30")),
+    queue_timeout=float(os.getenv("SCHEDULER_QUEUE_TIMEOUT", "300")),
+)
@@ -0,0 +1,149 @@
+"""
+内容寻址的上传存储
+
+分块写入并计算 SHA-256，文件名为 <sha256>.<ext>，按文件头识别格式，超过大小上限立即中止
+"""
+import os
+import re
+import uuid
+import hashlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+import aiofiles
+
+
+CHUNK_SIZE = 1024 * 1024
+
+# 内容寻址的文件名：<sha256>.<ext>
+CONTENT_ADDRESSED_NAME = re.compile(r"^([0-9a-f]{64})\.(jpg|png|webp|gif)$")
+
+
+class UploadTooLarge(Exception):
+    """上传超过大小上限"""
+
+
+class UnsupportedImage(Exception):
+    """文件头不是支持的图片格式"""
+
+
+@dataclass
+class StoredUpload:
+    """已保存的上传文件"""
+    filename: str
+    sha256: str
+    size: int
+    content_type: str
+    duplicate: bool  # 相同内容已存在，未占用新的磁盘空间
+
+
+def sniff_image_type(head: bytes) -> Optional[tuple]:
+    """按文件头魔数识别图片格式，返回 (content_type, ext)"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg", "jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png", "png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp", "webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif", "gif"
+    return None
+
+
+class UploadStore:
+    """
+    使用示例:
+        stored = await upload_store.save_upload(file)
+        url = f"/static/uploads/{stored.filename}"
+    """
+
+    SNIFF_BYTES = 12
+
+    def __init__(self, directory: Path, max_bytes: int = 25 * 1024 * 1024, chunk_size: int = CHUNK_SIZE):
+        """
+        Args:
+            directory: 存储目录
+            max_bytes: 单个文件上限
+            chunk_size: 每次读取的块大小
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # 指标
+        self.stored = 0
+        self.duplicates = 0
+        self.bytes_saved = 0
+
+    async def save(self, chunks: AsyncIterator[bytes]) -> StoredUpload:
+        """分块保存；超过上限抛出 UploadTooLarge，不是图片抛出 UnsupportedImage"""
+        tmp_path = self.directory / f".upload-{uuid.uuid4().hex}.tmp"
+        digest = hashlib.sha256()
+        size = 0
+        head = b""
+        image_type = None
+        try:
+            async with aiofiles.open(tmp_path, "wb") as f:
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadTooLarge(f"文件超过 {self.max_bytes // (1024 * 1024)}MB")
+                    if image_type is None:
+                        head += chunk[:self.SNIFF_BYTES - len(head)]
+                        if len(head) >= self.SNIFF_BYTES:
+                            image_type = self._sniff(head)
+                    digest.update(chunk)
+                    await f.write(chunk)
+
+            if image_type is None:
+                image_type = self._sniff(head)
+            content_type, ext = image_type
+            sha256 = digest.hexdigest()
+            filename = f"{sha256}.{ext}"
+            final_path = self.directory / filename
+
+            duplicate = final_path.exists()
+            if duplicate:
+                self.duplicates += 1
+                self.bytes_saved += size
+            else:
+                os.replace(tmp_path, final_path)
+                self.stored += 1
+            return StoredUpload(filename, sha256, size, content_type, duplicate)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    async def save_upload(self, file) -> StoredUpload:
+        """保存 FastAPI UploadFile（Starlette 已将大文件缓冲到临时文件，这里分块读取）"""
+        async def chunks():
+            while True:
+                chunk = await file.read(self.chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+        return await self.save(chunks())
+
+    def _sniff(self, head: bytes) -> tuple:
+        image_type = sniff_image_type(head)
+        if image_type is None:
+            raise UnsupportedImage("不支持的图片格式")
+        return image_type
+
+    def stats(self) -> dict:
+        return {
+            "stored": self.stored,
+            "duplicates": self.duplicates,
+            "bytes_saved": self.bytes_saved,
+            "max_bytes": self.max_bytes,
+        }
+
+
+upload_store = UploadStore(
+    Path(__file__).parent.parent / "static" / "uploads",
+    max_bytes=int(os.getenv("UPLOAD_MAX_BYTES", str(25 * 1024 * 1024))),
+)
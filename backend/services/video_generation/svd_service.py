@@ -197,7 +197,10 @@ class SVDService:
         try:
             # 加载图片
             if image_path:
-                image = Image.open(image_path).convert('RGB')
+                # 上传图片取不小于目标尺寸的最小衍生图，不再解码 4K 原图
+                from services.image_derivatives import derivative_store
+                derived = derivative_store.resolve_for_size(image_path, max(self.preset["size"]))
+                image = Image.open(derived or image_path).convert('RGB')
             elif image_base64:
                 if image_base64.startswith('data:'):
                     _, image_base64 = image_base64.split(',', 1)
@@ -292,6 +295,7 @@ class SVDService:
         try:
             import replicate
             import time
+            from services.rate_limiter import upstream_limits
             
             # 图片转 base64 data URI
             buffer = io.BytesIO()
@@ -302,18 +306,19 @@ class SVDService:
             print("[SVD] 调用 Replicate API...")
             start_time = time.time()
             
-            # 调用 Replicate SVD 模型
-            output = replicate.run(
-                "stability-ai/stable-video-diffusion:3f0457e4619daac51203dedb472816fd4af51f3149fa7a9e0b5ffcf1b8172438",
-                input={
-                    "input_image": image_uri,
-                    "video_length": "25_frames_with_svd_xt",
-                    "sizing_strategy": "maintain_aspect_ratio",
-                    "motion_bucket_id": 127,
-                    "cond_aug": 0.02,
-                    "fps": 7
-                }
-            )
+            # 调用 Replicate SVD 模型（按 svd 限流）
+            async with upstream_limits.limit("svd", "replicate"):
+                output = replicate.run(
+                    "stability-ai/stable-video-diffusion:3f0457e4619daac51203dedb472816fd4af51f3149fa7a9e0b5ffcf1b8172438",
+                    input={
+                        "input_image": image_uri,
+                        "video_length": "25_frames_with_svd_xt",
+                        "sizing_strategy": "maintain_aspect_ratio",
+                        "motion_bucket_id": 127,
+                        "cond_aug": 0.02,
+                        "fps": 7
+                    }
+                )
             
             elapsed = time.time() - start_time
             print(f"[SVD] API 完成，耗时 {elapsed:.1f}s")
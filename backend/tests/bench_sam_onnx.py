@@ -0,0 +1,111 @@
+"""
+基准测试：SAM 3 torch 后端 vs ONNX Runtime 后端（动态 int8 量化），CPU 上的延迟和常驻内存
+需要本地 SAM 3 模型（transformers + torch）、onnxruntime 和导出好的 ONNX 模型（python -m services.sam_onnx export）
+
+每个后端在独立子进程中运行（SAM_BACKEND 在导入时读取，峰值 RSS 也需要按进程统计）：
+- 编码：关闭图像特征缓存，每次 segment_furniture 都重新编码图像
+- 点击：特征命中缓存，只比较框提示解码
+峰值 RSS 为子进程的 ru_maxrss（包含模型加载）。
+
+运行:
+    cd backend
+    CUDA_VISIBLE_DEVICES= python tests/bench_sam_onnx.py [图片路径] [--repeat 3] [--backends torch,onnx]
+"""
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import resource
+import subprocess
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_IMAGE_DIR = Path(__file__).parent.parent / "test_images" / "input"
+
+
+def _child(args) -> dict:
+    """在当前进程中测一个后端（由父进程以 --child 调用），结果以 JSON 输出到最后一行"""
+    from services.embedding_cache import sam_embedding_cache
+    from services.local_sam_service import LocalSAMService
+    from services.mask_compositor import segmentation_compositor
+
+    image_base64 = base64.b64encode(Path(args.image).read_bytes()).decode()
+    labels = LocalSAMService.DEFAULT_LABELS
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        segmentation_compositor.output_dir = Path(output_dir)
+        service = LocalSAMService(output_dir=output_dir)
+
+        start = time.perf_counter()
+        warm = service.segment_furniture(image_base64=image_base64, labels=labels[:1])
+        assert warm.success, warm.error
+        load_seconds = time.perf_counter() - start
+
+        segment_runs, objects = [], 0
+        for _ in range(args.repeat):
+            sam_embedding_cache.clear()
+            result = service.segment_furniture(image_base64=image_base64, labels=labels)
+            assert result.success, result.error
+            segment_runs.append(result.elapsed_seconds)
+            objects = len(result.objects)
+
+        _, source_size = service._load_work_image(image_base64=image_base64)
+        point_runs = []
+        for _ in range(args.repeat):
+            result = service.segment_at_point(image_base64=image_base64, x=source_size[1] // 2, y=source_size[0] // 2)
+            assert result.success, result.error
+            point_runs.append(result.elapsed_seconds)
+
+    return {
+        "load": load_seconds,
+        "segment_best": min(segment_runs),
+        "segment_avg": sum(segment_runs) / len(segment_runs),
+        "point_best": min(point_runs),
+        "objects": objects,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,  # Linux 下单位为 KB
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("image", nargs="?", help="测试图片（默认 test_images/input 下的第一张）")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--backends", default="torch,onnx")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.image = args.image or str(sorted(DEFAULT_IMAGE_DIR.glob("*.jpg"))[0])
+
+    if args.child:
+        print(json.dumps(_child(args)))
+        return
+
+    print(f"图片: {Path(args.image).name}, 重复: {args.repeat}")
+    timings = {}
+    for backend in args.backends.split(","):
+        env = dict(os.environ, SAM_BACKEND=backend, CUDA_VISIBLE_DEVICES="")
+        proc = subprocess.run(
+            [sys.executable, __file__, args.image, "--repeat", str(args.repeat), "--child"],
+            env=env, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            print(f"{backend} 失败:\n{proc.stderr[-2000:]}")
+            continue
+        timings[backend] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    if not timings:
+        return
+    baseline = timings.get("torch", next(iter(timings.values())))
+    print(f"\n{'backend':>8} {'load(s)':>8} {'seg best(s)':>12} {'seg avg(s)':>11} {'point(s)':>9} "
+          f"{'objects':>8} {'RSS(MB)':>8} {'speedup':>8}")
+    for backend, t in timings.items():
+        print(f"{backend:>8} {t['load']:>8.1f} {t['segment_best']:>12.2f} {t['segment_avg']:>11.2f} "
+              f"{t['point_best']:>9.2f} {t['objects']:>8} {t['max_rss_mb']:>8.0f} "
+              f"{baseline['segment_best'] / t['segment_best']:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+基准测试：SAM 3 文本提示逐个解码 vs 批量解码
+需要本地 SAM 3 模型（transformers + torch），在 CPU 上运行
+
+图片缩放到最长边 1024；图像特征先编码一次（之后命中特征缓存），
+两种模式都只比较标签解码 + 后处理 + mask 输出的耗时。
+
+运行:
+    cd backend
+    CUDA_VISIBLE_DEVICES= python tests/bench_sam_text_batching.py [图片路径] [--repeat 3] [--batch-sizes 1,4,8,14]
+"""
+import os
+import sys
+import time
+import base64
+import argparse
+import tempfile
+from io import BytesIO
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from services.local_sam_service import LocalSAMService
+
+DEFAULT_IMAGE_DIR = Path(__file__).parent.parent / "test_images" / "input"
+
+
+def _load_1024(path: Path) -> str:
+    """读取图片并缩放到最长边 1024，返回 base64"""
+    image = Image.open(path).convert("RGB")
+    ratio = 1024 / max(image.size)
+    image = image.resize((round(image.width * ratio), round(image.height * ratio)), Image.Resampling.LANCZOS)
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=95)
+    print(f"图片: {path.name} -> {image.size}")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("image", nargs="?", help="测试图片（默认 test_images/input 下的第一张）")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--batch-sizes", default="1,4,8,14")
+    args = parser.parse_args()
+
+    path = Path(args.image) if args.image else sorted(DEFAULT_IMAGE_DIR.glob("*.jpg"))[0]
+    image_base64 = _load_1024(path)
+    labels = LocalSAMService.DEFAULT_LABELS
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        service = LocalSAMService(output_dir=output_dir)
+
+        # 预热：加载模型并编码图像特征（之后命中缓存）
+        warm = service.segment_furniture(image_base64=image_base64, labels=labels[:1], batch_size=1)
+        assert warm.success, warm.error
+
+        import torch
+        print(f"torch 线程数: {torch.get_num_threads()}, 标签数: {len(labels)}, 重复: {args.repeat}")
+
+        timings = {}
+        for batch_size in batch_sizes:
+            runs = []
+            for _ in range(args.repeat):
+                result = service.segment_furniture(image_base64=image_base64, labels=labels, batch_size=batch_size)
+                assert result.success, result.error
+                runs.append(result.elapsed_seconds)
+            timings[batch_size] = (min(runs), sum(runs) / len(runs), len(result.objects))
+
+    baseline = timings.get(1, next(iter(timings.values())))[0]
+    print(f"\n{'batch':>6} {'best(s)':>9} {'avg(s)':>9} {'objects':>8} {'speedup':>8}")
+    for batch_size, (best, avg, count) in timings.items():
+        print(f"{batch_size:>6} {best:>9.2f} {avg:>9.2f} {count:>8} {baseline / best:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+测试紧凑 mask 表示（按行打包位图 + COCO RLE）
+不需要模型和 API Key（用 numpy 随机 mask 与 bool 数组结果对照）
+
+运行:
+    cd backend
+    python tests/test_compact_mask.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from services.compact_mask import CompactMask
+
+
+def _random_mask(rng, h=37, w=53, p=0.3) -> np.ndarray:
+    return rng.random((h, w)) < p
+
+
+def test_roundtrip_and_set_ops():
+    """打包往返一致；集合运算 / 面积 / 包围框与 bool 数组结果相同；内存约为 1/8"""
+    rng = np.random.default_rng(0)
+    a, b = _random_mask(rng), _random_mask(rng)
+    ca, cb = CompactMask.from_array(a), CompactMask.from_array(b)
+
+    assert np.array_equal(ca.to_array(), a)
+    assert np.array_equal((ca | cb).to_array(), a | b)
+    assert np.array_equal((ca & cb).to_array(), a & b)
+    assert np.array_equal((ca - cb).to_array(), a & ~b)
+    assert np.array_equal((~ca).to_array(), ~a) and (~ca).area() == (~a).sum()
+    assert ca.area() == a.sum() and abs(ca.iou(cb) - (a & b).sum() / (a | b).sum()) < 1e-9
+
+    box = np.zeros((40, 70), dtype=bool)
+    box[5:12, 17:33] = True
+    assert CompactMask.from_array(box).bbox() == [17, 5, 33, 12]
+    assert CompactMask.empty(4, 4).bbox() is None
+
+    big = CompactMask.from_array(np.zeros((3000, 4000), dtype=bool))
+    assert big.nbytes == 3000 * 500
+    print("✅ 往返 / 集合运算通过")
+
+
+def test_rle_matches_coco():
+    """RLE 列优先、从 0 开始计数；压缩字符串按 COCO 差分变长编码并可往返"""
+    mask = np.zeros((3, 4), dtype=bool)
+    mask[0, 0] = True
+    mask[1:3, 2] = True
+    rle = CompactMask.from_array(mask).to_rle()
+    assert CompactMask.from_array(mask).rle_counts() == [0, 1, 6, 2, 3]
+    assert rle["size"] == [3, 4] and np.array_equal(CompactMask.from_rle(rle).to_array(), mask)
+    assert np.array_equal(CompactMask.from_rle({"size": [3, 4], "counts": [0, 1, 6, 2, 3]}).to_array(), mask)
+
+    # 4x4 左上 2x2 方块：counts [0, 2, 2, 2, 10]，第 4 个起与前两个差分 -> 0, 8
+    square = np.zeros((4, 4), dtype=bool)
+    square[:2, :2] = True
+    assert CompactMask.from_array(square).to_rle()["counts"] == "02208"
+
+    rng = np.random.default_rng(1)
+    for _ in range(5):
+        mask = _random_mask(rng, 64, 48, p=0.05)
+        assert np.array_equal(CompactMask.from_rle(CompactMask.from_array(mask).to_rle()).to_array(), mask)
+    print("✅ COCO RLE 通过")
+
+
+def test_resize():
+    """最近邻缩放"""
+    square = np.zeros((100, 100), dtype=bool)
+    square[40:60, 40:60] = True
+    half = CompactMask.from_array(square).resize(50, 50)
+    assert half.bbox() == [20, 20, 30, 30]
+    print("✅ 缩放通过")
+
+if __name__ == "__main__":
+    test_roundtrip_and_set_ops()
+    test_rle_matches_coco()
+    test_resize()
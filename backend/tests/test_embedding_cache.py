@@ -0,0 +1,131 @@
+"""
+测试 SAM 图像特征缓存
+不需要模型和 API Key（用 numpy 数组模拟特征）
+
+运行:
+    cd backend
+    python tests/test_embedding_cache.py
+"""
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from services.embedding_cache import EmbeddingCache, tensor_nbytes
+from services.local_sam_service import ImageEmbeddings, LocalSAMService
+
+
+def _embedding(mb: int) -> ImageEmbeddings:
+    return ImageEmbeddings(
+        vision_embeds={"fpn": [np.zeros(mb * 1024 * 1024, dtype=np.uint8)]},
+        original_sizes=np.array([[600, 800]]),
+    )
+
+
+def test_lru_by_bytes_and_ttl():
+    """按实际字节数淘汰最久未使用的图片；过期条目不再命中"""
+    assert tensor_nbytes(_embedding(2)) == 2 * 1024 * 1024 + 16
+    cache = EmbeddingCache(max_bytes=5 * 1024 * 1024, ttl=0.2)
+    cache.put("a", _embedding(2))
+    cache.put("b", _embedding(2))
+    assert cache.get("a") is not None  # a 变为最近使用
+    cache.put("c", _embedding(2))
+    assert cache.get("b") is None and cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1 and cache.stats()["bytes"] <= 5 * 1024 * 1024
+
+    cache.put("huge", _embedding(6))  # 超过总上限的单个条目不缓存
+    assert cache.get("huge") is None
+    time.sleep(0.25)
+    assert cache.get("a") is None and cache.get("c") is None
+    print("✅ LRU / TTL 通过")
+
+
+def test_concurrent_requests_encode_once():
+    """同一张图片的并发请求只编码一次，之后的点击直接命中"""
+    cache = EmbeddingCache(max_bytes=64 * 1024 * 1024)
+    calls = []
+
+    def encode():
+        calls.append(1)
+        time.sleep(0.1)  # 模拟图像编码器
+        return _embedding(1)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("img", encode))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1 and len(results) == 4 and all(r is results[0] for r in results)
+
+    started = time.monotonic()
+    assert cache.get_or_compute("img", encode) is results[0]
+    assert time.monotonic() - started < 0.05 and len(calls) == 1
+    assert cache.stats()["misses"] == 1 and cache.stats()["hits"] == 4
+    print("✅ 并发只编码一次通过")
+
+
+def test_failed_encode_not_cached():
+    """编码失败不写入缓存，下一次请求重新计算"""
+    cache = EmbeddingCache(max_bytes=64 * 1024 * 1024)
+
+    def broken():
+        raise RuntimeError("out of memory")
+
+    try:
+        cache.get_or_compute("img", broken)
+        raise AssertionError("应当抛出异常")
+    except RuntimeError:
+        pass
+    assert cache.get_or_compute("img", lambda: _embedding(1)).width == 800
+    print("✅ 编码失败不缓存通过")
+
+
+def test_source_key_without_decoding():
+    """上传图片和 base64 不解码即可得到缓存键；同内容的 data URL 与裸 base64 键相同"""
+    service = LocalSAMService()
+    sha = "b" * 64
+    assert service._source_key(image_url=f"http://localhost:8000/static/uploads/{sha}.jpg") == "sha256:" + sha
+    assert service._source_key(image_base64="aGVsbG8=") == service._source_key(image_base64="data:image/png;base64,aGVsbG8=")
+    assert service._source_key(image_url="https://example.com/room.jpg") is None
+    print("✅ 缓存键通过")
+
+
+def test_work_image_kept_with_embeddings():
+    """编码时的工作分辨率图片随特征一起缓存（合成标注图不再解码），并计入缓存字节数"""
+    import io
+    import base64
+    from PIL import Image
+    from services.embedding_cache import sam_embedding_cache
+    from services.sam_batcher import sam_encoder_batcher
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 30), (200, 100, 50)).save(buffer, format="PNG")
+    image_base64 = base64.b64encode(buffer.getvalue()).decode()
+
+    def submit(image):
+        return ImageEmbeddings(vision_embeds=None, original_sizes=np.array([[image.height, image.width]]))
+
+    saved = sam_encoder_batcher.submit
+    sam_encoder_batcher.submit = submit
+    sam_embedding_cache.clear()
+    try:
+        embeddings = LocalSAMService()._get_embeddings(image_base64=image_base64)
+    finally:
+        sam_encoder_batcher.submit = saved
+        sam_embedding_cache.clear()
+    assert embeddings.image is not None and embeddings.image.size == (40, 30)
+    assert tensor_nbytes(embeddings) == 40 * 30 * 3 + 16
+    print("✅ 工作分辨率图片随特征缓存通过")
+
+
+if __name__ == "__main__":
+    test_lru_by_bytes_and_ttl()
+    test_concurrent_requests_encode_once()
+    test_failed_encode_not_cached()
+    test_source_key_without_decoding()
+    test_work_image_kept_with_embeddings()
@@ -0,0 +1,102 @@
+"""
+测试 Grsai webHook 回调模式：任务登记表 + 超时退回轮询
+使用模拟上游，不需要 API Key
+
+运行:
+    cd backend
+    python tests/test_grsai_callback.py
+"""
+import os
+import sys
+import asyncio
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.grsai_task_registry import GrsaiTaskRegistry, grsai_task_registry
+from services.grsai_service import GrsaiNanoBananaService
+from services.grsai_poller import PollSchedule, PollProfile
+from services.result_cache import ResultCache
+
+
+def _succeeded(task_id: str) -> dict:
+    return {"id": task_id, "status": "succeeded", "progress": 100,
+            "results": [{"url": f"https://example.com/{task_id}.png", "content": "ok"}]}
+
+
+def test_registry_completes_waiters():
+    """回调完成等待方；进度回调被忽略；失败回调抛出上游错误"""
+    registry = GrsaiTaskRegistry()
+
+    async def run():
+        waiter = asyncio.create_task(registry.wait("t1", timeout=5))
+        await asyncio.sleep(0)
+        assert not await registry.complete({"id": "t1", "status": "running", "progress": 40})
+        assert await registry.complete({"code": 0, "data": _succeeded("t1")})
+        result = await waiter
+
+        failed = asyncio.create_task(registry.wait("t2", timeout=5))
+        await asyncio.sleep(0)
+        await registry.complete({"id": "t2", "status": "failed", "error": "bad prompt"})
+        try:
+            await failed
+            raise AssertionError("应当抛出异常")
+        except Exception as e:
+            assert str(e) == "bad prompt"
+        return result
+
+    result = asyncio.run(run())
+    assert result["results"][0]["url"] == "https://example.com/t1.png"
+    assert registry.stats()["pending"] == 0
+    print("✅ 回调完成任务通过")
+
+
+def test_registry_early_callback():
+    """回调早于登记到达时直接命中暂存结果"""
+    registry = GrsaiTaskRegistry()
+
+    async def run():
+        await registry.complete(_succeeded("fast"))
+        return await registry.wait("fast", timeout=0.1)
+
+    assert asyncio.run(run())["status"] == "succeeded"
+    assert registry.stats()["early_results"] == 0
+    print("✅ 提前回调通过")
+
+
+def test_callback_mode_falls_back_to_polling():
+    """超过回调截止时间后退回轮询"""
+    original = dict(PollSchedule.PROFILES)
+    PollSchedule.PROFILES["nano-banana-fast"] = PollProfile(first_delay=0.01, min_interval=0.01, max_interval=0.05)
+    submitted = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/nano-banana"):
+            submitted.append(request)
+            return httpx.Response(200, json={"code": 0, "data": {"id": "slow-task"}})
+        return httpx.Response(200, json={"code": 0, "data": _succeeded("slow-task")})
+
+    try:
+        service = GrsaiNanoBananaService(
+            api_key="test",
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+            webhook_url="https://example.com/api/v1/callbacks/grsai",
+            result_cache=ResultCache(enabled=False),
+        )
+        service.callback_deadline = 0.05
+        result = asyncio.run(service.generate_with_callback("prompt", model="nano-banana-fast", max_wait=5))
+        assert result.success, result.error
+        assert result.images == ["https://example.com/slow-task.png"]
+        assert b'"shutProgress":true' in submitted[0].content.replace(b" ", b"")
+        assert grsai_task_registry.stats()["pending"] == 0
+        print("✅ 回调超时退回轮询通过")
+    finally:
+        PollSchedule.PROFILES.clear()
+        PollSchedule.PROFILES.update(original)
+
+
+if __name__ == "__main__":
+    test_registry_completes_waiters()
+    test_registry_early_callback()
+    test_callback_mode_falls_back_to_polling()
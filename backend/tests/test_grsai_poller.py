@@ -0,0 +1,116 @@
+"""
+测试 Grsai 集中轮询器
+使用模拟的 /v1/draw/result，不需要 API Key
+
+运行:
+    cd backend
+    python tests/test_grsai_poller.py
+"""
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.grsai_poller import GrsaiResultPoller, PollSchedule, PollProfile
+
+FAST_PROFILE = PollProfile(first_delay=0.01, min_interval=0.01, max_interval=0.05)
+
+
+class FakeResultAPI:
+    """每次查询进度 +step，到 100 后返回 succeeded"""
+
+    def __init__(self, step: int = 25, fail_ids=()):
+        self.step = step
+        self.fail_ids = set(fail_ids)
+        self.progress = {}
+        self.calls = 0
+
+    async def fetch(self, task_id: str) -> dict:
+        self.calls += 1
+        if task_id == "missing":
+            return {"code": -22, "msg": "not found"}
+        progress = min(100, self.progress.get(task_id, 0) + self.step)
+        self.progress[task_id] = progress
+        if progress < 100:
+            return {"code": 0, "data": {"id": task_id, "status": "running", "progress": progress}}
+        if task_id in self.fail_ids:
+            return {"code": 0, "data": {"id": task_id, "status": "failed", "error": "bad prompt"}}
+        return {"code": 0, "data": {
+            "id": task_id, "status": "succeeded", "progress": 100,
+            "results": [{"url": f"https://example.com/{task_id}.png"}],
+        }}
+
+
+def test_schedule_adapts_to_progress():
+    """进度快时间隔缩短，停滞时退避，且不超出模型范围"""
+    schedule = PollSchedule("nano-banana-pro-4k-vip", jitter=0)
+    assert schedule.first_delay() == 15.0
+    schedule.observe(10, now=0.0)
+    fast = schedule.observe(60, now=1.0)
+    assert fast == schedule.profile.min_interval
+    stalled = schedule.observe(60, now=2.0)
+    assert stalled > fast
+    for i in range(10):
+        interval = schedule.observe(60, now=3.0 + i)
+    assert interval == schedule.profile.max_interval
+
+    assert PollSchedule("nano-banana-fast", jitter=0).first_delay() < PollSchedule("nano-banana-pro", jitter=0).first_delay()
+    print("✅ 自适应间隔通过")
+
+
+def test_poller_fans_out_results():
+    """多任务共用一个调度循环，同一 task_id 的多个等待方共享轮询"""
+    original = dict(PollSchedule.PROFILES)
+    PollSchedule.PROFILES["nano-banana-fast"] = FAST_PROFILE
+    try:
+        api = FakeResultAPI(step=50, fail_ids={"t-fail"})
+        poller = GrsaiResultPoller(fetch=api.fetch, jitter=0)
+
+        async def run():
+            waits = [poller.wait(f"t{i}", model="nano-banana-fast", max_wait=5) for i in range(20)]
+            waits.append(poller.wait("t0", model="nano-banana-fast", max_wait=5))
+            results = await asyncio.gather(*waits)
+            errors = await asyncio.gather(
+                poller.wait("t-fail", model="nano-banana-fast", max_wait=5),
+                poller.wait("missing", model="nano-banana-fast", max_wait=5),
+                return_exceptions=True,
+            )
+            return results, errors
+
+        results, errors = asyncio.run(run())
+        assert results[0] == results[-1]
+        assert all(r["status"] == "succeeded" for r in results)
+        assert str(errors[0]) == "bad prompt"
+        assert str(errors[1]) == "Task not found"
+        # 20 个任务各 2 次查询，重复等待 t0 不产生额外请求
+        assert api.calls == 20 * 2 + 2 + 1
+        assert poller.stats()["outstanding"] == 0
+        print(f"✅ 集中轮询通过 (请求数: {api.calls})")
+    finally:
+        PollSchedule.PROFILES.clear()
+        PollSchedule.PROFILES.update(original)
+
+
+def test_poller_timeout():
+    """超过 max_wait 报超时"""
+    original = dict(PollSchedule.PROFILES)
+    PollSchedule.PROFILES["nano-banana-fast"] = FAST_PROFILE
+    try:
+        api = FakeResultAPI(step=0)
+        poller = GrsaiResultPoller(fetch=api.fetch, jitter=0)
+        try:
+            asyncio.run(poller.wait("slow", model="nano-banana-fast", max_wait=0.2))
+            raise AssertionError("应当超时")
+        except Exception as e:
+            assert "Timeout" in str(e)
+        print("✅ 超时处理通过")
+    finally:
+        PollSchedule.PROFILES.clear()
+        PollSchedule.PROFILES.update(original)
+
+
+if __name__ == "__main__":
+    test_schedule_adapts_to_progress()
+    test_poller_fans_out_results()
+    test_poller_timeout()
@@ -0,0 +1,112 @@
+"""
+测试上游多入口路由与对冲请求
+不需要 API Key
+
+运行:
+    cd backend
+    python tests/test_host_router.py
+"""
+import os
+import sys
+import asyncio
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.host_router import HostRouter
+from services.grsai_service import GrsaiNanoBananaService
+
+CN, OVERSEAS = "https://cn.example.com", "https://global.example.com"
+
+
+def test_routes_to_fastest_healthy_host():
+    """按 TTFB 选择入口，连续失败的入口冷却"""
+    router = HostRouter([CN, OVERSEAS], preferred=CN)
+    assert router.choose() == CN  # 无数据时用首选
+    assert router.choose(preferred=OVERSEAS) == OVERSEAS
+
+    for _ in range(5):
+        router.record(CN, 0.8, True)
+        router.record(OVERSEAS, 0.2, True)
+    assert router.choose() == OVERSEAS
+
+    for _ in range(3):
+        router.record(OVERSEAS, None, False)
+    assert not router.is_healthy(OVERSEAS)
+    assert router.choose() == CN
+    print("✅ 按延迟 / 健康选择通过")
+
+
+def test_hedge_after_p95():
+    """主入口超过 p95 未返回时对冲，先完成的胜出，另一个被取消"""
+    router = HostRouter([CN, OVERSEAS], preferred=CN, hedge_min_delay=0.01)
+    for _ in range(10):
+        router.record(CN, 0.02, True)
+        router.record(OVERSEAS, 0.05, True)
+    cancelled = []
+
+    async def submit(host):
+        try:
+            await asyncio.sleep(1.0 if host == CN else 0.01)
+            return host
+        except asyncio.CancelledError:
+            cancelled.append(host)
+            raise
+
+    async def fail_fast(host):
+        if host == CN:
+            raise httpx.ConnectError("down")
+        return host
+
+    async def run():
+        slow = await router.hedged(submit)
+        await asyncio.sleep(0)
+        failover = await router.hedged(fail_fast)
+        fast = await router.hedged(lambda host: asyncio.sleep(0, result=host))
+        return slow, failover, fast
+
+    slow, failover, fast = asyncio.run(run())
+    assert slow == OVERSEAS and cancelled == [CN]
+    assert failover == OVERSEAS
+    assert fast == CN
+    assert router.hedges == 2 and router.hedge_wins == 2
+    print("✅ 对冲请求通过")
+
+
+def test_service_polls_on_submit_host():
+    """提交所在入口记录延迟，查询结果使用同一入口"""
+    seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append((request.url.host, request.url.path))
+        if request.url.path.endswith("/nano-banana"):
+            return httpx.Response(200, json={"code": 0, "data": {"id": "t1"}})
+        return httpx.Response(200, json={"code": 0, "data": {"id": "t1", "status": "running"}})
+
+    router = HostRouter([CN, OVERSEAS], preferred=CN, probe_interval=0)
+    for _ in range(5):
+        router.record(OVERSEAS, 0.01, True)
+    service = GrsaiNanoBananaService(
+        api_key="test",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        router=router,
+    )
+
+    async def run():
+        task_id = await service._submit_task({"model": "nano-banana-fast", "prompt": "p", "webHook": "-1"})
+        router.record(CN, 0.001, True)  # 之后国内更快，但已提交的任务仍查原入口
+        for _ in range(10):
+            router.record(CN, 0.001, True)
+        await service._fetch_task(task_id)
+
+    asyncio.run(run())
+    assert seen == [("global.example.com", "/v1/draw/nano-banana"), ("global.example.com", "/v1/draw/result")]
+    assert router.stats()["hosts"][OVERSEAS]["requests"] == 6
+    print("✅ 任务入口保持通过")
+
+
+if __name__ == "__main__":
+    test_routes_to_fastest_healthy_host()
+    test_hedge_after_p95()
+    test_service_polls_on_submit_host()
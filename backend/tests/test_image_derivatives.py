@@ -0,0 +1,135 @@
+"""
+测试上传图片规范化与衍生图阶梯
+使用临时 SQLite 数据库和临时目录，不需要 API Key
+
+运行:
+    cd backend
+    python tests/test_image_derivatives.py
+"""
+import os
+import io
+import sys
+import hashlib
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from services.database import db_manager
+from services.image_derivatives import DerivativeStore, upload_sha256
+
+
+def _with_temp_db(test):
+    """在临时数据库和临时上传目录上运行测试，结束后恢复原连接"""
+    def wrapper():
+        saved = (db_manager._engine, db_manager._SessionLocal)
+        with tempfile.TemporaryDirectory() as tmp:
+            db_manager._engine = db_manager._SessionLocal = None
+            db_manager.init(f"sqlite:///{os.path.join(tmp, 'derivatives.db')}")
+            try:
+                test(Path(tmp))
+            finally:
+                db_manager.get_engine().dispose()
+                db_manager._engine, db_manager._SessionLocal = saved
+    wrapper.__name__ = test.__name__
+    return wrapper
+
+
+def _upload(directory: Path, image: Image.Image, fmt: str = "JPEG", **save_args) -> str:
+    """按上传存储的规则写入 <sha256>.<ext>"""
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **save_args)
+    data = buffer.getvalue()
+    filename = f"{hashlib.sha256(data).hexdigest()}.{'jpg' if fmt == 'JPEG' else fmt.lower()}"
+    (directory / filename).write_bytes(data)
+    return filename
+
+
+def test_upload_sha256():
+    """只识别内容寻址的上传文件"""
+    sha = "a" * 64
+    assert upload_sha256(f"http://localhost:8000/static/uploads/{sha}.jpg") == sha
+    assert upload_sha256(f"/static/uploads/{sha}.png") == sha
+    assert upload_sha256(f"static/uploads/{sha}.webp") == sha
+    assert upload_sha256(f"/static/masks/{sha}.png") is None
+    assert upload_sha256("/static/uploads/photo.jpg") is None
+    assert upload_sha256("data:image/png;base64,xxx") is None
+    print("✅ 上传 URL 识别通过")
+
+
+@_with_temp_db
+def test_ladder_with_exif_rotation(tmp: Path):
+    """EXIF 方向在生成衍生图时应用；各级最长边正确；重复生成直接复用"""
+    uploads = tmp / "uploads"
+    uploads.mkdir()
+    image = Image.new("RGB", (3000, 2000), (200, 120, 40))
+    exif = Image.Exif()
+    exif[0x0112] = 6  # 需要顺时针旋转 90 度
+    filename = _upload(uploads, image, exif=exif.tobytes())
+
+    store = DerivativeStore(uploads, workers=1)
+    derivatives = store.schedule(filename).result(timeout=30)
+    assert (derivatives.width, derivatives.height) == (2000, 3000)
+
+    sizes = {}
+    for rung, url in derivatives.urls.items():
+        with Image.open(store._local_path(url)) as derived:
+            sizes[rung] = derived.size
+            assert not derived.getexif().get(0x0112)
+    assert sizes["original"] == (2000, 3000)
+    assert [max(sizes[rung]) for rung in ("2k", "work", "thumb")] == [2048, 1024, 256]
+    assert all(abs(w / h - 2 / 3) < 0.01 for w, h in sizes.values())
+    assert derivatives.url("original").startswith("/static/uploads/derived/")
+
+    # 数据库记录可查询；再次生成不重复写文件
+    sha = filename.split(".")[0]
+    assert store.lookup(sha).url("thumb") == derivatives.url("thumb")
+    assert store.thumbnail_url(f"http://localhost:8000/static/uploads/{filename}") == derivatives.url("thumb")
+    again = store.build(filename)
+    assert again.urls == derivatives.urls and store.reused == 1
+    print(f"✅ EXIF 旋转 / 衍生图阶梯通过 ({sizes})")
+
+
+@_with_temp_db
+def test_small_upright_image_reuses_source(tmp: Path):
+    """已经是正向 sRGB 的小图：original 指向上传文件，小于阶梯尺寸的级别直接复用"""
+    uploads = tmp / "uploads"
+    uploads.mkdir()
+    filename = _upload(uploads, Image.new("RGB", (800, 600), (10, 20, 30)))
+
+    store = DerivativeStore(uploads, workers=1)
+    # 没有预先调度：查询时当场生成
+    path = store.resolve(f"/static/uploads/{filename}", "work")
+    assert path == uploads / filename
+    derivatives = store.lookup(filename.split(".")[0])
+    assert derivatives.url("original") == derivatives.url("2k") == derivatives.url("work") == f"/static/uploads/{filename}"
+    with Image.open(store._local_path(derivatives.url("thumb"))) as thumb:
+        assert thumb.size == (256, 192)
+    assert store.resolve_for_size(f"/static/uploads/{filename}", 200) == store._local_path(derivatives.url("thumb"))
+    assert store.resolve("/static/masks/mask.png") is None
+    print("✅ 小图复用原文件通过")
+
+
+@_with_temp_db
+def test_transparent_png_keeps_alpha(tmp: Path):
+    """带透明通道的 PNG 衍生图保持 PNG/RGBA"""
+    uploads = tmp / "uploads"
+    uploads.mkdir()
+    filename = _upload(uploads, Image.new("RGBA", (1200, 1200), (0, 0, 0, 0)), fmt="PNG")
+
+    store = DerivativeStore(uploads, workers=1)
+    derivatives = store.schedule(filename).result(timeout=30)
+    work = store._local_path(derivatives.url("work"))
+    assert work.suffix == ".png"
+    with Image.open(work) as image:
+        assert image.mode == "RGBA" and image.size == (1024, 1024)
+    print("✅ 透明 PNG 通过")
+
+
+if __name__ == "__main__":
+    test_upload_sha256()
+    test_ladder_with_exif_rotation()
+    test_small_upright_image_reuses_source()
+    test_transparent_png_keeps_alpha()
@@ -0,0 +1,104 @@
+"""
+测试图片处理执行器
+不需要 API Key
+
+运行:
+    cd backend
+    python tests/test_image_ops.py
+"""
+import os
+import io
+import sys
+import base64
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+from services.image_ops import (
+    ImageOpsExecutor, compress_image_base64, merge_masks, prepare_inpaint_mask, prepare_inpaint_image,
+)
+
+
+def _data_url(image: Image.Image, fmt: str = "PNG") -> str:
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt)
+    mime = "png" if fmt == "PNG" else "jpeg"
+    return f"data:image/{mime};base64,{base64.b64encode(buffer.getvalue()).decode()}"
+
+
+def _decode(data_url: str) -> Image.Image:
+    return Image.open(io.BytesIO(base64.b64decode(data_url.split(",", 1)[1])))
+
+
+def _mask(size, box) -> Image.Image:
+    arr = np.zeros((size[1], size[0]), dtype=np.uint8)
+    x0, y0, x1, y1 = box
+    arr[y0:y1, x0:x1] = 255
+    return Image.fromarray(arr, mode="L")
+
+
+def test_merge_and_compress():
+    """多个 mask 叠加白色区域；尺寸不同时对齐到第一张；超过上限时缩小"""
+    first = _data_url(_mask((2048, 1024), (0, 0, 512, 512)))
+    second = _data_url(_mask((1024, 512), (512, 256, 1024, 512)))
+    merged = _decode(merge_masks([first, second]))
+    assert merged.size == (1024, 512)
+    arr = np.asarray(merged)
+    assert arr[10, 10] == 255 and arr[500, 1000] == 255 and arr[10, 1000] == 0
+
+    photo = _data_url(Image.new("RGB", (4000, 3000), (90, 90, 90)), fmt="JPEG")
+    compressed = compress_image_base64(photo, max_size=1024)
+    assert compressed.startswith("data:image/jpeg;base64,") and _decode(compressed).size == (1024, 768)
+    assert compress_image_base64("https://example.com/a.jpg") == "https://example.com/a.jpg"
+    print("✅ mask 合并 / 压缩通过")
+
+
+def test_prepare_skips_invalid_masks():
+    """无法读取的 mask 被跳过；全部无效时返回空字符串"""
+    valid = _data_url(_mask((800, 600), (0, 0, 100, 100)))
+    assert prepare_inpaint_mask(["/static/masks/missing.png", valid]) == valid
+    assert prepare_inpaint_mask(["/static/masks/missing.png"]) == ""
+    assert prepare_inpaint_image("https://example.com/room.jpg") == "https://example.com/room.jpg"
+    print("✅ 无效 mask 跳过通过")
+
+
+def test_process_pool_keeps_loop_responsive():
+    """进程池执行时事件循环仍可调度其他任务，并按操作记录耗时"""
+    masks = [_data_url(_mask((3000, 2000), (i * 100, 0, i * 100 + 50, 2000))) for i in range(4)]
+    executor = ImageOpsExecutor(mode="process", workers=1)
+    executor.start()
+
+    async def run():
+        ticks = 0
+
+        async def heartbeat():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.001)
+
+        beat = asyncio.create_task(heartbeat())
+        try:
+            result = await executor.run("inpaint_mask", prepare_inpaint_mask, masks, 1024)
+        finally:
+            beat.cancel()
+        return result, ticks
+
+    try:
+        result, ticks = asyncio.run(run())
+    finally:
+        executor.shutdown()
+    assert _decode(result).size == (1024, 682)
+    assert ticks > 1
+    stats = executor.stats()["ops"]["inpaint_mask"]
+    assert stats["calls"] == 1 and stats["errors"] == 0 and stats["max_ms"] > 0
+    print(f"✅ 进程池执行通过 (heartbeat ticks={ticks}, {stats})")
+
+
+if __name__ == "__main__":
+    test_merge_and_compress()
+    test_prepare_skips_invalid_masks()
+    test_process_pool_keeps_loop_responsive()
@@ -0,0 +1,227 @@
+"""
+测试生成任务队列
+使用临时 SQLite 数据库，不需要 API Key
+
+运行:
+    cd backend
+    python tests/test_job_queue.py
+"""
+import os
+import sys
+import asyncio
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.database import db_manager
+from services.job_queue import GenerationJobModel, JobQueue, JobStore, PermanentJobError
+
+
+def _with_temp_db(test):
+    """在临时数据库上运行测试，结束后恢复原连接"""
+    def wrapper():
+        saved = (db_manager._engine, db_manager._SessionLocal)
+        with tempfile.TemporaryDirectory() as tmp:
+            db_manager._engine = db_manager._SessionLocal = None
+            db_manager.init(f"sqlite:///{os.path.join(tmp, 'jobs.db')}")
+            try:
+                test()
+            finally:
+                db_manager.get_engine().dispose()
+                db_manager._engine, db_manager._SessionLocal = saved
+    wrapper.__name__ = test.__name__
+    return wrapper
+
+
+def _queue(**kwargs) -> JobQueue:
+    options = dict(workers=2, poll_interval=0.02, retry_backoff=0.01, lease_seconds=3)
+    options.update(kwargs)
+    return JobQueue(store=JobStore(), **options)
+
+
+async def _wait_status(queue: JobQueue, job_id: str, statuses, timeout: float = 3.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while asyncio.get_running_loop().time() < deadline:
+        job = queue.get(job_id)
+        if job.status in statuses:
+            return job
+        await asyncio.sleep(0.02)
+    raise AssertionError(f"{job_id} 状态仍为 {queue.get(job_id).status}")
+
+
+@_with_temp_db
+def test_submit_runs_and_retries():
+    """提交立即返回；失败按退避重试，成功后保存结果；永久失败不重试"""
+    queue = _queue(max_attempts=3)
+    calls = []
+
+    async def flaky(params):
+        calls.append(params["n"])
+        if len(calls) < 3:
+            raise Exception("upstream 502")
+        return {"images": ["r.png"], "provider": "grsai", "task_id": "t1", "cost_rmb": 0.18}
+
+    async def invalid(params):
+        raise PermanentJobError("bad params")
+
+    queue.register("generate", flaky)
+    queue.register("invalid", invalid)
+
+    async def run():
+        await queue.start()
+        try:
+            job = await queue.submit("generate", {"n": 1}, user_id=42)
+            assert job.status == "queued" and job.user_id == "42"
+            done = await _wait_status(queue, job.job_id, ("completed", "failed"))
+            bad = await queue.submit("invalid", {})
+            failed = await _wait_status(queue, bad.job_id, ("failed",))
+            return done, failed
+        finally:
+            await queue.aclose()
+
+    done, failed = asyncio.run(run())
+    assert done.status == "completed" and done.attempts == 3
+    assert done.result["images"] == ["r.png"] and done.provider == "grsai"
+    assert failed.attempts == 1 and failed.error == "bad params"
+    assert queue.retried == 2 and queue.completed == 1
+    print(f"✅ 提交 / 重试通过 (statuses={queue.store.counts()})")
+
+
+@_with_temp_db
+def test_generation_failures_retry_only_when_transient():
+    """生成 handler：内容审核等请求本身的失败只执行一次（不重复计费），上游故障按退避重试"""
+    import main
+    from services import grsai_service
+    from services.grsai_service import GenerationResult
+
+    calls = []
+
+    class FakeService:
+        webhook_url = None
+
+        def request_key(self, **params):
+            return f"{params['prompt']}|{params['image_url']}|{len(calls)}"
+
+        async def generate(self, **params):
+            calls.append(params["image_url"])
+            if params["image_url"].endswith("moderated.png"):
+                return GenerationResult(success=False, error="content moderation")
+            return GenerationResult(success=False, error="upstream 502", transient=True)
+
+    queue = _queue(max_attempts=3)
+    queue.register("generate", main._generate_job)
+    saved_service, grsai_service._grsai_service = grsai_service._grsai_service, FakeService()
+    saved_token = os.environ.pop("REPLICATE_API_TOKEN", None)  # 只走 Grsai，不切换到备用 provider
+
+    async def run():
+        await queue.start()
+        try:
+            moderated = await queue.submit("generate", {"image_url": "https://example.com/moderated.png"})
+            moderated = await _wait_status(queue, moderated.job_id, ("failed",))
+            flaky = await queue.submit("generate", {"image_url": "https://example.com/flaky.png"})
+            flaky = await _wait_status(queue, flaky.job_id, ("failed",))
+            return moderated, flaky
+        finally:
+            await queue.aclose()
+
+    try:
+        moderated, flaky = asyncio.run(run())
+    finally:
+        grsai_service._grsai_service = saved_service
+        if saved_token is not None:
+            os.environ["REPLICATE_API_TOKEN"] = saved_token
+    assert moderated.attempts == 1 and moderated.error == "content moderation"
+    assert flaky.attempts == 3 and flaky.error == "upstream 502"
+    assert calls.count("https://example.com/moderated.png") == 1
+    assert calls.count("https://example.com/flaky.png") == 3
+    print("✅ 生成失败只在上游故障时重试通过")
+
+
+@_with_temp_db
+def test_cancel_queued_and_running():
+    """排队中的任务直接取消；执行中的任务取消 handler；失败任务可重新排队"""
+    queue = _queue(workers=1)
+    started = []
+
+    async def slow(params):
+        started.append(params["n"])
+        await asyncio.sleep(10)
+        return {}
+
+    queue.register("generate", slow)
+
+    async def run():
+        await queue.start()
+        try:
+            running = await queue.submit("generate", {"n": 1})
+            queued = await queue.submit("generate", {"n": 2})
+            await _wait_status(queue, running.job_id, ("processing",))
+            assert queue.cancel(queued.job_id) == (True, "已取消")
+            assert queue.cancel(running.job_id) == (True, "正在取消")
+            cancelled = await _wait_status(queue, running.job_id, ("cancelled",))
+            assert queue.cancel(running.job_id) == (False, "任务已结束")
+            assert queue.retry(queued.job_id)[0]
+            await _wait_status(queue, queued.job_id, ("processing",))
+            return cancelled
+        finally:
+            await queue.aclose()
+
+    cancelled = asyncio.run(run())
+    assert cancelled.status == "cancelled"
+    assert started == [1, 2]
+    print("✅ 取消 / 手动重试通过")
+
+
+@_with_temp_db
+def test_restart_recovery():
+    """关闭时归还执行中的任务；租约过期的任务（进程崩溃）重新排队"""
+    queue = _queue(workers=1)
+
+    async def slow(params):
+        await asyncio.sleep(10)
+        return {}
+
+    queue.register("generate", slow)
+
+    async def shutdown_while_running():
+        await queue.start()
+        job = await queue.submit("generate", {})
+        await _wait_status(queue, job.job_id, ("processing",))
+        await queue.aclose()
+        return queue.get(job.job_id)
+
+    released = asyncio.run(shutdown_while_running())
+    assert released.status == "queued" and released.attempts == 0
+
+    # 模拟崩溃：另一个 worker 认领后未续租
+    store = JobStore()
+    claimed = store.claim("crashed-worker", lease_seconds=60)
+    assert claimed.job_id == released.job_id
+    with db_manager.get_session() as session:
+        record = session.query(GenerationJobModel).filter_by(job_uuid=claimed.job_id).first()
+        record.lease_until = datetime.now() - timedelta(seconds=1)
+
+    restarted = _queue(workers=1)
+    restarted.register("generate", lambda params: asyncio.sleep(0, result={"ok": True}))
+
+    async def restart():
+        await restarted.start()
+        try:
+            return await _wait_status(restarted, claimed.job_id, ("completed",))
+        finally:
+            await restarted.aclose()
+
+    done = asyncio.run(restart())
+    assert restarted.recovered == 1
+    assert done.result == {"ok": True} and done.attempts == 2
+    # 崩溃的 worker 迟到的结果不会覆盖
+    assert not store.complete(claimed.job_id, "crashed-worker", {"ok": False})
+    print("✅ 重启恢复通过")
+
+
+if __name__ == "__main__":
+    test_submit_runs_and_retries()
+    test_generation_failures_retry_only_when_transient()
+    test_cancel_queued_and_running()
+    test_restart_recovery()
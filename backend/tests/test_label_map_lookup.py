@@ -0,0 +1,87 @@
+"""
+测试标签索引图传输与点击查表
+不需要模型和 API Key（用 numpy 构造分割结果）
+
+运行:
+    cd backend
+    python tests/test_label_map_lookup.py
+"""
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+from services import embedding_cache
+from services.compact_mask import CompactMask
+from services.embedding_cache import EmbeddingCache
+from services.local_sam_service import LabelMapEntry, LocalSAMService, SegmentedObject
+from services.mask_compositor import build_label_map, render_label_map
+
+
+def _objects():
+    sofa = np.zeros((96, 128), dtype=bool)
+    sofa[50:90, 10:70] = True
+    lamp = np.zeros((96, 128), dtype=bool)
+    lamp[5:60, 100:110] = True
+    return [
+        SegmentedObject(label="sofa", label_zh="沙发", mask=CompactMask.from_array(sofa), mask_id="a" * 32,
+                        label_index=1, bbox=[40, 200, 280, 360], confidence=0.9),
+        SegmentedObject(label="lamp", label_zh="台灯", mask=CompactMask.from_array(lamp), mask_id="b" * 32,
+                        label_index=2, bbox=[400, 20, 440, 240], confidence=0.7),
+    ]
+
+
+def test_object_at_uses_source_coordinates():
+    """点击坐标为原图坐标，按比例换算到工作分辨率查表"""
+    objects = _objects()
+    label_map = build_label_map([o.mask for o in objects], [o.confidence for o in objects])
+    entry = LabelMapEntry(label_map, objects, source_size=(384, 512))  # 原图是工作分辨率的 4 倍
+    assert entry.object_at(160, 280).label == "sofa"
+    assert entry.object_at(420, 100).label == "lamp"
+    assert entry.object_at(300, 50) is None  # 背景
+    assert entry.object_at(600, 50) is None and entry.object_at(-1, 10) is None  # 越界
+    print("✅ 坐标换算查表通过")
+
+
+def test_lookup_point_after_segmentation():
+    """分割过的图片点击直接返回已有物体；没分割过 / 点在背景 / 远程 URL 返回 None"""
+    original = embedding_cache.sam_label_maps
+    embedding_cache.sam_label_maps = EmbeddingCache(max_bytes=16 * 1024 * 1024)
+    try:
+        service = LocalSAMService()
+        image_url = "/static/uploads/" + "c" * 64 + ".jpg"
+        objects = _objects()
+        label_map = build_label_map([o.mask for o in objects], [o.confidence for o in objects])
+        service._index_label_map(service._source_key(image_url=image_url), label_map, objects, (384, 512))
+
+        result = service.lookup_point(image_url=image_url, x=160, y=280)
+        assert result.success and [o.mask_id for o in result.objects] == ["a" * 32]
+        assert result.objects[0].mask is None  # 物体表不保留位图
+        assert service.lookup_point(image_url=image_url, x=300, y=50) is None
+        assert service.lookup_point(image_url="/static/uploads/" + "d" * 64 + ".jpg", x=160, y=280) is None
+
+        service._index_label_map(service._source_key(image_url="https://example.com/a.jpg"), label_map, objects, (384, 512))
+        assert service.lookup_point(image_url="https://example.com/a.jpg", x=160, y=280) is None
+    finally:
+        embedding_cache.sam_label_maps = original
+    print("✅ 点击查表通过")
+
+
+def test_label_map_png_roundtrip():
+    """标签索引图按原值编码为灰度 PNG（uint8 / uint16）"""
+    small = np.arange(12, dtype=np.uint8).reshape(3, 4)
+    assert np.array_equal(np.asarray(Image.open(io.BytesIO(render_label_map(small)))), small)
+    large = (np.arange(12, dtype=np.uint16) * 100).reshape(3, 4)
+    decoded = np.asarray(Image.open(io.BytesIO(render_label_map(large))))
+    assert np.array_equal(decoded.astype(np.uint16), large)
+    print("✅ 标签索引图 PNG 通过")
+
+
+if __name__ == "__main__":
+    test_object_at_uses_source_coordinates()
+    test_lookup_point_after_segmentation()
+    test_label_map_png_roundtrip()
@@ -0,0 +1,80 @@
+"""
+测试分割结果合成（标签索引图 -> 标注图 / 合并 mask）
+不需要模型和 API Key
+
+运行:
+    cd backend
+    python tests/test_mask_compositor.py
+"""
+import io
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+from services.compact_mask import CompactMask
+from services.mask_compositor import (
+    OVERLAY_ALPHA, SegmentationCompositor, build_label_map, object_color, render_annotated, render_combined,
+)
+
+
+def _box(box, h=60, w=80) -> CompactMask:
+    mask = np.zeros((h, w), dtype=bool)
+    x0, y0, x1, y1 = box
+    mask[y0:y1, x0:x1] = True
+    return CompactMask.from_array(mask)
+
+
+def test_label_map_overlap_goes_to_higher_score():
+    masks = [_box((0, 0, 40, 40)), _box((20, 20, 60, 60)), _box((70, 50, 80, 60))]
+    label_map = build_label_map(masks, [0.9, 0.5, 0.7])
+    assert label_map.dtype == np.uint8
+    assert label_map[10, 10] == 1 and label_map[30, 30] == 1 and label_map[50, 50] == 2
+    assert label_map[55, 75] == 3 and label_map[0, 79] == 0
+
+    many = build_label_map([_box((i % 80, 0, i % 80 + 1, 1)) for i in range(300)])
+    assert many.dtype == np.uint16 and many.max() == 300
+    print("✅ 标签索引图通过")
+
+
+def test_render_combined_and_annotated():
+    """合并 mask 为调色板 PNG（背景透明）；标注图只在物体区域混合颜色"""
+    label_map = build_label_map([_box((0, 0, 40, 40)), _box((40, 20, 80, 60))], [0.9, 0.8])
+
+    combined = Image.open(io.BytesIO(render_combined(label_map)))
+    assert combined.mode == "P" and combined.size == (80, 60)
+    rgba = np.asarray(combined.convert("RGBA"))
+    assert rgba[10, 10, 3] > 0 and tuple(rgba[10, 10, :3]) == object_color(0)
+    assert tuple(rgba[50, 60, :3]) == object_color(1) and rgba[55, 5, 3] == 0
+
+    photo = Image.new("RGB", (80, 60), (100, 100, 100))
+    annotated = np.asarray(Image.open(io.BytesIO(render_annotated(photo, label_map, quality=100)))).astype(int)
+    expected = (np.array([100] * 3) * (255 - OVERLAY_ALPHA) + np.array(object_color(0)) * OVERLAY_ALPHA) / 255
+    assert np.abs(annotated[20, 20] - expected).max() <= 3
+    assert np.abs(annotated[55, 5] - 100).max() <= 3
+    print("✅ 合成渲染通过")
+
+
+def test_compositor_writes_once():
+    """文件按内容哈希命名，同一结果只编码一次"""
+    label_map = build_label_map([_box((0, 0, 40, 40))])
+    photo = Image.new("RGB", (80, 60), (10, 20, 30))
+    with tempfile.TemporaryDirectory() as tmp:
+        compositor = SegmentationCompositor(tmp)
+        annotated_url, combined_url = compositor.compose(photo, label_map)
+        assert annotated_url.startswith("/static/masks/annotated_") and combined_url.endswith(".png")
+        assert compositor.compose(photo, label_map) == (annotated_url, combined_url)
+        assert compositor.stats() == {"composed": 2, "reused": 2}
+        assert sorted(os.listdir(tmp)) == sorted(url.rsplit("/", 1)[1] for url in (annotated_url, combined_url))
+        assert compositor.compose(None, label_map) == (None, combined_url)
+    print("✅ 合成文件复用通过")
+
+
+if __name__ == "__main__":
+    test_label_map_overlap_goes_to_higher_score()
+    test_render_combined_and_annotated()
+    test_compositor_writes_once()
@@ -0,0 +1,129 @@
+"""
+测试分割 mask 存储与按需渲染
+不需要模型和 API Key（用 numpy 构造 mask）
+
+运行:
+    cd backend
+    python tests/test_mask_store.py
+"""
+import io
+import os
+import json
+import sys
+import base64
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+from services import mask_store as mask_store_module
+from services.compact_mask import CompactMask
+from services.mask_store import MaskNotFound, MaskStore, mask_url, parse_mask_url
+
+
+def _rect_mask(h=60, w=80, box=(10, 20, 30, 50)) -> np.ndarray:
+    mask = np.zeros((h, w), dtype=bool)
+    y0, y1, x0, x1 = box
+    mask[y0:y1, x0:x1] = True
+    return mask
+
+
+def test_put_get_roundtrip_and_dedupe():
+    """位图往返一致；相同 mask 只存一份；内存淘汰后从磁盘读回"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = MaskStore(tmp, memory_max_bytes=1)  # 内存缓存放不下，强制走磁盘
+        mask = _rect_mask()
+        mask_id = store.put(mask)
+        assert store.put(mask.copy()) == mask_id and store.stored == 1
+        assert len(os.listdir(tmp)) == 1
+        assert np.array_equal(store.get(mask_id).to_array(), mask)
+
+        other = store.put(_rect_mask(box=(0, 5, 0, 5)))
+        assert other != mask_id and store.stored == 2
+
+        for missing in ("0" * 32, "../../etc/passwd"):
+            try:
+                store.get(missing)
+                raise AssertionError("应当抛出 MaskNotFound")
+            except MaskNotFound:
+                pass
+    print("✅ 存取 / 去重通过")
+
+
+def test_render_formats_cached():
+    """各格式首次访问时渲染，之后命中缓存"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = MaskStore(tmp)
+        mask = _rect_mask()
+        mask_id = store.put(mask)
+
+        png, media_type = store.render(mask_id, "bw")
+        assert media_type == "image/png"
+        bw = np.asarray(Image.open(io.BytesIO(png)))
+        assert bw.shape == mask.shape and np.array_equal(bw == 255, mask)
+
+        png, _ = store.render(mask_id, "color")
+        rgba = np.asarray(Image.open(io.BytesIO(png)))
+        assert rgba.shape == (*mask.shape, 4)
+        assert (rgba[mask, 3] == 180).all() and (rgba[~mask, 3] == 0).all()
+
+        text, media_type = store.render(mask_id, "base64")
+        assert media_type == "text/plain" and text.startswith(b"data:image/png;base64,")
+        assert base64.b64decode(text.split(b",", 1)[1]) == store.render(mask_id, "bw")[0]
+
+        rle, media_type = store.render(mask_id, "rle")
+        assert media_type == "application/json"
+        assert np.array_equal(CompactMask.from_rle(json.loads(rle)).to_array(), mask)
+
+        renders = store.renders
+        store.render(mask_id, "color")
+        assert store.renders == renders == 4
+
+        try:
+            store.render(mask_id, "jpeg")
+            raise AssertionError("应当抛出 ValueError")
+        except ValueError:
+            pass
+    print("✅ 按需渲染通过")
+
+
+def test_parse_mask_url():
+    mask_id = "ab" * 16
+    assert parse_mask_url(mask_url(mask_id, "bw")) == mask_id
+    assert parse_mask_url(f"http://localhost:3000/api/v1/masks/{mask_id}") == mask_id
+    assert parse_mask_url("/static/masks/inpaint_1234.png") is None
+    assert parse_mask_url("data:image/png;base64,/api/v1/masks/" + mask_id) is None
+    print("✅ URL 解析通过")
+
+
+def test_inpaint_mask_from_store():
+    """局部重绘直接从存储读取位图合并，与 data URL 混用"""
+    from services.image_ops import prepare_inpaint_mask
+
+    original = mask_store_module.mask_store
+    with tempfile.TemporaryDirectory() as tmp:
+        mask_store_module.mask_store = MaskStore(tmp)
+        try:
+            a = _rect_mask(box=(0, 10, 0, 10))
+            b = _rect_mask(box=(40, 60, 60, 80))
+            b_png = io.BytesIO()
+            Image.fromarray(b.astype(np.uint8) * 255, mode="L").save(b_png, format="PNG")
+            b_data = f"data:image/png;base64,{base64.b64encode(b_png.getvalue()).decode()}"
+
+            merged = prepare_inpaint_mask([mask_url(mask_store_module.mask_store.put(a), "bw"), b_data])
+            result = np.asarray(Image.open(io.BytesIO(base64.b64decode(merged.split(",", 1)[1])))) == 255
+            assert np.array_equal(result, a | b)
+
+            assert prepare_inpaint_mask([mask_url("0" * 32, "bw")]) == ""
+        finally:
+            mask_store_module.mask_store = original
+    print("✅ 局部重绘读取存储通过")
+
+
+if __name__ == "__main__":
+    test_put_get_roundtrip_and_dedupe()
+    test_render_formats_cached()
+    test_parse_mask_url()
+    test_inpaint_mask_from_store()
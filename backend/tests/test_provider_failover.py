@@ -0,0 +1,180 @@
+"""
+测试 provider 熔断与自动切换
+不需要 API Key
+
+运行:
+    cd backend
+    python tests/test_provider_failover.py
+"""
+import os
+import sys
+import time
+import asyncio
+from dataclasses import dataclass
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.provider_router import (
+    BreakerConfig, CircuitBreaker, CircuitOpenError, ProviderRouter, failover_order, is_transient_error,
+)
+
+
+@dataclass
+class FakeResult:
+    success: bool
+    error: str = None
+    transient: bool = False
+
+
+def test_breaker_opens_and_half_opens():
+    """失败率超过阈值熔断，冷却后半开放行一次探测，成功则恢复"""
+    breaker = CircuitBreaker("test", BreakerConfig(min_calls=4, failure_rate=0.5, open_seconds=0.05))
+    for ok in (True, False, True, False):
+        assert breaker.allow()
+        breaker.record(ok, 0.1)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()  # 只放行一个探测
+    breaker.record(False, 0.1)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(True, 0.1)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()["opened"] == 2 and breaker.stats()["rejected"] == 2
+    print("✅ 熔断 / 半开 / 恢复通过")
+
+
+def test_slow_calls_open_breaker():
+    """成功但过慢的调用同样会触发熔断"""
+    breaker = CircuitBreaker("test", BreakerConfig(min_calls=3, slow_call_seconds=1.0, slow_call_rate=0.6))
+    for elapsed in (2.0, 0.1, 2.0):
+        breaker.record(True, elapsed)
+    assert breaker.state == CircuitBreaker.OPEN
+    print("✅ 慢调用熔断通过")
+
+
+def test_router_fails_over_and_records_provider():
+    """主 provider 失败时切换；熔断后直接跳过，不再等待"""
+    router = ProviderRouter()
+    router._breakers["grsai"] = CircuitBreaker("grsai", BreakerConfig(min_calls=2, open_seconds=60))
+    grsai_calls = []
+
+    async def grsai():
+        grsai_calls.append(1)
+        return FakeResult(False, "upstream 502", transient=True)
+
+    async def replicate():
+        return FakeResult(True)
+
+    async def run():
+        calls = [("grsai", grsai), ("replicate", replicate)]
+        return [await router.run(calls) for _ in range(4)]
+
+    results = asyncio.run(run())
+    assert all(r.provider == "replicate" and r.result.success for r in results)
+    assert results[0].attempts == [{"provider": "grsai", "error": "upstream 502"}]
+    assert results[-1].attempts == [{"provider": "grsai", "error": "circuit open"}]
+    assert len(grsai_calls) == 2
+    assert router.stats()["served"] == {"replicate": 4} and router.stats()["failovers"] == 4
+    print("✅ 切换 / 记录 provider 通过")
+
+
+def test_router_timeout_and_all_open():
+    """单次调用超时即切换；全部失败返回最后的失败结果；全部熔断抛出 CircuitOpenError"""
+    router = ProviderRouter()
+    router._breakers["grsai"] = CircuitBreaker("grsai", BreakerConfig(min_calls=1, call_timeout=0.02))
+    router._breakers["controlnet"] = CircuitBreaker("controlnet", BreakerConfig(min_calls=1))
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    def controlnet():
+        return FakeResult(False, "upstream 503", transient=True)
+
+    routed = asyncio.run(router.run([("grsai", hang), ("controlnet", lambda: asyncio.to_thread(controlnet))]))
+    assert routed.provider == "controlnet" and not routed.result.success
+    assert routed.attempts[0]["error"].startswith("timeout")
+
+    try:
+        router.run_sync([("grsai", lambda: FakeResult(True)), ("controlnet", controlnet)])
+        raise AssertionError("应当抛出 CircuitOpenError")
+    except CircuitOpenError:
+        pass
+    print("✅ 超时切换 / 全部熔断通过")
+
+
+def test_request_failures_do_not_fail_over():
+    """内容审核、图片无效等请求本身的失败原样返回：不计入熔断，也不在备用 provider 上重复计费"""
+    router = ProviderRouter()
+    router._breakers["grsai"] = CircuitBreaker("grsai", BreakerConfig(min_calls=1))
+    replicate_calls = []
+
+    async def grsai():
+        return FakeResult(False, "content moderation")
+
+    async def replicate():
+        replicate_calls.append(1)
+        return FakeResult(True)
+
+    async def invalid():
+        raise ValueError("bad image")
+
+    async def run():
+        routed = await router.run([("grsai", grsai), ("replicate", replicate)])
+        try:
+            await router.run([("grsai", invalid), ("replicate", replicate)])
+            raise AssertionError("应当抛出 ValueError")
+        except ValueError:
+            pass
+        return routed
+
+    routed = asyncio.run(run())
+    assert routed.provider == "grsai" and routed.result.error == "content moderation" and not routed.attempts
+    assert not replicate_calls
+    assert router.breaker("grsai").state == CircuitBreaker.CLOSED
+    print("✅ 请求本身的失败不切换通过")
+
+
+def test_is_transient_error():
+    """网络错误、超时、429、5xx 算上游故障，4xx 和其他异常不算"""
+    import httpx
+
+    request = httpx.Request("POST", "https://example.com")
+    def status_error(code):
+        return httpx.HTTPStatusError("", request=request, response=httpx.Response(code, request=request))
+
+    assert is_transient_error(TimeoutError("Timeout after 300s"))
+    assert is_transient_error(asyncio.TimeoutError())
+    assert is_transient_error(httpx.ConnectError("refused", request=request))
+    assert is_transient_error(status_error(429)) and is_transient_error(status_error(502))
+    assert not is_transient_error(status_error(400)) and not is_transient_error(status_error(422))
+    assert not is_transient_error(Exception("Generation failed: content moderation"))
+    print("✅ 上游故障判定通过")
+
+
+def test_failover_order():
+    """主 provider 排在最前，其余按配置顺序"""
+    assert failover_order() == ["grsai", "replicate", "controlnet"]
+    assert failover_order("controlnet") == ["controlnet", "grsai", "replicate"]
+    os.environ["PROVIDER_FAILOVER_ORDER"] = "grsai,controlnet"
+    try:
+        assert failover_order("grsai") == ["grsai", "controlnet"]
+    finally:
+        del os.environ["PROVIDER_FAILOVER_ORDER"]
+    print("✅ 切换顺序通过")
+
+
+if __name__ == "__main__":
+    test_breaker_opens_and_half_opens()
+    test_slow_calls_open_breaker()
+    test_router_fails_over_and_records_provider()
+    test_router_timeout_and_all_open()
+    test_request_failures_do_not_fail_over()
+    test_is_transient_error()
+    test_failover_order()
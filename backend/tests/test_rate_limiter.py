@@ -0,0 +1,109 @@
+"""
+测试上游限流器
+不需要 API Key
+
+运行:
+    cd backend
+    python tests/test_rate_limiter.py
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.rate_limiter import (
+    LimitConfig, ProviderLimiter, RateLimitTimeout, TokenBucket, load_limit_config,
+)
+
+
+def test_max_in_flight_and_fifo():
+    """同时在途不超过上限，排队方按到达顺序获得名额"""
+    limiter = ProviderLimiter("test", LimitConfig(max_in_flight=2, rate_per_second=0))
+    order = []
+    peak = 0
+
+    async def job(i):
+        nonlocal peak
+        await limiter.acquire()
+        try:
+            order.append(i)
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.02)
+        finally:
+            limiter.release()
+
+    async def run():
+        tasks = []
+        for i in range(8):
+            tasks.append(asyncio.create_task(job(i)))
+            await asyncio.sleep(0)  # 保证到达顺序
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert peak == 2
+    assert order == list(range(8))
+    stats = limiter.stats()
+    assert stats["max_queue_depth"] == 6 and stats["queue_depth"] == 0 and stats["in_flight"] == 0
+    print(f"✅ 并发上限 / FIFO 通过 (最大排队 {stats['max_queue_depth']})")
+
+
+def test_token_bucket_rate():
+    """令牌桶：突发 burst 个后按速率放行"""
+    bucket = TokenBucket(rate_per_second=10, burst=2)
+    delays = [bucket.reserve() for _ in range(5)]
+    assert delays[0] == 0 and delays[1] == 0
+    assert 0.09 < delays[2] < 0.11 and 0.29 < delays[4] < 0.31
+    print("✅ 令牌桶通过")
+
+
+def test_queue_timeout_and_sync_callers():
+    """排队超时报错并释放队列位置；同步线程与异步调用方共用名额"""
+    limiter = ProviderLimiter("test", LimitConfig(max_in_flight=1, queue_timeout=0.05))
+    limiter.acquire_sync()
+    try:
+        asyncio.run(limiter.acquire())
+        raise AssertionError("应当超时")
+    except RateLimitTimeout:
+        pass
+    assert limiter.stats()["queue_depth"] == 0 and limiter.stats()["timeouts"] == 1
+
+    limiter.config.queue_timeout = 5
+    acquired = threading.Event()
+
+    def worker():
+        limiter.acquire_sync()
+        acquired.set()
+        limiter.release()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    time.sleep(0.05)
+    assert not acquired.is_set()
+    limiter.release()
+    thread.join(timeout=1)
+    assert acquired.is_set() and limiter.in_flight == 0
+    print("✅ 排队超时 / 同步调用方通过")
+
+
+def test_config_precedence():
+    """模型级环境变量优先于 provider 级"""
+    os.environ["LIMIT_GRSAI_MAX_IN_FLIGHT"] = "7"
+    os.environ["LIMIT_GRSAI_NANO_BANANA_PRO_4K_VIP_MAX_IN_FLIGHT"] = "3"
+    try:
+        assert load_limit_config("grsai", "nano-banana-pro-4k-vip").max_in_flight == 3
+        assert load_limit_config("grsai", "nano-banana-fast").max_in_flight == 7
+        assert load_limit_config("replicate").max_in_flight == 4
+    finally:
+        del os.environ["LIMIT_GRSAI_MAX_IN_FLIGHT"]
+        del os.environ["LIMIT_GRSAI_NANO_BANANA_PRO_4K_VIP_MAX_IN_FLIGHT"]
+    print("✅ 配置优先级通过")
+
+
+if __name__ == "__main__":
+    test_max_in_flight_and_fifo()
+    test_token_bucket_rate()
+    test_queue_timeout_and_sync_callers()
+    test_config_precedence()
@@ -0,0 +1,167 @@
+"""
+测试生成结果缓存
+使用模拟上游，不需要 API Key
+
+运行:
+    cd backend
+    python tests/test_result_cache.py
+"""
+import os
+import sys
+import json
+import base64
+import asyncio
+import tempfile
+import threading
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import result_cache as result_cache_module
+from services.result_cache import ResultCache, content_digest
+from services.grsai_service import GrsaiNanoBananaService
+
+
+def _data_url(content: bytes) -> str:
+    return "data:image/png;base64," + base64.b64encode(content).decode()
+
+
+def test_key_uses_image_content():
+    """相同内容不同编码得到相同 key；返回方式字段不参与计算"""
+    payload = {"model": "nano-banana-pro", "prompt": "p", "imageSize": "4K", "urls": [_data_url(b"img")]}
+    key = ResultCache.make_key(payload)
+    unpadded = _data_url(b"img").rstrip("=")
+    assert key == ResultCache.make_key(dict(payload, urls=[unpadded], shutProgress=True, webHook="-1"))
+    assert key != ResultCache.make_key(dict(payload, urls=[_data_url(b"other")]))
+    assert key != ResultCache.make_key(dict(payload, imageSize="2K"))
+    print("✅ 内容寻址 key 通过")
+
+
+def test_digest_only_reads_own_static_files():
+    """只有相对路径和本服务域名的 /static/ URL 读取本地文件；.. 不能读出 static 目录"""
+    with tempfile.TemporaryDirectory() as tmp:
+        static_dir = os.path.join(tmp, "static")
+        os.makedirs(os.path.join(static_dir, "masks"))
+        with open(os.path.join(static_dir, "masks", "m.png"), "wb") as f:
+            f.write(b"mask")
+        with open(os.path.join(tmp, "secret.txt"), "wb") as f:
+            f.write(b"secret")
+
+        original = result_cache_module.STATIC_DIR
+        result_cache_module.STATIC_DIR = result_cache_module.Path(static_dir)
+        try:
+            local = content_digest("/static/masks/m.png")
+            assert local.startswith("sha256:")
+            assert content_digest("http://localhost:8000/static/masks/m.png") == local
+            foreign = "https://other.example.com/static/masks/m.png"
+            assert content_digest(foreign) == "url:" + foreign
+            for ref in ("/static/../secret.txt", "/static/masks/../../secret.txt"):
+                assert content_digest(ref) == "url:" + ref
+        finally:
+            result_cache_module.STATIC_DIR = original
+    print("✅ 本地文件范围限制通过")
+
+
+def test_ttl_and_byte_eviction():
+    """TTL 过期、内存层按字节 LRU 淘汰、磁盘层回填内存层"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "cache.db")
+        entry = {"images": ["x" * 100]}
+        size = len(json.dumps(entry))
+        cache = ResultCache(db_path=db_path, memory_max_bytes=size * 2, disk_max_bytes=size * 3)
+
+        for key in ("a", "b", "c"):
+            cache.put(key, entry)
+        assert cache.stats()["memory_entries"] == 2
+        assert cache.get("a") == entry  # 内存层已淘汰，磁盘层命中
+
+        cache.put("d", entry)
+        assert cache.stats()["disk_entries"] == 3
+        assert cache.stats()["disk_bytes"] <= size * 3
+
+        # 重启后磁盘层仍可命中
+        reopened = ResultCache(db_path=db_path)
+        assert reopened.get("d") == entry
+
+        expired = ResultCache(db_path=db_path, ttl=-1)
+        expired.put("e", entry)
+        assert expired.get("e") is None
+    print("✅ TTL / 字节上限淘汰通过")
+
+
+def test_generate_hits_cache():
+    """第二次相同请求不调用上游，返回 cache_hit 和节省的成本"""
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        body = json.dumps({"id": "t1", "status": "succeeded", "results": [{"url": "https://example.com/r.png", "content": ""}]})
+        return httpx.Response(200, text=body + "\n")
+
+    service = GrsaiNanoBananaService(
+        api_key="test",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        result_cache=ResultCache(),
+    )
+
+    async def run():
+        first = await service.generate("prompt", image_url=_data_url(b"room"), model="nano-banana-pro")
+        second = await service.generate("prompt", image_url=_data_url(b"room"), model="nano-banana-pro")
+        other = await service.generate("prompt", image_url=_data_url(b"room"), model="nano-banana-fast")
+        return first, second, other
+
+    first, second, other = asyncio.run(run())
+    assert first.success and not first.cache_hit
+    assert second.cache_hit and second.images == first.images
+    assert second.cost == 0 and second.saved_cost == first.cost
+    assert not other.cache_hit
+    assert len(calls) == 2
+    print("✅ generate 缓存命中通过")
+
+
+def test_generate_keeps_cache_off_event_loop():
+    """make_key / get / put（读文件、SQLite）不在事件循环线程上执行"""
+    threads = []
+
+    class RecordingCache(ResultCache):
+        def make_key(self, payload):
+            threads.append(threading.get_ident())
+            return super().make_key(payload)
+
+        def get(self, key):
+            threads.append(threading.get_ident())
+            return super().get(key)
+
+        def put(self, key, value):
+            threads.append(threading.get_ident())
+            super().put(key, value)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.dumps({"id": "t1", "status": "succeeded", "results": [{"url": "https://example.com/r.png", "content": ""}]})
+        return httpx.Response(200, text=body + "\n")
+
+    service = GrsaiNanoBananaService(
+        api_key="test",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        result_cache=RecordingCache(),
+    )
+
+    async def run():
+        loop_thread = threading.get_ident()
+        await service.generate("prompt", image_url=_data_url(b"room"), model="nano-banana-pro")
+        await service.generate("prompt", image_url=_data_url(b"room"), model="nano-banana-pro")
+        return loop_thread
+
+    loop_thread = asyncio.run(run())
+    assert len(threads) == 5  # 两次 make_key + get，一次 put
+    assert loop_thread not in threads
+    print("✅ 缓存读写不阻塞事件循环通过")
+
+
+if __name__ == "__main__":
+    test_key_uses_image_content()
+    test_digest_only_reads_own_static_files()
+    test_ttl_and_byte_eviction()
+    test_generate_hits_cache()
+    test_generate_keeps_cache_off_event_loop()
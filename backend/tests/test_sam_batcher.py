@@ -0,0 +1,115 @@
+"""
+测试 SAM 图像编码微批处理
+不需要模型和 API Key（用 sleep 模拟批量编码）
+
+运行:
+    cd backend
+    python tests/test_sam_batcher.py
+"""
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.sam_batcher import Histogram, MicroBatcher
+
+
+def _run_concurrently(batcher: MicroBatcher, items, stagger: float = 0.0):
+    results, errors = {}, {}
+
+    def call(item):
+        try:
+            results[item] = batcher.submit(item, timeout=5)
+        except Exception as e:
+            errors[item] = e
+
+    threads = []
+    for item in items:
+        thread = threading.Thread(target=call, args=(item,))
+        thread.start()
+        threads.append(thread)
+        time.sleep(stagger)
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_requests_share_a_batch():
+    """同时到达的请求合并成一批，结果按顺序分发回各自的调用方"""
+    batches = []
+
+    def encode(items):
+        batches.append(list(items))
+        time.sleep(0.05)  # 模拟一次批量前向
+        return [f"emb:{item}" for item in items]
+
+    batcher = MicroBatcher(encode, max_batch=4, max_wait_ms=50)
+    try:
+        results, errors = _run_concurrently(batcher, ["a", "b", "c", "d", "e"])
+    finally:
+        batcher.shutdown()
+    assert not errors
+    assert results == {item: f"emb:{item}" for item in "abcde"}
+    assert sorted(len(b) for b in batches) == [1, 4]
+    stats = batcher.stats()
+    assert stats["batches"] == 2 and stats["batch_size"]["buckets"]["le_4"] == 1
+    assert stats["queue_delay_ms"]["count"] == 5
+    print(f"✅ 合并批次通过 (batches={batches})")
+
+
+def test_wait_bounded_by_max_wait():
+    """凑不满时第一条请求最多等待 max_wait_ms"""
+    batcher = MicroBatcher(lambda items: items, max_batch=8, max_wait_ms=30)
+    try:
+        started = time.monotonic()
+        assert batcher.submit("only") == "only"
+        elapsed = time.monotonic() - started
+    finally:
+        batcher.shutdown()
+    assert 0.02 < elapsed < 0.5
+    assert batcher.stats()["queue_delay_ms"]["buckets"]["le_50"] == 1
+    print(f"✅ 最长等待通过 ({elapsed * 1000:.0f}ms)")
+
+
+def test_failure_propagates_to_whole_batch():
+    """批处理失败时同批的每个调用方都收到异常，之后的批次不受影响"""
+    calls = []
+
+    def flaky(items):
+        calls.append(len(items))
+        if len(calls) == 1:
+            raise RuntimeError("out of memory")
+        return items
+
+    batcher = MicroBatcher(flaky, max_batch=2, max_wait_ms=50)
+    try:
+        _, errors = _run_concurrently(batcher, ["a", "b"])
+        assert set(errors) == {"a", "b"} and all(isinstance(e, RuntimeError) for e in errors.values())
+        assert batcher.submit("c") == "c"
+    finally:
+        batcher.shutdown()
+    assert batcher.failures == 1
+    print("✅ 失败传播通过")
+
+
+def test_histogram_and_passthrough():
+    """max_batch=1 时在调用方线程直接执行；直方图按上界计数"""
+    histogram = Histogram([1, 5, 10])
+    for value in (0.5, 1, 3, 50):
+        histogram.observe(value)
+    assert histogram.snapshot()["buckets"] == {"le_1": 2, "le_5": 1, "le_10": 0, "le_inf": 1}
+
+    caller = []
+    batcher = MicroBatcher(lambda items: caller.append(threading.current_thread()) or items, max_batch=1)
+    assert batcher.submit("x") == "x"
+    assert caller == [threading.current_thread()] and batcher._thread is None
+    print("✅ 直方图 / 直通模式通过")
+
+
+if __name__ == "__main__":
+    test_concurrent_requests_share_a_batch()
+    test_wait_bounded_by_max_wait()
+    test_failure_propagates_to_whole_batch()
+    test_histogram_and_passthrough()
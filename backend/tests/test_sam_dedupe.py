@@ -0,0 +1,72 @@
+"""
+测试分割结果跨标签去重
+不需要模型和 API Key（用 numpy 构造检测结果）
+
+运行:
+    cd backend
+    python tests/test_sam_dedupe.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from services.compact_mask import CompactMask, pairwise_iou
+from services.local_sam_service import LocalSAMService, SegmentedObject
+
+
+def _box_mask(box, h=200, w=300) -> CompactMask:
+    mask = np.zeros((h, w), dtype=bool)
+    x0, y0, x1, y1 = box
+    mask[y0:y1, x0:x1] = True
+    return CompactMask.from_array(mask)
+
+
+def _detection(label, box, score) -> SegmentedObject:
+    return SegmentedObject(label=label, label_zh=label, mask=_box_mask(box), bbox=list(box), confidence=score)
+
+
+def test_pairwise_iou_matches_dense():
+    """打包位图上的 IoU 矩阵与 bool 数组逐对计算的结果一致"""
+    rng = np.random.default_rng(0)
+    dense = [rng.random((50, 77)) < p for p in (0.1, 0.3, 0.5, 0.05)]
+    dense.append(np.zeros((50, 77), dtype=bool))
+    iou = pairwise_iou([CompactMask.from_array(m) for m in dense])
+    for i, a in enumerate(dense):
+        for j, b in enumerate(dense):
+            union = (a | b).sum()
+            expected = 1.0 if i == j else ((a & b).sum() / union if union else 0.0)
+            assert abs(iou[i, j] - expected) < 1e-6, (i, j)
+    print("✅ IoU 矩阵通过")
+
+
+def test_duplicates_merged_across_labels():
+    """couch/sofa 重叠只保留得分最高的一个并合并标签；两把不重叠的椅子都保留；碎片丢弃"""
+    service = LocalSAMService()
+    candidates = [
+        _detection("sofa", (10, 10, 110, 80), 0.6),
+        _detection("couch", (12, 10, 110, 82), 0.9),
+        _detection("sofa", (10, 12, 108, 80), 0.5),
+        _detection("chair", (150, 20, 190, 70), 0.8),
+        _detection("chair", (200, 20, 240, 70), 0.7),
+        _detection("vase", (280, 190, 283, 193), 0.95),  # 9 像素，小于 0.05% × 60000
+    ]
+    kept = service._suppress_duplicates(candidates, iou_threshold=0.7, min_area_ratio=0.0005)
+    assert [(o.label, o.labels) for o in kept] == [
+        ("couch", ["couch", "sofa"]),
+        ("chair", ["chair"]),
+        ("chair", ["chair"]),
+    ]
+    assert kept[0].confidence == 0.9 and kept[0].mask_id == ""  # 去重发生在存储之前
+
+    # 阈值调高后部分重叠的不再合并
+    assert len(service._suppress_duplicates(candidates, iou_threshold=0.99, min_area_ratio=0)) == 6
+    assert service._suppress_duplicates([]) == []
+    print("✅ 跨标签去重通过")
+
+
+if __name__ == "__main__":
+    test_pairwise_iou_matches_dense()
+    test_duplicates_merged_across_labels()
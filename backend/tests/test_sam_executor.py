@@ -0,0 +1,134 @@
+"""
+测试 SAM 推理执行器
+不需要模型和 API Key（用 sleep 模拟推理）
+
+运行:
+    cd backend
+    python tests/test_sam_executor.py
+"""
+import os
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.sam_executor import InferenceExecutor, InferenceOverloaded
+
+
+def _inference(seconds: float, value=None):
+    time.sleep(seconds)  # 模拟阻塞的模型前向
+    return value
+
+
+def test_event_loop_stays_responsive():
+    """推理在专用线程执行，事件循环在推理期间继续调度"""
+    executor = InferenceExecutor(workers=1, max_queue=2, torch_threads=1)
+
+    async def run():
+        ticks = 0
+
+        async def heartbeat():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        beat = asyncio.create_task(heartbeat())
+        try:
+            result = await executor.run(_inference, 0.2, value="mask")
+        finally:
+            beat.cancel()
+        return result, ticks
+
+    try:
+        result, ticks = asyncio.run(run())
+    finally:
+        executor.shutdown()
+    assert result == "mask"
+    assert ticks >= 10
+    assert executor.completed == 1 and executor.service_seconds < 5.0
+    print(f"✅ 事件循环不阻塞通过 (ticks={ticks})")
+
+
+def test_overload_rejected_with_retry_after():
+    """执行中 + 排队达到上限后立即拒绝，并给出 Retry-After"""
+    executor = InferenceExecutor(workers=1, max_queue=1, torch_threads=1, initial_service_seconds=2.0)
+
+    async def run():
+        first = asyncio.create_task(executor.run(_inference, 0.2, value=1))
+        second = asyncio.create_task(executor.run(_inference, 0.01, value=2))
+        await asyncio.sleep(0.05)
+        assert executor.stats()["in_flight"] == 1 and executor.stats()["queued"] == 1
+        try:
+            await executor.run(_inference, 0, value=3)
+            raise AssertionError("应当抛出 InferenceOverloaded")
+        except InferenceOverloaded as e:
+            retry_after = e.retry_after
+        return await first, await second, retry_after
+
+    try:
+        first, second, retry_after = asyncio.run(run())
+    finally:
+        executor.shutdown()
+    assert (first, second) == (1, 2)
+    assert retry_after == 4  # 2 个请求 × 2 秒 / 1 个 worker
+    assert executor.rejected == 1 and executor.stats()["queued"] == 0
+    print(f"✅ 过载拒绝通过 (Retry-After={retry_after})")
+
+
+def test_failure_releases_slot():
+    """推理异常向调用方抛出，名额归还"""
+    executor = InferenceExecutor(workers=1, max_queue=0, torch_threads=1)
+
+    def broken():
+        raise RuntimeError("CUDA out of memory")
+
+    async def run():
+        try:
+            await executor.run(broken)
+        except RuntimeError:
+            pass
+        return await executor.run(_inference, 0, value="ok")
+
+    try:
+        assert asyncio.run(run()) == "ok"
+    finally:
+        executor.shutdown()
+    assert executor.failed == 1 and executor.completed == 1
+    print("✅ 异常归还名额通过")
+
+
+def test_cancelled_request_keeps_slot_until_inference_ends():
+    """等待的请求被取消时推理仍在执行，名额要到推理结束才释放，新请求仍被拒绝"""
+    executor = InferenceExecutor(workers=1, max_queue=0, torch_threads=1)
+
+    async def run():
+        task = asyncio.create_task(executor.run(_inference, 0.2, value=1))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        try:
+            await executor.run(_inference, 0, value=2)
+            raise AssertionError("应当抛出 InferenceOverloaded")
+        except InferenceOverloaded:
+            pass
+        await asyncio.sleep(0.25)
+        return await executor.run(_inference, 0, value=3)
+
+    try:
+        assert asyncio.run(run()) == 3
+    finally:
+        executor.shutdown()
+    assert executor.rejected == 1 and executor.stats()["in_flight"] == 0
+    print("✅ 取消后名额保留到推理结束通过")
+
+
+if __name__ == "__main__":
+    test_event_loop_stays_responsive()
+    test_overload_rejected_with_retry_after()
+    test_failure_releases_slot()
+    test_cancelled_request_keeps_slot_until_inference_ends()
@@ -0,0 +1,166 @@
+"""
+测试 SAM 3 ONNX 后端（动态 int8 量化）与 torch 后端的精度一致性
+需要本地 SAM 3 模型（transformers + torch）、onnxruntime 和导出好的 ONNX 模型，缺少任一项时标记为 skipped（不算通过）
+
+导出:
+    cd backend
+    python -m services.sam_onnx export
+
+运行:
+    cd backend
+    python tests/test_sam_onnx_parity.py
+"""
+import os
+import sys
+import base64
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+
+from services import local_sam_service
+from services.local_sam_service import LocalSAMService
+
+FIXTURE_DIR = Path(__file__).parent.parent / "test_images" / "input"
+LABELS = ["sofa", "chair", "table", "lamp", "rug", "plant"]
+
+# 动态 int8 量化允许的误差
+MIN_FEATURE_COSINE = 0.98
+MIN_MEAN_IOU = 0.85
+MIN_RECALL = 0.8
+
+_models = {}
+
+
+def _load_models() -> dict:
+    """加载 torch 与 onnx 两个后端（缺少依赖或导出文件时 pytest.skip）"""
+    if _models:
+        return _models
+    try:
+        import torch  # noqa: F401
+        import transformers  # noqa: F401
+        import onnxruntime  # noqa: F401
+    except ImportError as e:
+        pytest.skip(f"ONNX 精度测试需要 torch / transformers / onnxruntime，缺少 {e.name}")
+
+    from services.sam_onnx import MANIFEST, ONNX_DIR, OnnxSam3Model
+    if not (ONNX_DIR / MANIFEST).exists():
+        pytest.skip(f"{ONNX_DIR} 下没有导出结果（python -m services.sam_onnx export）")
+
+    service = LocalSAMService()
+    original_backend = local_sam_service.SAM_BACKEND
+    try:
+        local_sam_service.SAM_BACKEND = "torch"
+        local_sam_service._sam3_model = None
+        service._load_sam3_model()
+        _models["torch"] = local_sam_service._sam3_model
+    finally:
+        local_sam_service.SAM_BACKEND = original_backend
+    _models["onnx"] = OnnxSam3Model(ONNX_DIR)
+    return _models
+
+
+def _use(backend: str):
+    """切换全局模型，并清空图像特征缓存（避免两个后端共用特征）"""
+    from services.embedding_cache import sam_embedding_cache
+    local_sam_service._sam3_model = _models[backend]
+    sam_embedding_cache.clear()
+
+
+def _fixtures(limit: int = 3):
+    for path in sorted(FIXTURE_DIR.glob("*.jpg"))[:limit]:
+        yield path.name, base64.b64encode(path.read_bytes()).decode()
+
+
+def test_vision_features_close():
+    """图像编码器输出：逐个张量的余弦相似度"""
+    _load_models()
+    import torch
+    from services.sam_onnx import _flatten
+
+    service = LocalSAMService()
+    for name, image_base64 in _fixtures():
+        image, _ = service._load_work_image(image_base64=image_base64)
+        pixel_values = local_sam_service._sam3_processor(images=[image], return_tensors="pt")["pixel_values"]
+        with torch.no_grad():
+            reference, _ = _flatten(_models["torch"].get_vision_features(pixel_values=pixel_values.to(_models["torch"].device)))
+        candidate, _ = _flatten(_models["onnx"].get_vision_features(pixel_values=pixel_values))
+        assert len(reference) == len(candidate)
+        for a, b in zip(reference, candidate):
+            assert a.shape == b.shape, (name, a.shape, b.shape)
+            cosine = torch.nn.functional.cosine_similarity(a.cpu().flatten().float(), b.flatten().float(), dim=0).item()
+            assert cosine >= MIN_FEATURE_COSINE, (name, cosine)
+    print("✅ 图像特征一致")
+
+
+def test_segment_furniture_parity():
+    """文本提示分割：两个后端的检测结果逐个匹配"""
+    _load_models()
+    from services.mask_compositor import segmentation_compositor
+
+    original_dir = segmentation_compositor.output_dir
+    with tempfile.TemporaryDirectory() as output_dir:
+        segmentation_compositor.output_dir = Path(output_dir)  # 合成图不写进 static/masks
+        service = LocalSAMService(output_dir=output_dir)
+        try:
+            _compare_segment_furniture(service)
+        finally:
+            segmentation_compositor.output_dir = original_dir
+    print("✅ 文本提示分割一致")
+
+
+def _compare_segment_furniture(service: LocalSAMService):
+    """torch 的每个检测在 onnx 结果中找同标签 IoU 最高的匹配，统计召回和平均 IoU"""
+    for name, image_base64 in _fixtures():
+        results = {}
+        for backend in ("torch", "onnx"):
+            _use(backend)
+            result = service.segment_furniture(image_base64=image_base64, labels=LABELS)
+            assert result.success, result.error
+            results[backend] = result.objects
+
+        ious = []
+        for ref in results["torch"]:
+            same_label = [obj for obj in results["onnx"] if obj.label == ref.label]
+            ious.append(max((ref.mask.iou(obj.mask) for obj in same_label), default=0.0))
+        if not ious:
+            continue
+        recall = np.mean([iou >= 0.5 for iou in ious])
+        matched = [iou for iou in ious if iou >= 0.5]
+        print(f"   {name}: torch {len(results['torch'])} / onnx {len(results['onnx'])} 个物体, "
+              f"召回 {recall:.2f}, 平均 IoU {np.mean(matched) if matched else 0:.3f}")
+        assert recall >= MIN_RECALL, (name, recall)
+        assert np.mean(matched) >= MIN_MEAN_IOU, (name, matched)
+
+
+def test_segment_at_point_parity():
+    """框提示分割（点击）：两个后端选中的区域 IoU"""
+    _load_models()
+    with tempfile.TemporaryDirectory() as output_dir:
+        service = LocalSAMService(output_dir=output_dir)
+        for name, image_base64 in _fixtures():
+            _, source_size = service._load_work_image(image_base64=image_base64)
+            y, x = source_size[0] // 2, source_size[1] // 2
+            masks = {}
+            for backend in ("torch", "onnx"):
+                _use(backend)
+                result = service.segment_at_point(image_base64=image_base64, x=x, y=y)
+                assert result.success, result.error
+                masks[backend] = result.objects[0].mask if result.objects else None
+            if masks["torch"] is None:
+                continue
+            assert masks["onnx"] is not None, name
+            iou = masks["torch"].iou(masks["onnx"])
+            assert iou >= MIN_MEAN_IOU, (name, iou)
+    print("✅ 点击分割一致")
+
+
+if __name__ == "__main__":
+    for test in (test_vision_features_close, test_segment_furniture_parity, test_segment_at_point_parity):
+        try:
+            test()
+        except pytest.skip.Exception as e:
+            print(f"⚠️ 跳过 {test.__name__}: {e.msg}")
@@ -0,0 +1,97 @@
+"""
+测试分割工作分辨率：缩小推理、坐标换算、mask 按需放大
+不需要模型和 API Key
+
+运行:
+    cd backend
+    python tests/test_sam_work_resolution.py
+"""
+import io
+import os
+import sys
+import base64
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+from services import local_sam_service
+from services.compact_mask import CompactMask
+from services.local_sam_service import ImageEmbeddings, LocalSAMService
+from services.mask_store import MaskStore
+
+
+def _disk(h, w, cy, cx, r) -> np.ndarray:
+    yy, xx = np.mgrid[:h, :w]
+    return (yy - cy) ** 2 + (xx - cx) ** 2 <= r ** 2
+
+
+def test_load_work_image_and_coordinates():
+    """大图缩小到工作分辨率；框坐标换算回原图"""
+    buffer = io.BytesIO()
+    Image.new("RGB", (4000, 3000), (120, 110, 100)).save(buffer, format="JPEG")
+    image_base64 = base64.b64encode(buffer.getvalue()).decode()
+
+    service = LocalSAMService()
+    original = local_sam_service.WORK_SIZE
+    try:
+        local_sam_service.WORK_SIZE = 1024
+        image, source_size = service._load_work_image(image_base64=image_base64)
+        assert image.size == (1024, 768) and source_size == (3000, 4000)
+
+        local_sam_service.WORK_SIZE = 0
+        image, _ = service._load_work_image(image_base64=image_base64)
+        assert image.size == (4000, 3000)
+    finally:
+        local_sam_service.WORK_SIZE = original
+
+    embeddings = ImageEmbeddings(vision_embeds=None, original_sizes=[[768, 1024]], source_size=(3000, 4000))
+    sx, sy = embeddings.scale
+    assert abs(sx - 4000 / 1024) < 1e-9 and abs(sy - 3000 / 768) < 1e-9
+    assert embeddings.to_source_box([256, 192, 512, 384]) == [1000, 750, 2000, 1500]
+    assert ImageEmbeddings(vision_embeds=None, original_sizes=[[10, 20]]).scale == (1.0, 1.0)
+    print("✅ 工作分辨率 / 坐标换算通过")
+
+
+def test_upsample_smooth_and_local():
+    """按包围框局部放大：与原图分辨率的真实形状比最近邻更接近，框外保持为空"""
+    small = CompactMask.from_array(_disk(192, 256, 96, 128, 40))
+    truth = _disk(768, 1024, 384 + 1.5, 512 + 1.5, 160)
+
+    smooth = small.upsample(768, 1024).to_array()
+    nearest = small.resize(768, 1024).to_array()
+    assert (smooth != truth).sum() <= (nearest != truth).sum()
+    assert abs(smooth.sum() - truth.sum()) / truth.sum() < 0.03
+
+    box = small.upsample(768, 1024).bbox()
+    assert 340 <= box[0] and box[2] <= 690 and 210 <= box[1] and box[3] <= 560
+    assert CompactMask.empty(10, 10).upsample(40, 40).area() == 0
+    print("✅ 局部平滑放大通过")
+
+
+def test_store_full_resolution_on_demand():
+    """mask 按工作分辨率保存，size=full 时才放大到原图"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = MaskStore(tmp)
+        work = _disk(96, 128, 48, 64, 20)
+        mask_id = store.put(work, source_shape=(300, 400))
+        assert store.put(work) != mask_id  # 原图尺寸不同视为不同的 mask
+
+        reloaded = MaskStore(tmp)
+        assert reloaded.source_shape(mask_id) == (300, 400)
+        assert reloaded.get(mask_id).shape == (96, 128)
+        assert reloaded.get(mask_id, full=True).shape == (300, 400)
+
+        work_png, _ = reloaded.render(mask_id, "bw")
+        full_png, _ = reloaded.render(mask_id, "bw", full=True)
+        assert Image.open(io.BytesIO(work_png)).size == (128, 96)
+        assert Image.open(io.BytesIO(full_png)).size == (400, 300)
+    print("✅ 按需放大到原图通过")
+
+
+if __name__ == "__main__":
+    test_load_work_image_and_coordinates()
+    test_upsample_smooth_and_local()
+    test_store_full_resolution_on_demand()
@@ -0,0 +1,80 @@
+"""
+测试生成请求合并 (single-flight)
+不需要 API Key
+
+运行:
+    cd backend
+    python tests/test_single_flight.py
+"""
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.single_flight import SingleFlight
+from services.grsai_service import GrsaiNanoBananaService, GenerationResult
+
+
+def test_concurrent_duplicates_share_one_call():
+    """并发的相同 key 只执行一次，不同 key 各自执行"""
+    flights = SingleFlight()
+    calls = []
+
+    async def upstream(name):
+        calls.append(name)
+        await asyncio.sleep(0.05)
+        return GenerationResult(success=True, task_id=name, images=[f"{name}.png"])
+
+    async def run():
+        return await asyncio.gather(
+            flights.do("a", lambda: upstream("a"), member=1),
+            flights.do("a", lambda: upstream("a"), member=1),
+            flights.do("a", lambda: upstream("a"), member=2),
+            flights.do("b", lambda: upstream("b"), member=1),
+        )
+
+    outcomes = asyncio.run(run())
+    assert calls == ["a", "b"]
+    assert outcomes[0].value is outcomes[1].value is outcomes[2].value
+    assert [o.shared for o in outcomes] == [False, True, True, False]
+    assert [o.first_for_member for o in outcomes] == [True, False, True, True]
+    assert flights.stats()["in_flight"] == 0
+    print("✅ 相同请求合并通过")
+
+
+def test_errors_propagate_and_key_released():
+    """上游异常传给所有等待方，结束后 key 释放可重新调用"""
+    flights = SingleFlight()
+
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def run():
+        results = await asyncio.gather(flights.do("k", boom), flights.do("k", boom), return_exceptions=True)
+        again = await flights.do("k", lambda: asyncio.sleep(0, result="ok"))
+        return results, again
+
+    results, again = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert again.value == "ok" and not again.shared
+    print("✅ 异常传递通过")
+
+
+def test_request_key_is_canonical():
+    """key 由 _build_prompt 结果和参数决定，枚举与字符串等价"""
+    service = GrsaiNanoBananaService(api_key="test")
+    base = dict(prompt="装修客厅", image_url="https://example.com/a.jpg", style=None,
+                room_type=None, model="nano-banana-pro", image_size="4K", aspect_ratio="auto")
+    key = service.request_key(**base)
+    assert key == service.request_key(**dict(base, image_url=["https://example.com/a.jpg"]))
+    assert key != service.request_key(**dict(base, prompt="装修卧室"))
+    assert key != service.request_key(**dict(base, image_size="2K"))
+    print("✅ 规范化 key 通过")
+
+
+if __name__ == "__main__":
+    test_concurrent_duplicates_share_one_call()
+    test_errors_propagate_and_key_released()
+    test_request_key_is_canonical()
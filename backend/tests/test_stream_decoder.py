@@ -0,0 +1,145 @@
+"""
+测试 Grsai 流式响应解码器 + 微基准
+不需要 API Key
+
+运行:
+    cd backend
+    python tests/test_stream_decoder.py
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.stream_decoder import GrsaiStreamDecoder
+
+
+def make_progress_stream(frames: int = 500, sse: bool = False, status: str = "succeeded") -> list:
+    """构造 frames 帧进度 + 1 帧终态的模拟响应"""
+    lines = []
+    for i in range(frames):
+        frame = {
+            "id": "task-bench",
+            "progress": i * 100 // frames,
+            "status": "running",
+            "results": [],
+            "failure_reason": "",
+            "error": "",
+        }
+        lines.append(json.dumps(frame))
+    final = {
+        "id": "task-bench",
+        "progress": 100,
+        "status": status,
+        "results": [{"url": "https://example.com/result.png", "content": "ok"}],
+        "failure_reason": "",
+        "error": "upstream error" if status == "failed" else "",
+    }
+    lines.append(json.dumps(final))
+    if sse:
+        lines = [f"data: {line}" for line in lines]
+    return lines
+
+
+async def _aiter(lines):
+    for line in lines:
+        yield line
+
+
+def test_decode_ndjson_and_sse():
+    """NDJSON 和 SSE 两种分帧都能拿到终态"""
+    for sse in (False, True):
+        lines = make_progress_stream(20, sse=sse)
+        lines.insert(3, "")
+        lines.insert(5, ": keep-alive")
+        lines.append("data: [DONE]")
+        result = asyncio.run(GrsaiStreamDecoder().read_terminal(_aiter(lines)))
+        assert result["status"] == "succeeded"
+        assert result["results"][0]["url"] == "https://example.com/result.png"
+    print("✅ NDJSON / SSE 解码通过")
+
+
+def test_failed_and_missing_terminal():
+    """失败帧抛出上游错误，流结束无结果时报告行数"""
+    lines = make_progress_stream(5, status="failed")
+    try:
+        asyncio.run(GrsaiStreamDecoder().read_terminal(_aiter(lines)))
+        raise AssertionError("应当抛出异常")
+    except Exception as e:
+        assert str(e) == "upstream error"
+
+    decoder = GrsaiStreamDecoder(history_size=3)
+    try:
+        asyncio.run(decoder.read_terminal(_aiter(make_progress_stream(10)[:-1])))
+        raise AssertionError("应当抛出异常")
+    except Exception as e:
+        assert "Lines: 10" in str(e)
+    assert len(decoder.tail()) == 3
+    print("✅ 失败 / 无结果处理通过")
+
+
+def test_terminal_only_skips_progress_frames():
+    """只要终态时中间帧不做 JSON 解析"""
+    decoder = GrsaiStreamDecoder()
+    asyncio.run(decoder.read_terminal(_aiter(make_progress_stream(500))))
+    assert decoder.frames_seen == 501
+    assert decoder.frames_parsed == 1
+
+    frames = []
+
+    async def collect():
+        async for data in GrsaiStreamDecoder().iter_frames(_aiter(make_progress_stream(50, sse=True))):
+            frames.append(data)
+
+    asyncio.run(collect())
+    assert len(frames) == 51
+    print("✅ 跳过中间帧通过")
+
+
+def test_benchmark_500_frames(rounds: int = 200):
+    """微基准：500 帧进度流，对比逐行 json.loads 与解码器"""
+    lines = make_progress_stream(500, sse=True)
+
+    async def naive():
+        final = None
+        async for line in _aiter(lines):
+            if line.strip():
+                json_str = line[6:] if line.startswith("data: ") else line
+                try:
+                    data = json.loads(json_str)
+                    if data.get("status") == "succeeded":
+                        final = data
+                        break
+                except json.JSONDecodeError:
+                    continue
+        return final
+
+    async def decoded():
+        return await GrsaiStreamDecoder().read_terminal(_aiter(lines))
+
+    async def bench(fn):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            result = await fn()
+        return (time.perf_counter() - start) / rounds * 1000, result
+
+    naive_ms, naive_result = asyncio.run(bench(naive))
+    decoder_ms, decoder_result = asyncio.run(bench(decoded))
+    assert naive_result == decoder_result
+
+    print("=" * 50)
+    print(f"📊 500 帧进度流 ({rounds} 轮平均)")
+    print(f"   逐行 json.loads: {naive_ms:.3f} ms")
+    print(f"   GrsaiStreamDecoder: {decoder_ms:.3f} ms")
+    print(f"   加速: {naive_ms / decoder_ms:.1f}x")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    test_decode_ndjson_and_sse()
+    test_failed_and_missing_terminal()
+    test_terminal_only_skips_progress_frames()
+    test_benchmark_500_frames()
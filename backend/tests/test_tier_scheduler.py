@@ -0,0 +1,99 @@
+"""
+测试会员等级优先调度
+不需要 API Key
+
+运行:
+    cd backend
+    python tests/test_tier_scheduler.py
+"""
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.tier_scheduler import SchedulerTimeout, TierConfig, TierScheduler
+
+
+TIERS = {
+    "free": TierConfig(weight=1, reserved=0),
+    "designer": TierConfig(weight=4, reserved=1),
+}
+
+
+def test_reserved_slot_during_free_burst():
+    """免费用户突发占满共享池，付费用户仍立即获得预留名额"""
+    async def run():
+        scheduler = TierScheduler(capacity=3, tiers=TIERS)
+        free = [scheduler.enqueue("free") for _ in range(10)]
+        assert sum(t.granted for t in free) == 2  # 共享池 = 3 - 1
+        designer = scheduler.enqueue("designer")
+        assert designer.granted
+        assert scheduler.position(free[2]) == 1 and scheduler.position(free[9]) == 8
+        assert scheduler.eta(free[9]) > scheduler.eta(free[2]) > 0
+
+        second = scheduler.enqueue("designer")
+        assert not second.granted  # 预留已用完，共享池也满
+        scheduler.release(free[0])
+        assert second.granted  # 空出的共享名额优先给权重高的 designer
+        return scheduler.stats()
+
+    stats = asyncio.run(run())
+    assert stats["tiers"]["free"]["queued"] == 8 and stats["tiers"]["designer"]["in_flight"] == 2
+    print("✅ 预留名额通过")
+
+
+def test_weighted_fair_order():
+    """两个等级都积压时按 4:1 的比例放行"""
+    async def run():
+        scheduler = TierScheduler(capacity=1, tiers={"free": TierConfig(1), "designer": TierConfig(4)})
+        running = scheduler.enqueue("free")
+        tickets = [scheduler.enqueue("free") for _ in range(10)] + [scheduler.enqueue("designer") for _ in range(10)]
+        order = []
+        current = running
+        for _ in range(10):
+            scheduler.release(current)
+            current = next(t for t in tickets if t.granted)
+            order.append(current.tier)
+            tickets.remove(current)
+        return order
+
+    order = asyncio.run(run())
+    assert order.count("designer") in (8, 9) and order.count("free") >= 1
+    print(f"✅ 加权公平通过 ({''.join(t[0] for t in order)})")
+
+
+def test_starvation_and_timeout():
+    """等待过久的免费请求优先放行；排队超时抛出 SchedulerTimeout 并离开队列"""
+    async def run():
+        scheduler = TierScheduler(
+            capacity=1, tiers={"free": TierConfig(1), "designer": TierConfig(100)},
+            starvation_seconds=0.05, queue_timeout=0.2,
+        )
+        running = scheduler.enqueue("designer")
+        starving = scheduler.enqueue("free")
+        await asyncio.sleep(0.06)
+        designer = scheduler.enqueue("designer")
+        scheduler.release(running)
+        assert starving.granted and not designer.granted
+
+        try:
+            async with scheduler.slot("free"):
+                raise AssertionError("不应获得名额")
+        except SchedulerTimeout:
+            pass
+        assert scheduler.stats()["tiers"]["free"]["queued"] == 0
+
+        scheduler.release(starving)
+        assert await scheduler.wait(designer, timeout=0.01)
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert scheduler.aged_grants >= 1 and scheduler.timeouts == 1
+    print("✅ 防饿死 / 排队超时通过")
+
+
+if __name__ == "__main__":
+    test_reserved_slot_during_free_burst()
+    test_weighted_fair_order()
+    test_starvation_and_timeout()
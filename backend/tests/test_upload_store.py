@@ -0,0 +1,74 @@
+"""
+测试内容寻址上传存储
+不需要 API Key
+
+运行:
+    cd backend
+    python tests/test_upload_store.py
+"""
+import os
+import sys
+import asyncio
+import hashlib
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.upload_store import UnsupportedImage, UploadStore, UploadTooLarge
+from services.result_cache import content_digest
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+JPEG = b"\xff\xd8\xff\xe0" + b"\x11" * 3000
+
+
+async def _chunks(data: bytes, size: int = 1000):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def test_dedupe_and_sniff():
+    """相同内容只存一份；格式按文件头识别"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = UploadStore(tmp)
+
+        async def run():
+            first = await store.save(_chunks(JPEG))
+            second = await store.save(_chunks(JPEG, size=7))
+            png = await store.save(_chunks(PNG))
+            return first, second, png
+
+        first, second, png = asyncio.run(run())
+        assert first.filename == f"{hashlib.sha256(JPEG).hexdigest()}.jpg"
+        assert first.content_type == "image/jpeg" and not first.duplicate
+        assert second.filename == first.filename and second.duplicate
+        assert png.filename.endswith(".png") and png.size == len(PNG)
+        assert sorted(os.listdir(tmp)) == sorted([first.filename, png.filename])
+        assert store.stats()["bytes_saved"] == len(JPEG)
+    print("✅ 去重 / 格式识别通过")
+
+
+def test_rejects_oversize_and_non_images():
+    """超过上限或不是图片时中止，不留下临时文件"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = UploadStore(tmp, max_bytes=2000)
+        for data, error in ((JPEG, UploadTooLarge), (b"<html>" + b"x" * 100, UnsupportedImage), (b"GIF", UnsupportedImage)):
+            try:
+                asyncio.run(store.save(_chunks(data)))
+                raise AssertionError(f"应当抛出 {error.__name__}")
+            except error:
+                pass
+        assert os.listdir(tmp) == []
+    print("✅ 大小上限 / 非图片拒绝通过")
+
+
+def test_cache_digest_from_filename():
+    """结果缓存直接用上传文件名作为内容哈希，与 data: URL 的哈希一致"""
+    sha = hashlib.sha256(PNG).hexdigest()
+    assert content_digest(f"http://localhost:8000/static/uploads/{sha}.png") == "sha256:" + sha
+    print("✅ 缓存内容哈希通过")
+
+
+if __name__ == "__main__":
+    test_dedupe_and_sniff()
+    test_rejects_oversize_and_non_images()
+    test_cache_digest_from_filename()
@@ -371,6 +371,7 @@ export default function HomePage() {
     workImages,
     selectedImageId,
     segmentsCache,
+    combinedMaskCache,
     selectedStyle,
     editMode,
     prompt,
@@ -1297,9 +1298,10 @@ export default function HomePage() {
                     imageUrl={selectedImage.url}
                     imageBase64={selectedImage.base64}
                     cachedSegments={segmentsCache[selectedImage.id]}
-                    onSegmentsLoaded={(segments) => {
-                      // 缓存识别结果
-                      storeSetSegmentsCache(selectedImage.id, segments)
+                    cachedCombinedMaskUrl={combinedMaskCache[selectedImage.id]}
+                    onSegmentsLoaded={(segments, combinedMaskUrl) => {
+                      // 缓存识别结果（连同合成 mask）
+                      storeSetSegmentsCache(selectedImage.id, segments, combinedMaskUrl)
                     }}
                     onSegmentSelect={(segment, maskUrl) => {
                       // 多选模式：添加或移除
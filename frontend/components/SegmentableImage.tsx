@@ -18,8 +18,9 @@ interface SegmentableImageProps {
   imageUrl: string
   imageBase64?: string  // 用于 API 调用
   cachedSegments?: SegmentedObject[]  // 缓存的识别结果
+  cachedCombinedMaskUrl?: string | null  // 缓存的合成 mask
   onSegmentSelect?: (segment: SegmentedObject, maskUrl: string) => void
-  onSegmentsLoaded?: (segments: SegmentedObject[]) => void  // 识别完成回调
+  onSegmentsLoaded?: (segments: SegmentedObject[], combinedMaskUrl: string | null) => void  // 识别完成回调
   onPointClick?: (x: number, y: number) => void
   className?: string
 }
@@ -28,6 +29,7 @@ export default function SegmentableImage({
   imageUrl,
   imageBase64,
   cachedSegments,
+  cachedCombinedMaskUrl,
   onSegmentSelect,
   onSegmentsLoaded,
   onPointClick,
@@ -43,6 +45,7 @@ export default function SegmentableImage({
     if (cachedSegments && cachedSegments.length > 0) {
       console.log('[SegmentableImage] 使用缓存的识别结果:', cachedSegments.length, '个物体')
       setSegments(cachedSegments)
+      setCombinedMaskUrl(cachedCombinedMaskUrl || null)
       setIsSegmented(true)
       // 保留已选择的物品（如果仍在缓存中）
       setSelectedSegments(prev => {
@@ -54,10 +57,12 @@ export default function SegmentableImage({
       console.log('[SegmentableImage] 无缓存，重置状态')
       setSegments([])
       setSelectedSegments([])
+      setCombinedMaskUrl(null)
       setIsSegmented(false)
     }
-  }, [cachedSegments, imageUrl])
+  }, [cachedSegments, cachedCombinedMaskUrl, imageUrl])
   const [hoveredSegment, setHoveredSegment] = useState<string | null>(null)
+  const [combinedMaskUrl, setCombinedMaskUrl] = useState<string | null>(null)  // 所有物体合成的一张 mask
   const [error, setError] = useState<string | null>(null)
   const [loadingProgress, setLoadingProgress] = useState(0)
   const [loadingStage, setLoadingStage] = useState('')
@@ -117,9 +122,10 @@ export default function SegmentableImage({
         await new Promise(r => setTimeout(r, 500)) // 短暂显示完成状态
         console.log('设置segments:', data.objects.length, '个物体')
         setSegments(data.objects)
+        setCombinedMaskUrl(data.combined_mask_url || null)
         setIsSegmented(true)
         // 回调通知父组件缓存结果
-        onSegmentsLoaded?.(data.objects)
+        onSegmentsLoaded?.(data.objects, data.combined_mask_url || null)
       } else {
         setError(data.error || '分割服务暂不可用')
       }
@@ -156,6 +162,7 @@ export default function SegmentableImage({
   const handleReset = () => {
     setSegments([])
     setSelectedSegments([])
+    setCombinedMaskUrl(null)
     setIsSegmented(false)
     setError(null)
   }
@@ -197,7 +204,20 @@ export default function SegmentableImage({
           className="w-full h-full object-contain"
         />
         
-        {/* Mask 蒙版叠加层 - 只显示选中或悬停的 */}
+        {/* 合并 mask - 没有悬停/选中时一张图显示全部识别结果 */}
+        {isSegmented && combinedMaskUrl && (
+          <img
+            src={combinedMaskUrl}
+            alt=""
+            className="absolute inset-0 w-full h-full object-contain pointer-events-none"
+            style={{
+              opacity: hoveredSegment || selectedSegments.length > 0 ? 0 : 0.5,
+              transition: 'opacity 0.15s ease-out',
+            }}
+          />
+        )}
+
+        {/* Mask 蒙版叠加层 - 只显示选中或悬停的（单个 mask 在需要显示时才加载） */}
         <AnimatePresence>
           {isSegmented && segments.map((segment, index) => {
             const segmentKey = `${segment.label}-${segment.bbox?.join(',')}`
@@ -217,15 +237,14 @@ export default function SegmentableImage({
               {segment.mask_url && (
                 <>
                   {/* 显示的 mask 图片 */}
-                  <img
-                    src={segment.mask_url}
-                    alt=""
-                    className="absolute inset-0 w-full h-full object-contain pointer-events-none"
-                    style={{
-                      opacity: shouldShow ? 0.7 : 0,
-                      transition: 'opacity 0.15s ease-out',
-                    }}
-                  />
+                  {shouldShow && (
+                    <img
+                      src={segment.mask_url}
+                      alt=""
+                      className="absolute inset-0 w-full h-full object-contain pointer-events-none"
+                      style={{ opacity: 0.7 }}
+                    />
+                  )}
                   {/* 透明的可点击区域 - 基于 bbox */}
                   {segment.bbox?.length === 4 && (
                     <div
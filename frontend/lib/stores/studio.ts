@@ -32,6 +32,7 @@ interface StudioState {
   workImages: DesignImage[]
   selectedImageId: string | null
   segmentsCache: Record<string, SegmentInfo[]>
+  combinedMaskCache: Record<string, string>  // 每张图片的合成 mask URL，随识别结果一起缓存
   selectedSegmentIds: string[]
   selectedStyle: number
   editMode: 'full' | 'segment'
@@ -64,7 +65,7 @@ interface StudioState {
   setWorkImages: (images: DesignImage[]) => void
   addWorkImage: (image: DesignImage) => void
   setSelectedImageId: (id: string | null) => void
-  setSegmentsCache: (imageId: string, segments: SegmentInfo[]) => void
+  setSegmentsCache: (imageId: string, segments: SegmentInfo[], combinedMaskUrl?: string | null) => void
   setSelectedSegmentIds: (ids: string[]) => void
   setSelectedStyle: (index: number) => void
   setEditMode: (mode: 'full' | 'segment') => void
@@ -85,6 +86,7 @@ const initialState = {
   workImages: [] as DesignImage[],
   selectedImageId: null as string | null,
   segmentsCache: {} as Record<string, SegmentInfo[]>,
+  combinedMaskCache: {} as Record<string, string>,
   selectedSegmentIds: [] as string[],
   selectedStyle: 0,
   editMode: 'full' as const,
@@ -134,9 +136,13 @@ export const useStudioStore = create<StudioState>()(
     selectedImageId: image.id
   })),
   setSelectedImageId: (id) => set({ selectedImageId: id }),
-  setSegmentsCache: (imageId, segments) => set((state) => ({
-    segmentsCache: { ...state.segmentsCache, [imageId]: segments }
-  })),
+  setSegmentsCache: (imageId, segments, combinedMaskUrl) => set((state) => {
+    const { [imageId]: _, ...combinedMaskCache } = state.combinedMaskCache
+    return {
+      segmentsCache: { ...state.segmentsCache, [imageId]: segments },
+      combinedMaskCache: combinedMaskUrl ? { ...combinedMaskCache, [imageId]: combinedMaskUrl } : combinedMaskCache,
+    }
+  }),
   setSelectedSegmentIds: (ids) => set({ selectedSegmentIds: ids }),
   setSelectedStyle: (index) => set({ selectedStyle: index }),
   setEditMode: (mode) => set({ editMode: mode }),
@@ -161,6 +167,7 @@ export const useStudioStore = create<StudioState>()(
             v.map(seg => ({ ...seg, inpaint_mask_base64: undefined }))
           ])
         ),
+        combinedMaskCache: state.combinedMaskCache,
         selectedStyle: state.selectedStyle,
         editMode: state.editMode,
         prompt: state.prompt,
@@ -25,6 +25,10 @@ const nextConfig = {
         source: '/static/:path*',
         destination: 'http://localhost:8000/static/:path*',
       },
+      {
+        source: '/api/v1/masks/:path*',
+        destination: 'http://localhost:8000/api/v1/masks/:path*',
+      },
     ]
   },
 }